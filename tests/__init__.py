@@ -4,6 +4,7 @@ monkey.patch_all()
 
 import mock
 import unittest
+from contextlib import contextmanager
 
 from flask import json
 from flask_principal import identity_changed
@@ -13,6 +14,7 @@ from imgurpython import ImgurClient
 from requests import Session
 
 from parse_rest.query import QueryManager as ParseUserQuery
+from pymongo.collection import Collection
 from parse_rest.user import User as ParseUser
 from twilio.rest import Messages
 from werkzeug.datastructures import Headers
@@ -511,6 +513,47 @@ class BaseTestCase(unittest.TestCase):
         """Turns off doctstrings in verbose output"""
         return None
 
+    @contextmanager
+    def assertFetchesOnly(self, document_class, *field_names):
+        """Asserts that queries only fetch the given fields of a document
+
+        Every find on the document's collection inside the block must have a
+        projection limited to the named fields. This keeps hot queries from
+        silently going back to loading whole documents.
+        """
+        collection_name = document_class._get_collection_name()
+        allowed = set(['_id', '_cls'])
+        for field_name in field_names:
+            allowed.add(document_class._fields[field_name].db_field)
+
+        projections = []
+        find = Collection.find
+
+        def spy_find(collection, *args, **kwargs):
+            if collection.name == collection_name:
+                projection = kwargs.get('fields')
+                if projection is None and len(args) > 1:
+                    projection = args[1]
+                projections.append(projection)
+            return find(collection, *args, **kwargs)
+
+        with mock.patch.object(Collection, 'find', spy_find):
+            yield
+
+        self.assertTrue(projections, 'No query on %s' % collection_name)
+        for projection in projections:
+            self.assertTrue(projection,
+                            'Query on %s fetched every field' % collection_name)
+            if isinstance(projection, dict):
+                self.assertTrue(all(projection.values()),
+                                'Query on %s excluded fields instead of '
+                                'selecting them' % collection_name)
+            fetched = set(projection)
+            self.assertLessEqual(fetched, allowed,
+                                 'Query on %s fetched %s' % (
+                                     collection_name,
+                                     ', '.join(sorted(fetched - allowed))))
+
     def jsonpost(self, *args, **kwargs):
         """Convenience method for making JSON POST requests."""
         kwargs.setdefault('content_type', 'application/json')
@@ -12,9 +12,13 @@ from yoapi import jwt
 
 from twilio.rest import Messages
 
-from yoapi.accounts import update_user, get_user
+from yoapi.accounts import (update_user, get_user, get_users_by_ids,
+                           get_users_by_usernames, get_user_id_by_api_token,
+                           get_user_id_by_access_token, revoke_access_tokens,
+                           UserActivityBatch)
 from yoapi.core import redis
 from yoapi.models import User
+from yoapi.models.oauth import Token
 from yoapi.services import low_rq, high_rq
 
 from yoapi.extensions.flask_sendgrid import SendGridClient
@@ -1021,3 +1025,116 @@ class AccountTestCase(BaseTestCase):
         '''
 
     # TODO, create a local admin user to add admin based tests
+
+    def test_31_get_users_by_usernames(self):
+        # Test that users are resolved in bulk from the cache and the
+        # database with a single query for the misses.
+        get_user(username=self._user2.username)
+
+        usernames = [self._user2.username, self._user3.username.lower(),
+                     self._user3.username, 'NOSUCHUSER']
+        with mock.patch.object(User, 'objects',
+                               wraps=User.objects) as objects_mock:
+            users = get_users_by_usernames(usernames)
+        self.assertEquals(objects_mock.call_count, 1)
+        self.assertEquals(sorted(users.keys()),
+                          [self._user2.username, self._user3.username])
+        self.assertEquals(users[self._user3.username].user_id,
+                          self._user3.user_id)
+
+        # The misses were written back to the cache.
+        with mock.patch.object(User, 'objects',
+                               wraps=User.objects) as objects_mock:
+            users = get_users_by_usernames(usernames[:3])
+        self.assertEquals(objects_mock.call_count, 0)
+        self.assertEquals(len(users), 2)
+
+        users = get_users_by_ids([self._user2.user_id, self._user3.user_id],
+                                 ignore_permission=True)
+        self.assertEquals(users[self._user2.user_id].username,
+                          self._user2.username)
+
+    def test_32_cached_token_identities(self):
+        # Test that tokens resolve to users from the cache and stop
+        # resolving as soon as they are revoked.
+        token = Token(access_token='AbCdEfGhIjKlMnOpQrStUvWxYz0123',
+                      user=self._user1).save()
+
+        user_id = get_user_id_by_access_token(token.access_token.upper())
+        self.assertEquals(user_id, self._user1.user_id)
+
+        # Tokens posted in the body must match exactly.
+        self.assertIsNone(get_user_id_by_access_token(
+            token.access_token.upper(), exact=True))
+        self.assertEquals(get_user_id_by_access_token(token.access_token,
+                                                      exact=True),
+                          self._user1.user_id)
+        self.assertIsNone(get_user_id_by_access_token(None))
+        res = self.jsonpost('/rpc/get_me', auth=False,
+                            data={'access_token': None})
+        self.assertEquals(res.status_code, 401)
+
+        with mock.patch.object(Token, 'objects',
+                               wraps=Token.objects) as objects_mock:
+            user_id = get_user_id_by_access_token(token.access_token)
+        self.assertEquals(objects_mock.call_count, 0)
+        self.assertEquals(user_id, self._user1.user_id)
+
+        # Tokens saved before the lower cased copy are still found and
+        # backfilled.
+        old_token = Token(access_token='ZyXwVuTsRqPoNmLkJiHgFeDcBa9876',
+                          user=self._user2).save()
+        Token.objects(id=old_token.id).update(unset__access_token_lower=True)
+        with mock.patch('yoapi.accounts._unlowered_access_tokens', [True]):
+            user_id = get_user_id_by_access_token(
+                old_token.access_token.lower())
+        self.assertEquals(user_id, self._user2.user_id)
+        self.assertEquals(
+            Token.objects(id=old_token.id).first().access_token_lower,
+            old_token.access_token.lower())
+
+        revoke_access_tokens([token])
+        self.assertIsNone(get_user_id_by_access_token(token.access_token))
+        self.assertIsNone(get_user_id_by_access_token(token.access_token,
+                                                      exact=True))
+
+        update_user(self._user1, api_token='first-api-token',
+                    ignore_permission=True)
+        self.assertEquals(get_user_id_by_api_token('first-api-token'),
+                          self._user1.user_id)
+
+        # Rotating the api token revokes the old one.
+        update_user(self._user1, api_token='second-api-token',
+                    ignore_permission=True)
+        self.assertIsNone(get_user_id_by_api_token('first-api-token'))
+        self.assertEquals(get_user_id_by_api_token('second-api-token'),
+                          self._user1.user_id)
+
+    def test_33_user_activity_batch(self):
+        # Test that counters and timestamps are merged per user, written in
+        # one go and not served stale from the cache afterwards.
+        get_user(user_id=self._user2.user_id)
+        count_in = self._user2.count_in or 0
+
+        batch = UserActivityBatch()
+        batch.add(self._user2, counters={'count_in': 1})
+        batch.add(self._user2, last_yo_time=1, last_received_time=2)
+        batch.add(self._user3, last_yo_time=3)
+        batch.add(self._user2, counters={'count_in': 1})
+        self.assertEquals(len(batch.updates), 2)
+        batch.flush()
+        self.assertEquals(len(batch.updates), 0)
+
+        user = get_user(user_id=self._user2.user_id)
+        self.assertEquals(user.count_in, count_in + 2)
+        self.assertEquals(user.last_yo_time, 1)
+        self.assertEquals(user.last_received_time, 2)
+        user = get_user(user_id=self._user3.user_id)
+        self.assertEquals(user.last_yo_time, 3)
+
+        # Full batches are written right away.
+        batch = UserActivityBatch(size=1)
+        batch.add(self._user3, last_yo_time=4)
+        self.assertEquals(len(batch.updates), 0)
+        self.assertEquals(get_user(user_id=self._user3.user_id).last_yo_time,
+                          4)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks broadcasting to an account with a huge audience.
+
+These take several minutes against a local mongod so they only run when
+YOAPI_BENCHMARKS is set.
+"""
+
+import os
+import resource
+import time
+from itertools import chain
+from unittest import skipUnless
+
+from bson import ObjectId
+
+from . import BaseTestCase
+from yoapi.contacts import iter_follower_ids
+from yoapi.helpers import get_usec_timestamp
+from yoapi.models import Contact, User, Yo
+from yoapi.yos.helpers import _create_child_yos
+from yoapi.yos.queries import iter_child_yo_recipient_ids
+
+FOLLOWER_COUNT = int(os.environ.get('YOAPI_BENCHMARK_FOLLOWERS', 1000000))
+INSERT_CHUNK_SIZE = 10000
+
+# Loading every child of a 1M follower broadcast took several gigabytes.
+MAX_RSS_GROWTH_KB = 256 * 1024
+
+
+def _get_max_rss():
+    """Returns the peak resident memory of this process in kilobytes"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@skipUnless(os.environ.get('YOAPI_BENCHMARKS'), 'Set YOAPI_BENCHMARKS')
+class BigBroadcastTestCase(BaseTestCase):
+
+    """Test case for broadcasting to a very large number of followers"""
+
+    def setUp(self):
+        super(BigBroadcastTestCase, self).setUp()
+        # Followers are written directly instead of being created through
+        # the API. Owners without a user document aren't followers so a
+        # bare user is inserted for each of them.
+        contacts = Contact._get_collection()
+        users = User._get_collection()
+        created = get_usec_timestamp()
+        for start in xrange(0, FOLLOWER_COUNT, INSERT_CHUNK_SIZE):
+            end = min(start + INSERT_CHUNK_SIZE, FOLLOWER_COUNT)
+            owner_ids = [ObjectId() for _ in xrange(start, end)]
+            users.insert([{'_id': owner_id,
+                           'username': 'FOLLOWER%s' % (start + i)}
+                          for i, owner_id in enumerate(owner_ids)])
+            contacts.insert([{'owner': owner_id,
+                              'target': self._user1.pk,
+                              'created': created + start + i}
+                             for i, owner_id in enumerate(owner_ids)])
+
+    def test_01_stream_broadcast(self):
+        """Make sure memory stays bounded while broadcasting"""
+        yo = Yo(sender=self._user1, broadcast=True)
+        yo.save()
+        start_rss = _get_max_rss()
+
+        start_time = time.time()
+        recipient_ids = chain.from_iterable(iter_follower_ids(self._user1))
+        recipient_count = _create_child_yos(yo, recipient_ids)
+        create_duration = time.time() - start_time
+        self.assertEquals(recipient_count, FOLLOWER_COUNT)
+
+        start_time = time.time()
+        read_count = 0
+        for chunk in iter_child_yo_recipient_ids(yo.yo_id):
+            read_count += len(chunk)
+        read_duration = time.time() - start_time
+        self.assertEquals(read_count, FOLLOWER_COUNT)
+
+        rss_growth = _get_max_rss() - start_rss
+        print ('\n%s followers: created children in %.1fs, read them back '
+               'in %.1fs, peak memory grew by %s MB' % (
+                   FOLLOWER_COUNT, create_duration, read_duration,
+                   rss_growth / 1024))
+        self.assertLess(rss_growth, MAX_RSS_GROWTH_KB)
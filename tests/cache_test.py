@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""Tests for the cache backends."""
+
+import cPickle as pickle
+import os
+import time
+from unittest import skipUnless
+
+import gevent
+import mock
+from redis.exceptions import ResponseError
+from werkzeug.contrib.cache import RedisCache
+
+from . import BaseTestCase
+
+from yoapi.accounts import _get_user, update_user
+from yoapi.core import cache
+from yoapi.extensions import cache_serializer
+from yoapi.extensions.local_cache import TwoTierCache
+from yoapi.models import Yo
+from yoapi.yos.queries import get_yo_by_id
+
+
+class LocalCacheTestCase(BaseTestCase):
+
+    def _start_tier(self, remote):
+        tier = TwoTierCache(remote, size=100, timeout=60)
+        tier.start()
+        while not tier.listening:
+            gevent.sleep(0.01)
+        return tier
+
+    def test_01_fewer_redis_calls(self):
+        # Repeated lookups of the same user, as done for every push to a
+        # recipient, should only reach redis once.
+        remote = cache.cache
+        tier = self._start_tier(remote)
+        client = remote._client
+        user_id = self._user1.user_id
+
+        with mock.patch.object(client, 'get', wraps=client.get) as get_mock:
+            for _ in xrange(10):
+                _get_user(user_id=user_id)
+        plain_calls = get_mock.call_count
+
+        self.app.extensions['cache'][cache] = tier
+        try:
+            with mock.patch.object(client, 'get',
+                                   wraps=client.get) as get_mock:
+                for _ in xrange(10):
+                    _get_user(user_id=user_id)
+            tier_calls = get_mock.call_count
+
+            self.assertEquals(plain_calls, 10)
+            self.assertEquals(tier_calls, 1)
+            self.assertEquals(tier.get_metrics()['hits'], 9)
+
+            # Writing through to the cache evicts the local copy.
+            update_user(self._user1, display_name='Local Cache',
+                        ignore_permission=True)
+            user = _get_user(user_id=user_id)
+            self.assertEquals(user.display_name, 'Local Cache')
+        finally:
+            self.app.extensions['cache'][cache] = remote
+            gevent.kill(tier.greenlet)
+
+    def test_02_invalidation_across_processes(self):
+        # A delete in one process evicts the key in every other process.
+        remote = cache.cache
+        tier1 = self._start_tier(remote)
+        tier2 = self._start_tier(remote)
+
+        try:
+            tier1.set('local-cache-test', 'first')
+            self.assertEquals(tier2.get('local-cache-test'), 'first')
+            self.assertIn('local-cache-test', tier2.local)
+
+            tier1.set('local-cache-test', 'second')
+            gevent.sleep(0.1)
+            self.assertNotIn('local-cache-test', tier2.local)
+            self.assertEquals(tier2.get('local-cache-test'), 'second')
+
+            tier1.delete('local-cache-test')
+            gevent.sleep(0.1)
+            self.assertIsNone(tier2.get('local-cache-test'))
+        finally:
+            gevent.kill(tier1.greenlet)
+            gevent.kill(tier2.greenlet)
+
+    def test_03_compact_documents(self):
+        # Documents are stored as versioned BSON that is smaller and loads
+        # faster than the pickled document.
+        yo = Yo(sender=self._user1, recipient=self._user2, text='Yo')
+        yo.save()
+
+        user = _get_user(user_id=self._user1.user_id)
+        yo = get_yo_by_id(yo.yo_id)
+        # Dereference so the pickle carries what the old cache stored.
+        yo.sender
+        yo.recipient
+
+        pickled = RedisCache().dump_object
+        for document in (user, yo):
+            compact = cache_serializer.dumps(document)
+            pickle_value = pickled(document)
+            self.assertLess(len(compact), len(pickle_value))
+
+            loaded = cache_serializer.loads(compact)
+            self.assertEquals(loaded.__class__, document.__class__)
+            self.assertEquals(loaded.pk, document.pk)
+
+        self.assertEquals(cache_serializer.loads(compact).sender.user_id,
+                          self._user1.user_id)
+
+        # Lists of documents round trip too.
+        loaded = cache_serializer.loads(cache_serializer.dumps([user, yo]))
+        self.assertEquals([item.pk for item in loaded], [user.pk, yo.pk])
+
+        # Values written with another version are cache misses.
+        stale = cache_serializer.MARKER + chr(cache_serializer.VERSION + 1)
+        self.assertIsNone(cache_serializer.loads(stale + compact[2:]))
+
+    def test_04_pubsub_failures(self):
+        # Invalidations go over their own connection and failures there
+        # never reach callers nor respawn the listener on every lookup.
+        remote = cache.cache
+        pubsub_client = mock.Mock()
+        pubsub_client.publish.side_effect = ResponseError('unsupported')
+        pubsub_client.pubsub.return_value.listen.side_effect = \
+            ResponseError('unsupported')
+        tier = TwoTierCache(remote, size=100, timeout=60,
+                            pubsub_client=pubsub_client)
+
+        tier.set('local-cache-test', 'first')
+        tier.delete('local-cache-test')
+        self.assertEquals(pubsub_client.publish.call_count, 2)
+
+        tier.start()
+        gevent.sleep(0.01)
+        self.assertFalse(tier.listening)
+        self.assertIsNone(tier.greenlet)
+
+        for _ in xrange(10):
+            self.assertIsNone(tier.get('local-cache-test'))
+        gevent.sleep(0.01)
+        self.assertEquals(pubsub_client.pubsub.call_count, 1)
+        self.assertGreater(tier.retry_at, time.time())
+
+    @skipUnless(os.environ.get('YOAPI_BENCHMARKS'), 'Set YOAPI_BENCHMARKS')
+    def test_05_compact_documents_benchmark(self):
+        """Make sure compact documents load no slower than pickles"""
+        yo = Yo(sender=self._user1, recipient=self._user2, text='Yo')
+        yo.save()
+
+        user = _get_user(user_id=self._user1.user_id)
+        yo = get_yo_by_id(yo.yo_id)
+        # Dereference so the pickle carries what the old cache stored.
+        yo.sender
+        yo.recipient
+
+        pickled = RedisCache().dump_object
+        for document in (user, yo):
+            compact = cache_serializer.dumps(document)
+            pickle_value = pickled(document)
+
+            start_time = time.time()
+            for _ in xrange(1000):
+                cache_serializer.loads(compact)
+            compact_time = time.time() - start_time
+
+            start_time = time.time()
+            for _ in xrange(1000):
+                pickle.loads(pickle_value[1:])
+            pickle_time = time.time() - start_time
+
+            print ('\n%s: compact loads in %.3fs, pickle loads in %.3fs' % (
+                document.__class__.__name__, compact_time, pickle_time))
+            # Timings are noisy so only guard against regressions.
+            self.assertLess(compact_time, pickle_time * 2)
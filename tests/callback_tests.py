@@ -1,8 +1,14 @@
 # -*- coding: utf-8 -*-
 """Tests the callback mechinism."""
 
+import time
+
+import mock
+
 from . import BaseTestCase
 
+from yoapi.core import callback_dispatcher
+from yoapi.extensions.dispatcher import CircuitBreaker, CircuitOpenError
 from yoapi.models import NotificationEndpoint
 from yoapi.notification_endpoints import IOS
 from yoapi.services import high_rq, low_rq
@@ -81,3 +87,53 @@ class CallbacksTestCase(BaseTestCase):
         self.assertEquals(res.status_code, 200)
         self.assertTrue(res.json.get('is_verified'),
                         'Expected user to be verified')
+
+    def test_03_callback_circuit_breaker(self):
+        # Test that a failing callback host is skipped once its circuit
+        # opens and that a successful trial closes it again.
+        breaker = CircuitBreaker(threshold=2, reset_timeout=0)
+        self.assertTrue(breaker.allow_request())
+
+        breaker.record_failure()
+        self.assertFalse(breaker.is_open)
+        breaker.record_failure()
+        self.assertTrue(breaker.is_open)
+
+        # Only a single trial request is allowed through.
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+
+        breaker.record_success()
+        self.assertFalse(breaker.is_open)
+        self.assertTrue(breaker.allow_request())
+
+        # Requests to an open circuit are returned as errors.
+        dispatcher = callback_dispatcher.instance
+        open_breaker = dispatcher.get_breaker('http://callback.test/yo')
+        open_breaker.opened_at = time.time()
+        open_breaker.trial_pending = True
+
+        results = callback_dispatcher.map(
+            [('GET', 'http://callback.test/yo', {})])
+        self.assertIsInstance(results[0], CircuitOpenError)
+
+        # A trial that fails for reasons other than the host is released.
+        open_breaker.trial_pending = False
+        open_breaker.opened_at = time.time() - dispatcher.breaker_reset_timeout
+        with mock.patch.object(dispatcher.session, 'request',
+                               side_effect=ValueError):
+            self.assertRaises(ValueError, dispatcher.request, 'GET',
+                              'http://callback.test/yo')
+        self.assertTrue(open_breaker.allow_request())
+
+        # Only the breakers of the most recently used hosts are kept.
+        breaker_hosts = dispatcher.breaker_hosts
+        dispatcher.breaker_hosts = 2
+        try:
+            for i in xrange(3):
+                dispatcher.get_breaker('http://callback%s.test/yo' % i)
+            self.assertEquals(list(dispatcher.breakers),
+                              ['callback1.test', 'callback2.test'])
+        finally:
+            dispatcher.breaker_hosts = breaker_hosts
+            dispatcher.breakers.clear()
@@ -30,6 +30,10 @@ class Testing(Default):
     FIRST_YO_LINK = 'http://google.com'
     FIRST_YO_LOCATION = '0,0'
 
+    # The api and worker apps share a process in tests so skip the local
+    # cache layer. See cache_test.py for tests of it.
+    CACHE_LOCAL_SIZE = 0
+
     RATELIMIT_STORAGE_URL = 'redis://localhost:6379/4'
 
     EASTER_EGG_TEXT = 'Test easter send'
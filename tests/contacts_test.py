@@ -2,8 +2,15 @@
 
 """Tests all authentication related endpoints."""
 
+from itertools import chain
+
 from flask import g
 from yoapi.accounts import get_user
+from yoapi.contacts import (is_blocked, iter_follower_ids,
+                            get_follower_ids, get_followers,
+                            add_follower_id, clear_follower_ids)
+from yoapi.core import redis
+from yoapi.models import Contact
 
 from . import BaseTestCase
 
@@ -317,3 +324,96 @@ class ContactsTestCase(BaseTestCase):
 
         contacts = res.json.get('contacts')
         self.assertEquals(len(contacts), 0)
+
+    def test_05_follower_ids(self):
+        # Test that follower ids are loaded once and then kept up to date.
+        res = self.jsonpost('/rpc/add',
+                            jwt_token=self._user2_jwt,
+                            data={'username': self._user1.username})
+        self.assertEquals(res.status_code, 200, '200 OK')
+
+        follower_ids = list(iter_follower_ids(self._user1))
+        self.assertEquals(follower_ids, [[self._user2.user_id]])
+
+        # New followers are added to the loaded set.
+        res = self.jsonpost('/rpc/add',
+                            jwt_token=self._user3_jwt,
+                            data={'username': self._user1.username})
+        self.assertEquals(res.status_code, 200, '200 OK')
+
+        follower_ids = list(iter_follower_ids(self._user1, chunk_size=1))
+        self.assertEquals(len(follower_ids), 2)
+        self.assertEquals(set(chain.from_iterable(follower_ids)),
+                          set([self._user2.user_id, self._user3.user_id]))
+
+        # Blocking removes the contact and therefore the follower.
+        res = self.jsonpost('/rpc/block',
+                            jwt_token=self._user2_jwt,
+                            data={'username': self._user1.username})
+        self.assertEquals(res.status_code, 200, '200 OK')
+
+        follower_ids = list(iter_follower_ids(self._user1))
+        self.assertEquals(follower_ids, [[self._user3.user_id]])
+
+        # Contacts whose owner has blocked the user are left out on reload,
+        # as are contacts whose owner no longer exists.
+        self._user3.update(push__blocked=self._user1)
+        Contact(owner=self._user4, target=self._user1).save()
+        self._user4.delete()
+        clear_follower_ids(self._user1)
+        follower_ids = list(iter_follower_ids(self._user1))
+        self.assertEquals(follower_ids, [])
+        self.assertEquals(redis.keys('yoapi:followers:%s:*' %
+                                     self._user1.user_id), [])
+
+        # Follows that land while the set is loaded are kept.
+        clear_follower_ids(self._user1)
+        redis.set('yoapi:followers:%s:loading' % self._user1.user_id, 1)
+        add_follower_id(self._user1, '5549f7f0e2a4c1f1c4e0e2b6')
+        follower_ids = list(iter_follower_ids(self._user1))
+        self.assertEquals(follower_ids, [['5549f7f0e2a4c1f1c4e0e2b6']])
+        self.assertEquals(redis.keys('yoapi:followers:%s:*' %
+                                     self._user1.user_id), [])
+
+    def test_06_blocked_ids(self):
+        # Test that blocked ids are kept in redis and on the user object.
+        self.assertFalse(is_blocked(self._user1, self._user2))
+        self.assertGreater(redis.ttl('yoapi:blocked:%s' % self._user1.user_id),
+                           0)
+
+        res = self.jsonpost('/rpc/block',
+                            data={'username': self._user2.username})
+        self.assertEquals(res.status_code, 200, '200 OK')
+
+        self.assertTrue(is_blocked(self._user1, self._user2))
+        self.assertFalse(is_blocked(self._user1, self._user3))
+
+        user1 = get_user(user_id=self._user1.user_id)
+        self.assertEquals(user1.blocked_ids, frozenset([self._user2.pk]))
+        self.assertTrue(user1.has_blocked(self._user2))
+        self.assertTrue(user1.has_blocked(self._user2.user_id))
+        self.assertFalse(user1.has_blocked(self._user3))
+
+        res = self.jsonpost('/rpc/unblock',
+                            data={'username': self._user2.username})
+        self.assertEquals(res.status_code, 200, '200 OK')
+
+        self.assertFalse(is_blocked(self._user1, self._user2))
+        user1 = get_user(user_id=self._user1.user_id)
+        self.assertFalse(user1.has_blocked(self._user2))
+
+    def test_07_followers_by_id(self):
+        # Test that followers are found by reading only the contact owners.
+        for jwt_token in (self._user2_jwt, self._user3_jwt):
+            res = self.jsonpost('/rpc/add', jwt_token=jwt_token,
+                                data={'username': self._user1.username})
+            self.assertEquals(res.status_code, 200, '200 OK')
+
+        with self.assertFetchesOnly(Contact, 'owner'):
+            follower_ids = get_follower_ids(self._user1)
+        self.assertEquals(set(follower_ids),
+                          set([self._user2.user_id, self._user3.user_id]))
+
+        followers = get_followers(self._user1, ignore_permission=True)
+        self.assertEquals(set(follower.username for follower in followers),
+                          set([self._user2.username, self._user3.username]))
@@ -1,8 +1,19 @@
 # -*- coding: utf-8 -*-
 """Tests the contexts endpoints"""
 
+from datetime import timedelta
+
+import mock
+
 from . import BaseTestCase
 
+from yoapi.accounts import get_user
+from yoapi.constants.context import UNLOCKING_CONTEXT_IDS
+from yoapi.contexts import has_used_contexts
+from yoapi.helpers import get_usec_timestamp
+from yoapi.models import Yo
+from yoapi.services import low_rq
+
 class Obj(object):
     """Pseudo object"""
 
@@ -56,3 +67,39 @@ class ContextsTestCase(BaseTestCase):
         self.assertEquals(payload.get('urls')[0], gif.fixed_width.url)
 
         self.giphy_search_mock.return_value = []
+
+    def test_04_context_usage(self):
+        since = get_usec_timestamp(timedelta(days=-27))
+        self.assertFalse(has_used_contexts(self._user2, UNLOCKING_CONTEXT_IDS,
+                                           since))
+
+        # Users found without such yos are not looked up again.
+        user = get_user(user_id=self._user2.user_id, ignore_permission=True)
+        self.assertEquals(user.context_times_since, since)
+        with mock.patch.object(Yo, 'objects') as objects_mock:
+            self.assertFalse(has_used_contexts(
+                user, UNLOCKING_CONTEXT_IDS, since + 1))
+        self.assertFalse(objects_mock.called)
+
+        # Yos sent before context times were recorded are still found, and
+        # their time is recorded.
+        yo = Yo(sender=self._user1, recipient=self._user2,
+                context_id='emoji')
+        yo.save()
+        self.assertTrue(has_used_contexts(self._user1, UNLOCKING_CONTEXT_IDS,
+                                          since))
+        user = get_user(user_id=self._user1.user_id, ignore_permission=True)
+        self.assertEquals(user.context_times['emoji'], yo.created)
+
+        # Sending records the context time so no yos need to be read.
+        res = self.jsonpost('/rpc/yo', data={'to': self._user3.username,
+                                             'context_identifier': 'gif'})
+        self.assertEquals(res.status_code, 200)
+        low_rq.create_worker(app=self.worker_app).work(burst=True)
+
+        user = get_user(user_id=self._user1.user_id, ignore_permission=True)
+        self.assertGreater(user.context_times['gif'], since)
+        with mock.patch.object(Yo, 'objects') as objects_mock:
+            self.assertTrue(has_used_contexts(user, UNLOCKING_CONTEXT_IDS,
+                                              since))
+        self.assertFalse(objects_mock.called)
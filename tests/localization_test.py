@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Tests for location lookups."""
+
+import gevent
+from bson import ObjectId
+
+from . import BaseTestCase
+
+from yoapi.localization import (clear_region_bounds, get_location_city,
+                                get_region, is_in_region)
+from yoapi.models.region import Region
+
+
+class FakeAddresses(list):
+
+    """Stands in for the results of a reverse geocode"""
+
+    @property
+    def count(self):
+        return len(self)
+
+
+class FakeAddress(object):
+
+    def __init__(self, city):
+        self.city = city
+
+
+class LocalizationTestCase(BaseTestCase):
+
+    def test_01_location_city_cache(self):
+        # Test that nearby locations share one geocoder request, even
+        # when they are looked up at the same time.
+        def reverse_geocode(latitude, longitude):
+            gevent.sleep(0.01)
+            return FakeAddresses([FakeAddress(u'Tel Aviv')])
+
+        self.geocoder_mock.side_effect = reverse_geocode
+
+        def lookup(latitude):
+            with self.app.app_context():
+                return get_location_city(latitude, 34.7972)
+
+        greenlets = [gevent.spawn(lookup, 32.0878 + i * 0.0001)
+                     for i in xrange(5)]
+        gevent.joinall(greenlets, raise_error=True)
+        self.assertEquals([greenlet.value for greenlet in greenlets],
+                          [u'Tel Aviv'] * 5)
+        self.assertEquals(self.geocoder_mock.call_count, 1)
+
+        self.assertEquals(get_location_city(32.0881, 34.7969), u'Tel Aviv')
+        self.assertEquals(self.geocoder_mock.call_count, 1)
+
+        # Locations without a city are cached too.
+        self.geocoder_mock.side_effect = None
+        self.geocoder_mock.return_value = FakeAddresses()
+        self.assertIsNone(get_location_city(0, 0))
+        self.assertIsNone(get_location_city(0, 0))
+        self.assertEquals(self.geocoder_mock.call_count, 2)
+
+    def test_02_regions(self):
+        # Test that regions are found from the bounds and that the push
+        # filter rules out far away recipients.
+        Region.drop_collection()
+        austin = Region(name='Austin', latitude=30.25, longitude=-97.75,
+                        radius=20)
+        austin.save()
+        tel_aviv = Region(name='Tel Aviv', latitude=32.0878,
+                          longitude=34.7972, radius=50)
+        tel_aviv.save()
+        clear_region_bounds()
+
+        self.assertEquals(get_region((30.3, -97.7)), 'Austin')
+        self.assertEquals(get_region((32.1, 34.8)), 'Tel Aviv')
+        self.assertIsNone(get_region((40.7, -74.0)))
+
+        self.assertTrue(is_in_region(austin.id, (30.3, -97.7)))
+        # Inside the bounding box but outside of the circle.
+        self.assertFalse(is_in_region(austin.id, (30.52, -97.46)))
+        self.assertFalse(is_in_region(austin.id, (32.1, 34.8)))
+        self.assertTrue(is_in_region(tel_aviv.id, (32.1, 34.8)))
+
+        # Regions saved after the bounds were loaded are looked up on
+        # their own and unknown regions exclude everyone.
+        state_college = Region(name='State College', latitude=40.7982,
+                               longitude=-77.8599, radius=50)
+        state_college.save()
+        self.assertTrue(is_in_region(state_college.id, (40.8, -77.9)))
+        self.assertFalse(is_in_region(state_college.id, (30.3, -97.7)))
+        self.assertFalse(is_in_region(ObjectId(), (30.3, -97.7)))
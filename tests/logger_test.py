@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Tests for the JSON logger."""
+
+import logging
+from cStringIO import StringIO
+
+import gevent
+
+from . import BaseTestCase
+
+from yoapi.logger import JSONFormatter, QueueHandler
+
+
+class LoggerTestCase(BaseTestCase):
+
+    def _make_record(self, msg, level=logging.INFO):
+        return logging.LogRecord('yoapi', level, __file__, 0, msg, None, None)
+
+    def test_01_queue_handler(self):
+        stream = StringIO()
+        handler = QueueHandler(logging.StreamHandler(stream), size=10,
+                               batch_size=4, sample_rate=2)
+        handler.setFormatter(JSONFormatter(self.app))
+
+        # Nothing is written until the greenlet gets to run.
+        payload = {'password': 'secret', 'items': [{'photo': 'data'}]}
+        handler.handle(self._make_record(payload))
+        self.assertEquals(stream.getvalue(), '')
+
+        gevent.sleep(0)
+        self.assertIn('REDACTED', stream.getvalue())
+        # Redacting doesn't touch the logged object.
+        self.assertEquals(payload['password'], 'secret')
+        self.assertEquals(payload['items'][0]['photo'], 'data')
+
+        # Info records are sampled once the queue is half full and dropped
+        # once it is full.
+        for i in xrange(20):
+            handler.handle(self._make_record('info %s' % i))
+        for i in xrange(5):
+            handler.handle(self._make_record('error %s' % i, logging.ERROR))
+
+        metrics = handler.get_metrics()
+        self.assertEquals(metrics['pending'], 10)
+        self.assertEquals(metrics['sampled'], 8)
+        self.assertEquals(metrics['dropped'], 7)
+
+        handler.flush()
+        lines = stream.getvalue().splitlines()
+        self.assertEquals(handler.get_metrics()['written'], 11)
+        self.assertIn('8 records sampled out, 7 dropped', lines[-1])
+        gevent.kill(handler.greenlet)
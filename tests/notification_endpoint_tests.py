@@ -3,9 +3,16 @@
 
 from uuid import uuid4
 
+from boto.exception import BotoServerError
+
+from yoapi.callbacks import remove_disabled_endpoint
+from yoapi.extensions.sns import SNSConnectionPool
 from yoapi.models import Device, NotificationEndpoint
 from yoapi.notification_endpoints import (get_useragent_profile, IOSBETA, IOS,
-                                          ANDROID)
+                                          ANDROID, get_user_endpoints,
+                                          clear_get_user_endpoints_cache,
+                                          clear_endpoint_owners_cache)
+from yoapi.notifications import _push_to_endpoint
 from . import BaseTestCase
 
 
@@ -388,3 +395,123 @@ class NotificationEndpointTestCase(BaseTestCase):
         self.assertEquals(ua_profile.get('os_version'), '5.0.1')
         self.assertEquals(ua_profile.get('platform'), ANDROID)
 
+
+    def test_11_publish_reenables_only_disabled_endpoints(self):
+        """Tests that endpoints are only re-enabled after a failed publish"""
+
+        arn = self.get_unique_arn()
+        NotificationEndpoint(owner=self._user1, arn=arn, platform=IOS,
+                             token='test_publish_token').save()
+
+        disabled_error = BotoServerError(400, 'Bad Request')
+        disabled_error.error_code = 'EndpointDisabled'
+
+        with self.worker_app.test_request_context():
+            self.sns_publish_mock.reset_mock()
+            self.sns_set_endpoint_mock.reset_mock()
+
+            # A healthy endpoint costs a single publish call.
+            _push_to_endpoint(arn, sns_message='{}')
+            self.assertEquals(self.sns_publish_mock.call_count, 1)
+            self.assertEquals(self.sns_set_endpoint_mock.call_count, 0)
+
+            # A disabled endpoint is re-enabled and retried once.
+            self.sns_publish_mock.side_effect = [disabled_error, None]
+            _push_to_endpoint(arn, sns_message='{}')
+            self.assertEquals(self.sns_publish_mock.call_count, 3)
+            self.assertEquals(self.sns_set_endpoint_mock.call_count, 1)
+            endpoint = NotificationEndpoint.objects(arn=arn).get()
+            self.assertFalse(endpoint.disabled)
+
+            # If the retry fails the state is recorded on the endpoint.
+            self.sns_publish_mock.side_effect = [disabled_error,
+                                                 disabled_error]
+            _push_to_endpoint(arn, sns_message='{}')
+            self.assertEquals(self.sns_publish_mock.call_count, 5)
+            self.assertEquals(self.sns_set_endpoint_mock.call_count, 2)
+            endpoint = NotificationEndpoint.objects(arn=arn).get()
+            self.assertTrue(endpoint.disabled)
+
+            self.sns_publish_mock.side_effect = None
+
+    def test_12_sns_connection_pool(self):
+        """Tests that the sns connection pool reuses and bounds connections"""
+
+        pool = SNSConnectionPool(object, size=2)
+        with pool.connection() as conn1:
+            pass
+        with pool.connection() as conn2:
+            self.assertIs(conn1, conn2)
+
+        with pool.connection() as conn1:
+            with pool.connection() as conn2:
+                self.assertIsNot(conn1, conn2)
+
+        metrics = pool.get_metrics()
+        self.assertEquals(metrics.get('checkouts'), 4)
+        self.assertEquals(metrics.get('creations'), 2)
+        self.assertEquals(metrics.get('idle'), 2)
+        self.assertEquals(metrics.get('waits'), 0)
+
+        # Stale connections are replaced on checkout.
+        pool.max_idle = -1
+        with pool.connection() as conn3:
+            self.assertNotIn(conn3, [conn1, conn2])
+        self.assertEquals(pool.get_metrics().get('discards'), 2)
+
+        # Connections are kept after errors returned by the service and
+        # discarded after any other error.
+        pool.max_idle = 300
+        with self.assertRaises(BotoServerError):
+            with pool.connection() as conn:
+                raise BotoServerError(400, 'Bad Request')
+        self.assertEquals(pool.get_metrics().get('idle'), 1)
+
+        with self.assertRaises(ValueError):
+            with pool.connection() as conn:
+                raise ValueError()
+        metrics = pool.get_metrics()
+        self.assertEquals(metrics.get('idle'), 0)
+        self.assertEquals(metrics.get('discards'), 3)
+
+    def test_13_user_endpoints_cache(self):
+        """Tests that cached endpoints are evicted when endpoints change"""
+
+        arn1 = self.get_unique_arn()
+        arn2 = self.get_unique_arn()
+        NotificationEndpoint(owner=self._user1, arn=arn1, platform=IOS,
+                             token='test_cache_token1',
+                             installation_id='test_cache_install1').save()
+
+        with self.worker_app.test_request_context():
+            clear_get_user_endpoints_cache(self._user1)
+            endpoints = get_user_endpoints(self._user1,
+                                           ignore_permissions=True)
+            self.assertEquals([e.arn for e in endpoints], [arn1])
+            self.assertEquals(endpoints[0].platform, IOS)
+
+            # Writes that bypass the endpoint helpers are not seen.
+            NotificationEndpoint(owner=self._user1, arn=arn2,
+                                 platform=ANDROID,
+                                 token='test_cache_token2').save()
+            endpoints = get_user_endpoints(self._user1,
+                                           ignore_permissions=True)
+            self.assertEquals([e.arn for e in endpoints], [arn1])
+
+            # Removing a disabled endpoint evicts the owner's cache.
+            remove_disabled_endpoint(arn1)
+            endpoints = get_user_endpoints(self._user1,
+                                           ignore_permissions=True)
+            self.assertEquals([e.arn for e in endpoints], [arn2])
+            endpoints = get_user_endpoints(self._user1,
+                                           app_id='co.justyo.yopolls',
+                                           ignore_permissions=True)
+            self.assertEquals(endpoints, [])
+
+            # Handing an endpoint to another user evicts the old owner.
+            endpoints = NotificationEndpoint.objects(arn=arn2)
+            clear_endpoint_owners_cache(endpoints)
+            endpoints.update(set__owner=self._user2)
+            endpoints = get_user_endpoints(self._user1,
+                                           ignore_permissions=True)
+            self.assertEquals(endpoints, [])
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 """Tests for various conditions that change the payload sent to a endpoint"""
 
+from flask import json
+
 from . import BaseTestCase
 
 from yoapi.accounts import update_user
@@ -13,7 +15,8 @@ from yoapi.notification_endpoints import (get_useragent_profile, IOSBETA, IOS,
                                           ANDROID)
 from yoapi.services import low_rq, medium_rq
 
-from yoapi.models.payload import Payload, YoPayload, YoGroupPayload
+from yoapi.models.payload import (Payload, PayloadCache, YoPayload,
+                                  YoGroupPayload)
 from yoapi.constants import payload as YoPayloadConst
 from yoapi.constants.regex import (DOUBLE_PERIOD_RE, NOT_GSM_RE,
                                    NOT_ASCII_GSM_RE)
@@ -1138,3 +1141,46 @@ class PayloadTestCase(BaseTestCase):
         self.assertNotIn('origin_sender', payload_extras)
         self.assertNotIn('link', payload_extras)
         self.assertNotIn('location', payload_extras)
+
+    def test_15_payload_cache(self):
+        # Endpoints sharing a capability class should reuse one message.
+        yo = construct_yo(sender=self._user1, recipients=[self._user2])
+        payload_cache = PayloadCache()
+
+        ios_message = payload_cache.get_sns_message(yo, self.ios_endpoint)
+        self.assertEquals(len(payload_cache), 1)
+        self.assertEquals(
+            ios_message,
+            YoPayload(yo, self.ios_payload_support_dict).to_sns())
+
+        self.assertIs(payload_cache.get_sns_message(yo, self.ios_endpoint),
+                      ios_message)
+        self.assertEquals(len(payload_cache), 1)
+
+        android_message = payload_cache.get_sns_message(
+            yo, self.android_endpoint)
+        self.assertEquals(len(payload_cache), 2)
+        self.assertNotEquals(android_message, ios_message)
+
+    def test_16_payload_cache_broadcast(self):
+        # Children of a broadcast share one payload per capability class
+        # and only differ in their own yo id and creation time.
+        recipients = [self._user2, self._user3]
+        yo = construct_yo(sender=self._user1, recipients=recipients)
+        _create_child_yos(yo, recipients)
+        child_yos = get_child_yos(yo)
+        payload_cache = PayloadCache()
+
+        for child_yo in child_yos:
+            message = json.loads(payload_cache.get_sns_message(
+                child_yo, self.ios_endpoint))
+            expected = json.loads(YoPayload(
+                child_yo, self.ios_payload_support_dict).to_sns())
+            self.assertEquals(message['default'], expected['default'])
+            self.assertEquals(json.loads(message['apns']),
+                              json.loads(expected['apns']))
+            self.assertEquals(json.loads(message['apns'])['yo_id'],
+                              child_yo.yo_id)
+
+        self.assertEquals(len(payload_cache), 2)
+        self.assertEquals(len(payload_cache._payloads), 1)
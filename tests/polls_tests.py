@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Tests poll tallies."""
+
+from . import BaseTestCase
+
+from yoapi.models import Yo
+from yoapi.polls import count_poll_reply, get_poll_counts, reconcile_poll_counts
+
+
+class PollsTestCase(BaseTestCase):
+
+    def _reply(self, poll, sender, text):
+        reply = Yo(sender=sender, recipient=poll.sender, reply_to=poll,
+                   text=text)
+        reply.save()
+        return reply
+
+    def test_01_poll_counts(self):
+        poll = Yo(sender=self._user1, is_poll=True, question='Yo?',
+                  response_pair='nope.yep')
+        poll.save()
+
+        # Polls without counters are reconciled on the first reply.
+        self._reply(poll, self._user2, 'yep')
+        self.assertEquals(count_poll_reply(poll, 'yep'), (0, 1))
+
+        # Later replies increment the counters.
+        self._reply(poll, self._user3, 'yep')
+        self.assertEquals(count_poll_reply(poll, 'yep'), (0, 2))
+        self._reply(poll, self._user4, 'nope')
+        self.assertEquals(count_poll_reply(poll, 'nope'), (1, 2))
+
+        poll.reload()
+        self.assertEquals(get_poll_counts(poll), (1, 2))
+
+        # Reconciling fixes counters that drifted.
+        poll.update(set__right_replies_count=10)
+        poll.reload()
+        self.assertEquals(reconcile_poll_counts(poll), (1, 2))
+        poll.reload()
+        self.assertEquals(poll.right_replies_count, 2)
@@ -3,6 +3,7 @@
 
 import time
 
+from yoapi.core import redis
 from yoapi.helpers import get_usec_timestamp
 from yoapi.services import low_rq
 from yoapi.services.scheduler import yo_scheduler, schedule_yo
@@ -67,3 +68,49 @@ class SchedulerTestCase(BaseTestCase):
         yo.reload()
         self.assertEquals(yo.status, 'sent',
                           'Expected yo to have sent')
+
+    def test_02_schedule_index(self):
+        # Test that scheduled yos are kept in a redis time index that can
+        # be rebuilt from the database.
+        yo = construct_yo(sender=self._user1,
+                          recipients=[self._user2],
+                          ignore_permission=True)
+
+        delay_until = get_usec_timestamp() + TEST_SCHEDULED_DELAY
+        schedule_yo(yo, scheduled_for=delay_until)
+
+        index_key = yo_scheduler.get_index_key(JOB_TYPE)
+        self.assertEquals(redis.zscore(index_key, yo.yo_id), delay_until)
+
+        next_job_time = yo_scheduler.get_time_until_next_job()
+        self.assertEquals(next_job_time[0], JOB_TYPE)
+        self.assertLessEqual(next_job_time[1], TEST_SCHEDULED_DELAY)
+
+        # Losing the index reloads it from the database.
+        redis.flushdb()
+        next_job_time = yo_scheduler.get_time_until_next_job()
+        self.assertEquals(next_job_time[0], JOB_TYPE)
+        self.assertEquals(redis.zcard(index_key), 1)
+
+        # Claims that were never acknowledged, e.g. because the scheduler
+        # died before running them, are run once their lease expires.
+        claimed_key = yo_scheduler.get_claimed_key(JOB_TYPE)
+        redis.zadd(index_key, **{yo.yo_id: get_usec_timestamp()})
+        yo.update(set__scheduled_for=get_usec_timestamp())
+        self.assertEquals(yo_scheduler.claim_due_job_ids(JOB_TYPE),
+                          [yo.yo_id])
+        self.assertEquals(redis.zcard(index_key), 0)
+        self.assertEquals(yo_scheduler.claim_due_job_ids(JOB_TYPE), [])
+
+        redis.zadd(claimed_key, **{yo.yo_id: get_usec_timestamp()})
+        next_job_time = yo_scheduler.get_time_until_next_job()
+        self.assertEquals(next_job_time, (JOB_TYPE, 0))
+
+        # Due jobs are acknowledged once executed.
+        yo_scheduler.execute_scheduled_items_now(JOB_TYPE)
+
+        self.assertEquals(redis.zcard(index_key), 0)
+        self.assertEquals(redis.zcard(claimed_key), 0)
+        yo.reload()
+        self.assertEquals(yo.status, 'started',
+                          'Expected yo to have started')
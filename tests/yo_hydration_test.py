@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks loading lists of yos by id.
+
+Timings depend on the local redis and mongod so these only run when
+YOAPI_BENCHMARKS is set.
+"""
+
+import os
+import time
+from unittest import skipUnless
+
+from . import BaseTestCase
+from yoapi.core import cache
+from yoapi.models import Yo
+from yoapi.yos.queries import get_yo_by_id, get_yos_by_ids
+
+YO_COUNT = 100
+ROUNDS = 20
+
+
+@skipUnless(os.environ.get('YOAPI_BENCHMARKS'), 'Set YOAPI_BENCHMARKS')
+class YoHydrationTestCase(BaseTestCase):
+
+    """Compares loading yos one by one to loading them in bulk"""
+
+    def setUp(self):
+        super(YoHydrationTestCase, self).setUp()
+        yos = [Yo(sender=self._user1, recipient=self._user2, text=str(i))
+               for i in xrange(YO_COUNT)]
+        self.yo_ids = [str(yo_id) for yo_id in
+                       Yo.objects.insert(yos, load_bulk=False)]
+
+    def _time(self, load, warm):
+        duration = 0
+        for _ in xrange(ROUNDS):
+            if not warm:
+                cache.clear()
+            start_time = time.time()
+            yos = load(self.yo_ids)
+            duration += time.time() - start_time
+            self.assertEquals([yo.yo_id for yo in yos], self.yo_ids)
+        return duration / ROUNDS
+
+    def test_01_hydrate_yos(self):
+        load_each = lambda yo_ids: [get_yo_by_id(yo_id) for yo_id in yo_ids]
+        results = {}
+        for warm in (False, True):
+            each_time = self._time(load_each, warm)
+            bulk_time = self._time(get_yos_by_ids, warm)
+            results[warm] = (each_time, bulk_time)
+            print ('\n%s yos from a %s cache: %.1fms one by one, %.1fms in '
+                   'bulk' % (YO_COUNT, 'warm' if warm else 'cold',
+                             each_time * 1000, bulk_time * 1000))
+
+        for each_time, bulk_time in results.values():
+            self.assertLess(bulk_time, each_time)
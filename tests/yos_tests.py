@@ -2,21 +2,33 @@
 
 """Tests all yo related endpoints."""
 
+import cStringIO
 import mock
 import time
 
 from flask import g, json
+from gevent.pywsgi import WSGIServer
+from PIL import Image
 from gevent.queue import Queue
 from yoapi.accounts import update_user
 from yoapi.contacts import add_contact
-from yoapi.core import limiter
-from yoapi.models import Contact, User
+from yoapi.core import cache, limiter, redis
+from yoapi.helpers import make_memoized_cache_keys
+from yoapi.models import Contact, User, Yo
 from yoapi.urltools import UrlHelper
 from yoapi.services import low_rq, medium_rq, high_rq, redis_pubsub
 
 from yoapi.yos.queries import (get_yos_received, get_yos_sent, get_yo_by_id,
-                               get_child_yos)
-from yoapi.constants.yos import LIVE_YO_CHANNEL
+                               get_yos_by_ids,
+                               get_child_yos, get_unread_yos,
+                               get_favorite_yos, get_broadcasts,
+                               _get_unread_yo_ids, _get_favorite_yo_ids,
+                               _get_broadcast_ids, add_unread_yo,
+                               _get_unread_inbox_key)
+from yoapi.yos.helpers import get_link_content_type
+from yoapi.yos.send import (generate_yo_thumbnail, _push_to_recipient,
+                            _push_to_recipient_batch)
+from yoapi.constants.yos import LIVE_YO_CHANNEL, UNREAD_INBOX_SIZE
 
 from . import BaseTestCase
 
@@ -882,3 +894,200 @@ class YosTestCase(BaseTestCase):
         self.assertEquals(res.status_code, 200, 'Expected 200 Ok.')
         unread_yos = res.json.get('unread_yos')
         self.assertEquals(len(unread_yos), 0)
+
+    def test_22_id_queries(self):
+        # Test that listing yos only reads their ids before loading each
+        # yo through the cache.
+        unread_yo = Yo(sender=self._user1, recipient=self._user2,
+                       status='received', app_id='co.justyo.yoapp')
+        unread_yo.save()
+        favorite_yo = Yo(sender=self._user1, recipient=self._user2,
+                         status='read', is_favorite=True)
+        favorite_yo.save()
+        broadcast_yo = Yo(sender=self._user1, broadcast=True,
+                          link='http://justyo.co')
+        broadcast_yo.save()
+
+        # Unread ids are loaded with their creation time for the inbox.
+        with self.assertFetchesOnly(Yo, 'id', 'created'):
+            unread_ids = _get_unread_yo_ids(self._user2.user_id, 20)
+            favorite_ids = _get_favorite_yo_ids(self._user2.user_id)
+            broadcast_ids = _get_broadcast_ids(self._user1.user_id)
+
+        self.assertEquals(unread_ids, [unread_yo.yo_id])
+        self.assertEquals(favorite_ids, [favorite_yo.yo_id])
+        self.assertEquals(broadcast_ids, [broadcast_yo.yo_id])
+
+        yos = get_unread_yos(self._user2, ignore_permission=True)
+        self.assertEquals([yo.yo_id for yo in yos], [unread_yo.yo_id])
+        yos = get_favorite_yos(self._user2, ignore_permission=True)
+        self.assertEquals([yo.yo_id for yo in yos], [favorite_yo.yo_id])
+        yos = get_broadcasts(self._user1, ignore_permission=True)
+        self.assertEquals([yo.yo_id for yo in yos], [broadcast_yo.yo_id])
+
+    def test_23_link_content_type_cache(self):
+        # Test that links are probed once and failures are cached too.
+        probed_paths = []
+
+        def link_app(environ, start_response):
+            probed_paths.append(environ['PATH_INFO'])
+            if environ['PATH_INFO'] == '/broken':
+                start_response('500 Internal Server Error', [])
+            else:
+                start_response('200 OK', [('Content-Type', 'image/png')])
+            return []
+
+        server = WSGIServer(('127.0.0.1', 0), link_app, log=None)
+        server.start()
+        # Let the requests reach the stand-in server.
+        self.get_request_patcher.stop()
+        try:
+            link = 'http://127.0.0.1:%s/image.png' % server.server_port
+            self.assertEquals(get_link_content_type(link), 'image/png')
+            self.assertEquals(get_link_content_type(link), 'image/png')
+            self.assertEquals(probed_paths, ['/image.png'])
+
+            link = 'http://127.0.0.1:%s/broken' % server.server_port
+            self.assertEquals(get_link_content_type(link),
+                              'application/unknown')
+            self.assertEquals(get_link_content_type(link),
+                              'application/unknown')
+            self.assertEquals(probed_paths, ['/image.png', '/broken'])
+        finally:
+            server.stop()
+
+    def test_24_thumbnail_after_send(self):
+        # Test that image thumbnails are rendered after the yo is sent and
+        # uploaded once per image.
+        image_data = cStringIO.StringIO()
+        Image.new('RGB', (400, 300)).save(image_data, format='PNG')
+        self.get_request_mock.return_value.content = image_data.getvalue()
+        self.get_link_content_type_mock.return_value = 'image/png'
+        self.s3_upload_image_mock.side_effect = \
+            lambda filename, data: 'https://s3.amazonaws.com/yo/%s' % filename
+
+        link = 'http://justyo.co/image.png'
+        res = self.jsonpost('/rpc/yo', data={'to': self._user2.username,
+                                             'link': link})
+        self.assertEquals(res.status_code, 200)
+        yo_id = res.json.get('yo_id')
+
+        with mock.patch('yoapi.yos.send.generate_yo_thumbnail') as job_mock:
+            low_rq.create_worker(app=self.worker_app).work(burst=True)
+        self.assertIsNone(get_yo_by_id(yo_id).thumbnail_url)
+        job_mock.delay.assert_called_once_with(yo_id)
+
+        with self.app.test_request_context():
+            generate_yo_thumbnail(yo_id)
+        thumbnail_url = get_yo_by_id(yo_id).thumbnail_url
+        self.assertTrue(thumbnail_url.endswith('.png'))
+        self.assertEquals(self.s3_upload_image_mock.call_count, 1)
+
+        # The next yo of the same image reuses the thumbnail right away.
+        res = self.jsonpost('/rpc/yo', data={'to': self._user3.username,
+                                             'link': link})
+        low_rq.create_worker(app=self.worker_app).work(burst=True)
+        yo = get_yo_by_id(res.json.get('yo_id'))
+        self.assertEquals(yo.thumbnail_url, thumbnail_url)
+        self.assertEquals(self.s3_upload_image_mock.call_count, 1)
+
+    def test_25_unread_inbox(self):
+        # Test that unread yos are read from the inbox in redis once it
+        # has been built.
+        res = self.jsonpost('/rpc/yo', data={'to': self._user2.username})
+        yo_id = res.json.get('yo_id')
+        low_rq.create_worker(app=self.worker_app).work(burst=True)
+
+        yos = get_unread_yos(self._user2, ignore_permission=True)
+        self.assertEquals([yo.yo_id for yo in yos], [yo_id])
+
+        with mock.patch.object(Yo, 'objects') as objects_mock:
+            yos = get_unread_yos(self._user2, ignore_permission=True)
+        self.assertEquals([yo.yo_id for yo in yos], [yo_id])
+        self.assertFalse(objects_mock.called)
+
+        # The inbox keeps only the newest yos.
+        for i in xrange(UNREAD_INBOX_SIZE + 5):
+            yo = Yo(sender=self._user1, recipient=self._user2, status='sent',
+                    created=i + 1)
+            yo.save()
+            add_unread_yo(yo)
+        unread_ids = _get_unread_yo_ids(self._user2.user_id,
+                                        UNREAD_INBOX_SIZE)
+        self.assertEquals(len(unread_ids), UNREAD_INBOX_SIZE)
+        self.assertEquals(unread_ids[0], yo_id)
+        self.assertEquals(unread_ids[1], yo.yo_id)
+        # The marker is kept next to exactly UNREAD_INBOX_SIZE yos.
+        key = _get_unread_inbox_key(self._user2.user_id)
+        self.assertEquals(redis.zcard(key), UNREAD_INBOX_SIZE + 1)
+
+        # Reading a yo removes it from the inbox.
+        res = self.jsonpost('/rpc/yo_ack',
+                            data={'yo_id': yo_id, 'status': 'read'},
+                            jwt_token=self._user2_jwt)
+        self.assertEquals(res.status_code, 200)
+        low_rq.create_worker(app=self.worker_app).work(burst=True)
+        unread_ids = _get_unread_yo_ids(self._user2.user_id, 1)
+        self.assertEquals(unread_ids, [yo.yo_id])
+
+        # A trimmed inbox that runs short is refilled from mongo.
+        unread_ids = _get_unread_yo_ids(self._user2.user_id,
+                                        UNREAD_INBOX_SIZE)
+        self.assertEquals(len(unread_ids), UNREAD_INBOX_SIZE)
+        self.assertEquals(unread_ids[0], yo.yo_id)
+
+    def test_26_get_yos_by_ids(self):
+        # Test that yos are loaded in order with one query for the misses
+        # and are then served from the cache.
+        yos = [Yo(sender=self._user1, recipient=self._user2, text=str(i))
+               for i in xrange(5)]
+        for yo in yos:
+            yo.save()
+        yo_ids = [yo.yo_id for yo in reversed(yos)]
+        get_yo_by_id(yo_ids[1])
+
+        with mock.patch.object(Yo, 'objects', wraps=Yo.objects) as objects_mock:
+            loaded = get_yos_by_ids(yo_ids + ['5549f7f0e2a4c1f1c4e0e2b6'])
+        self.assertEquals([yo.yo_id for yo in loaded], yo_ids)
+        self.assertEquals(objects_mock.call_count, 1)
+
+        with mock.patch.object(Yo, 'objects') as objects_mock:
+            loaded = get_yos_by_ids(yo_ids)
+        self.assertEquals([yo.yo_id for yo in loaded], yo_ids)
+        self.assertFalse(objects_mock.called)
+
+        # The keys are the ones the memoized function uses, with the
+        # version read from the cache once.
+        with mock.patch.object(cache, '_memoize_version',
+                               wraps=cache._memoize_version) as version_mock:
+            cache_keys = make_memoized_cache_keys(cache, get_yo_by_id,
+                                                  yo_ids)
+        self.assertEquals(version_mock.call_count, 1)
+        self.assertEquals(cache_keys,
+                          [get_yo_by_id.make_cache_key(get_yo_by_id.uncached,
+                                                       yo_id)
+                           for yo_id in yo_ids])
+
+    def test_27_batch_requeues_failed_children(self):
+        # Test that a child yo that fails in a batch is queued again on its
+        # own while the rest of the batch is pushed once.
+        yos = [Yo(sender=self._user1, recipient=self._user2, text=str(i))
+               for i in xrange(3)]
+        for yo in yos:
+            yo.save()
+        failing_id = yos[1].yo_id
+
+        def push(yo, **kwargs):
+            if yo.yo_id == failing_id:
+                raise Exception('Push failed')
+            return 'pushed'
+
+        with mock.patch('yoapi.yos.send._push_yo_to_recipient',
+                        side_effect=push), \
+                mock.patch.object(_push_to_recipient, 'delay') as delay_mock:
+            results = _push_to_recipient_batch(
+                [yo.yo_id for yo in yos], protocol='sns')
+
+        self.assertEquals(sorted(results.keys()),
+                          sorted([yos[0].yo_id, yos[2].yo_id]))
+        delay_mock.assert_called_once_with(failing_id, protocol='sns')
@@ -2,10 +2,12 @@
 
 """Account management package."""
 
+import hashlib
 import random
 import pytz
 import sys
 from base64 import b64decode
+from collections import OrderedDict
 from uuid import uuid4
 
 import re
@@ -24,13 +26,16 @@ from .core import cache, s3, twilio, sendgrid, redis, facebook
 from .errors import APIError
 from .helpers import (random_string, get_usec_timestamp, get_remote_addr,
                       random_number_string, clean_phone_number,
-                      get_location_data)
+                      get_location_data, make_memoized_cache_keys)
 from .models import (User, AuthToken, SignupLocation, Device,
                      NotificationEndpoint)
+from .models.oauth import Token
+from .models.user import get_reference_id
 from .permissions import (assert_view_permission, assert_account_permission,
                           assert_admin_permission)
 from .services import low_rq
 from .urltools import UrlHelper
+from .yos.queries import get_yo_count
 
 
 
@@ -41,6 +46,17 @@ from .urltools import UrlHelper
 
 sms_redis_prefix = 'yoapi:sms:'
 
+# Resolved tokens are cached briefly. Revoking a token clears its entry
+# right away so the timeout only bounds staleness from missed clears.
+IDENTITY_CACHE_TIMEOUT = 300
+
+# Whether this process may still find OAuth tokens saved before their
+# lower cased copy existed. Cleared once a lookup finds none left.
+_unlowered_access_tokens = [True]
+
+# Users are written in bulk once this many have pending activity updates.
+USER_ACTIVITY_BATCH_SIZE = 500
+
 @async_job(rq=low_rq)
 def add_email_to_mailchimp(email):
     """If the user has an email address on file add it to the mailchimp
@@ -84,6 +100,100 @@ def clear_get_user_cache(user):
                 clear_get_facebook_user_cache(user.facebook_id)
 
 
+def clear_get_user_caches(users, clear_yo_count=False):
+    """Clears the _get_user caches of many users with one cache call"""
+    keys = []
+    for user in users:
+        if clear_yo_count:
+            keys.append(get_yo_count.make_cache_key(get_yo_count.uncached,
+                                                    user))
+        keys.append(_get_user.make_cache_key(_get_user.uncached,
+                                             user_id=str(user.user_id)))
+        if user.username:
+            keys.append(_get_user_by_username.make_cache_key(
+                _get_user_by_username.uncached, str(user.username)))
+    if keys:
+        cache.cache.delete_many(*keys)
+
+
+def _get_user_db_field(name):
+    """Returns the db field of a user field, e.g. context_times.gif"""
+    name, _, key = name.partition('.')
+    db_field = User._fields[name].db_field
+    return '%s.%s' % (db_field, key) if key else db_field
+
+
+class UserActivityBatch(object):
+    """Accumulates timestamp and counter updates for many users
+
+    Updates for the same user are merged into one $set and $inc, and all
+    users are written with a single unordered bulk operation once `size`
+    users have been added or when flushed. The cached users are cleared
+    together after each write. Users in memory are left as they are, since
+    saving a stale counter later would overwrite the increments.
+    """
+
+    def __init__(self, size=USER_ACTIVITY_BATCH_SIZE):
+        self.size = size
+        self.updates = OrderedDict()
+        self.users = {}
+
+    def add(self, user, counters=None, **fields):
+        """Adds updates for a user
+
+        Args:
+            user: The user to update.
+            counters: A dict of counter field names to increment by.
+            fields: Field values to set. Keys of map fields can be set
+                with dotted names passed as **{'context_times.gif': value}.
+        """
+        update = self.updates.setdefault(user.pk, {'$set': {}, '$inc': {}})
+        for name, value in fields.items():
+            update['$set'][_get_user_db_field(name)] = value
+        for name, value in (counters or {}).items():
+            db_field = _get_user_db_field(name)
+            update['$inc'][db_field] = update['$inc'].get(db_field, 0) + value
+
+        self.users[user.pk] = user
+        if len(self.updates) >= self.size:
+            self.flush()
+
+    def flush(self):
+        """Writes the accumulated updates"""
+        if not self.updates:
+            return
+
+        updates, users = self.updates, self.users
+        self.updates = OrderedDict()
+        self.users = {}
+
+        bulk = User._get_collection().initialize_unordered_bulk_op()
+        for user_id, update in updates.items():
+            update = dict((operator, values)
+                          for operator, values in update.items() if values)
+            bulk.find({'_id': user_id}).update_one(update)
+
+        try:
+            bulk.execute()
+        finally:
+            # Always clear the cache after modifying a user object.
+            clear_yo_count = any('count_in' in update['$inc']
+                                 for update in updates.values())
+            clear_get_user_caches(users.values(),
+                                  clear_yo_count=clear_yo_count)
+
+
+def update_user_activity(user, counters=None, **fields):
+    """Sets fields and increments counters of a user in one write
+
+    Use this over update_user for timestamps and counters that change on
+    every yo, since the user is neither saved as a whole nor reloaded.
+    """
+    batch = UserActivityBatch()
+    batch.add(user, counters=counters, **fields)
+    batch.flush()
+
+
 def write_through_user_cache(user):
     """Write the changes on a user object directly to the cache
     and the database to reduce the number of calls needed.
@@ -503,9 +613,12 @@ def delete_user(user, clear_parent_cache=True, ignore_permission=False):
         clear_get_facebook_user_cache(user.facebook_id)
     cached_objectid = ObjectId(user.user_id)
     cached_user = User(id=cached_objectid, username=user.username)
+    revoke_access_tokens(Token.objects(user=user))
+    revoke_api_token(user.api_token)
     user.delete()
     # Always clear the cache after modifying a user object.
     clear_get_user_cache(cached_user)
+    clear_user_id_exists_cache(cached_user.user_id)
 
     # Delete user from parse.
     # Since we are no longer signing user up to parse we do not care if
@@ -639,6 +752,76 @@ def _get_user(user_id=None):
         raise APIError('User %s does not exist' % user_id, status_code=404)
 
 
+def _get_memoized_many(func, values, query_field):
+    """Gets the memoized users for many arguments of `func` at once
+
+    The memoize version of `func` is read once and the cache with a single
+    MGET. Users missing from it are loaded with one `$in` query and written
+    back under the keys `func` would have used. Values without a user are
+    left out of the returned dict.
+    """
+    values = list(OrderedDict.fromkeys(values))
+    if not values:
+        return {}
+
+    cache_keys = make_memoized_cache_keys(cache, func, values)
+    users = {}
+    missing = {}
+    for value, cache_key, user in zip(values, cache_keys,
+                                      cache.cache.get_many(*cache_keys)):
+        if isinstance(user, User):
+            users[value] = user
+        else:
+            missing[value] = cache_key
+
+    if missing:
+        query = {'%s__in' % query_field: missing.keys()}
+        backfill = {}
+        for user in User.objects(**query):
+            value = str(getattr(user, query_field))
+            if value in missing:
+                users[value] = user
+                backfill[missing[value]] = user
+
+        if backfill:
+            cache.cache.set_many(backfill)
+
+    return users
+
+
+def get_users_by_usernames(usernames, ignore_permission=False):
+    """Gets Yo user accounts for many usernames in bulk
+
+    Returns:
+        A dict of upper cased username to User. Usernames without an
+        account are left out.
+    """
+    usernames = [str(username).upper() for username in usernames]
+    users = _get_memoized_many(_get_user_by_username, usernames, 'username')
+
+    if not ignore_permission:
+        for user in users.values():
+            assert_view_permission(user, 'No permission to view user.')
+
+    return users
+
+
+def get_users_by_ids(user_ids, ignore_permission=False):
+    """Gets Yo user accounts for many user ids in bulk
+
+    Returns:
+        A dict of user id to User. Ids without an account are left out.
+    """
+    user_ids = [str(user_id) for user_id in user_ids]
+    users = _get_memoized_many(_get_user, user_ids, 'id')
+
+    if not ignore_permission:
+        for user in users.values():
+            assert_view_permission(user, 'No permission to view user.')
+
+    return users
+
+
 def find_user_id(**kwargs):
     user_ids = find_user_ids(**kwargs)
     if not user_ids:
@@ -969,6 +1152,9 @@ def update_user(user=None, ignore_permission=False, **kwargs):
     if kwargs.get('status'):
         kwargs.update({'status_last_updated': get_usec_timestamp()})
 
+    if 'api_token' in kwargs and kwargs['api_token'] != user.api_token:
+        revoke_api_token(user.api_token)
+
     for key, value in kwargs.items():
         if hasattr(user, key):
             setattr(user, key, value)
@@ -987,9 +1173,123 @@ def user_exists(username):
 
 def user_id_exists(user_id):
     """Checkes that the given user id exists"""
+    return _user_id_exists(str(user_id))
+
+
+@cache.memoize(timeout=IDENTITY_CACHE_TIMEOUT)
+def _user_id_exists(user_id):
     try:
         User.objects(id=user_id).only('id').get()
     except DoesNotExist:
         return False
 
     return True
+
+
+def clear_user_id_exists_cache(user_id):
+    """Clears the cache for the given user id existence check"""
+    cache.delete_memoized(_user_id_exists, str(user_id))
+
+
+def _get_identity_cache_key(kind, token):
+    # Tokens are hashed so they never show up in cache keys.
+    token_hash = hashlib.sha1(token.encode('utf-8')).hexdigest()
+    return 'yoapi:identity:%s:%s' % (kind, token_hash)
+
+
+def get_user_id_by_api_token(api_token):
+    """Returns the id of the user an api token belongs to
+
+    Returns None unless exactly one user matches. Only tokens that resolve
+    are cached.
+    """
+    if not api_token:
+        return None
+
+    cache_key = _get_identity_cache_key('api', api_token)
+    user_id = cache.cache.get(cache_key)
+    if user_id:
+        return user_id
+
+    user_ids = find_user_ids(api_token=api_token)
+    if len(user_ids) != 1:
+        return None
+
+    user_id = user_ids[0]
+    cache.cache.set(cache_key, user_id, timeout=IDENTITY_CACHE_TIMEOUT)
+    return user_id
+
+
+def revoke_api_token(api_token):
+    """Clears the cached user for an api token"""
+    if api_token:
+        cache.cache.delete(_get_identity_cache_key('api', api_token))
+
+
+def _find_unlowered_access_token(access_token, exact):
+    """Finds an OAuth token saved before its lower cased copy existed
+
+    The token is given its lower cased copy so later lookups find it with
+    the index. Once no such tokens are left this process stops looking.
+    """
+    if not _unlowered_access_tokens[0]:
+        return None
+
+    tokens = Token.objects(access_token_lower__exists=False,
+                           access_token__exists=True)
+    if not tokens.only('id').as_pymongo().first():
+        _unlowered_access_tokens[0] = False
+        return None
+
+    if exact:
+        tokens = tokens.filter(access_token=access_token)
+    else:
+        tokens = tokens.filter(access_token__iexact=access_token)
+    token = tokens.only('user', 'access_token').as_pymongo().first()
+    if token:
+        Token.objects(id=token['_id']).update(
+            set__access_token_lower=token['access_token'].lower())
+    return token
+
+
+def get_user_id_by_access_token(access_token, exact=False):
+    """Returns the id of the user an OAuth access token belongs to
+
+    Access tokens are matched case insensitively unless exact is set. Both
+    lookups use the index on the lower cased copy. Tokens saved before it
+    existed are found without the index once and backfilled.
+    """
+    if not access_token or not isinstance(access_token, basestring):
+        return None
+
+    access_token_lower = access_token.lower()
+    if exact:
+        cache_key = _get_identity_cache_key('oauth-exact', access_token)
+    else:
+        cache_key = _get_identity_cache_key('oauth', access_token_lower)
+    user_id = cache.cache.get(cache_key)
+    if user_id:
+        return user_id
+
+    tokens = Token.objects(access_token_lower=access_token_lower)
+    if exact:
+        tokens = tokens.filter(access_token=access_token)
+    token = tokens.only('user').as_pymongo().first()
+    if not token:
+        token = _find_unlowered_access_token(access_token, exact)
+    if not token or not token.get('user'):
+        return None
+
+    user_id = str(get_reference_id(token['user']))
+    cache.cache.set(cache_key, user_id, timeout=IDENTITY_CACHE_TIMEOUT)
+    return user_id
+
+
+def revoke_access_tokens(tokens):
+    """Deletes OAuth tokens and clears their cached users"""
+    for token in tokens:
+        if token.access_token:
+            cache.cache.delete_many(
+                _get_identity_cache_key('oauth', token.access_token.lower()),
+                _get_identity_cache_key('oauth-exact', token.access_token))
+        token.delete()
@@ -7,14 +7,16 @@ import string
 from flask import request, g
 from mongoengine import DoesNotExist
 
-from ..notification_endpoints import (get_user_endpoints, subscribe,
+from ..notification_endpoints import (subscribe,
                                       unsubscribe, register_device,
                                       unregister_device,
                                       make_fingerprint_for_request, create_poll_user, get_useragent_profile,
-                                      clear_get_user_endpoints_cache)
+                                      clear_get_user_endpoints_cache,
+                                      clear_endpoint_owners_cache)
 
 from ..accounts import get_user, create_user, record_signup_location, record_get_me_location
 from ..errors import APIError
+from ..permissions import assert_account_permission
 from yoapi.core import log_to_slack
 from yoapi.jwt import generate_token
 from yoapi.models import NotificationEndpoint, User
@@ -51,7 +53,10 @@ def route_get_endpoints():
         user = get_user(username=username)
     else:
         user = g.identity.user
-    endpoints = get_user_endpoints(user)
+    assert_account_permission(user, 'No permission to access user.')
+
+    # The cached endpoints don't carry tokens so load the documents.
+    endpoints = NotificationEndpoint.objects(owner=user)
     endpoints = [endpoint.get_dict() for endpoint in endpoints]
     return make_json_response(endpoints=endpoints)
 
@@ -105,6 +110,8 @@ def route_register_device():
 
         # Upsert so calls in quick succession succeed.
         endpoints = NotificationEndpoint.objects(installation_id=request.installation_id, platform=platform)
+        # The installation may be handed over from another user.
+        clear_endpoint_owners_cache(endpoints)
         endpoints.modify(upsert=True,
                          set__installation_id=request.installation_id,
                          set__platform=platform,
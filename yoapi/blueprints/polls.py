@@ -26,7 +26,11 @@ from yoapi.manage import login
 from yoapi.models import Yo, Contact, NotificationEndpoint
 from yoapi.models.polls_client_app import PollsClientApp
 from yoapi.models.push_app import PushApp, EnabledPushApp
-from yoapi.notification_endpoints import register_device, get_useragent_profile
+from yoapi.notification_endpoints import (register_device, get_useragent_profile,
+                                         clear_endpoint_owners_cache,
+                                         clear_get_user_endpoints_cache)
+from yoapi.polls import (count_poll_reply, get_poll_counts,
+                         get_poll_reply_senders)
 from yoapi.services import low_rq
 from yoapi.services.scheduler import schedule_yo
 from yoapi.yoflask import Blueprint
@@ -46,15 +50,8 @@ def send_results(poll_id):
     left_reply_text = poll.response_pair.split('.')[0]
     right_reply_text = poll.response_pair.split('.')[1]
 
-    left_replies = Yo.objects.filter(reply_to=poll_id, text=left_reply_text)
-    left_reply_users = []
-    for reply in left_replies:
-        left_reply_users.append(reply.sender)
-
-    right_replies = Yo.objects.filter(reply_to=poll_id, text=right_reply_text)
-    right_reply_users = []
-    for reply in right_replies:
-        right_reply_users.append(reply.sender)
+    left_reply_users = get_poll_reply_senders(poll, left_reply_text)
+    right_reply_users = get_poll_reply_senders(poll, right_reply_text)
 
     left_count = len(left_reply_users) or 0
     right_count = len(right_reply_users) or 0
@@ -231,11 +228,7 @@ def route_get_poll(poll_id):
 
     result = {}
 
-    left_reply_button = yo.response_pair.split('.')[0]
-    right_reply_button = yo.response_pair.split('.')[1]
-
-    left_replies_count = Yo.objects.filter(reply_to=yo, text=left_reply_button).count()
-    right_replies_count = Yo.objects.filter(reply_to=yo, text=right_reply_button).count()
+    left_replies_count, right_replies_count = get_poll_counts(yo)
 
     result.update({'id': yo.yo_id})
 
@@ -452,12 +445,7 @@ def route_polls_reply():
             left_real_reply_text = replied_to_yo.left_reply or left_reply_text
             right_real_reply_text = replied_to_yo.right_reply or right_reply_text
 
-            left_count = Yo.objects.filter(reply_to=replied_to_yo, text=left_reply_text).count()
-            right_count = Yo.objects.filter(reply_to=replied_to_yo, text=right_reply_text).count()
-
-            replied_to_yo.left_replies_count = left_count
-            replied_to_yo.right_replies_count = right_count
-            replied_to_yo.save()
+            left_count, right_count = count_poll_reply(replied_to_yo, reply_text)
 
             total_count = left_count + right_count
             if total_count == 0:
@@ -683,6 +671,7 @@ def route_polls_installations():
         sdk_version = profile.get('sdk_version')
 
         # Upsert so calls in quick succession succeed.
+        clear_endpoint_owners_cache(endpoints)
         endpoints.modify(upsert=True,
                          set__token=push_token,
                          set__platform=platform,
@@ -691,6 +680,7 @@ def route_polls_installations():
                          set__version=version,
                          set__os_version=os_version,
                          set__sdk_version=sdk_version)
+        clear_get_user_endpoints_cache(user)
 
         return make_json_response({})
 
@@ -707,6 +697,7 @@ def route_polls_installations_single(installation_id):
 
     elif request.method == 'DELETE':
         item.delete()
+        clear_get_user_endpoints_cache(user)
         return make_json_response({'status_code': 204})
 
     elif request.method == 'PUT':
@@ -5,6 +5,7 @@ from flask import g, request
 from mongoengine import DoesNotExist
 from oauthlib.common import generate_token
 from werkzeug.security import gen_salt
+from yoapi.accounts import revoke_access_tokens
 from yoapi.blueprints.accounts import route_set_me, route_get_me
 from yoapi.blueprints.contacts import route_list_contacts, route_add_contact
 from yoapi.blueprints.yos import route_get_unread_yos, route_yo
@@ -145,7 +146,7 @@ def single_authorized_app(client_id):
                 user=user.id,
                 client_id=client_id
             )
-            token.delete()
+            revoke_access_tokens([token])
         except DoesNotExist:
             raise APIError('Client not found.', status_code=404)
         return make_json_response()
@@ -199,7 +200,7 @@ def access_token():
     item = Client.objects.get(
         client_id__iexact=request.args.get('client_id')
     )
-    Token.objects(client_id=item.client_id, user=user).delete()
+    revoke_access_tokens(Token.objects(client_id=item.client_id, user=user))
 
     expires = datetime.utcnow() + timedelta(days=365)
 
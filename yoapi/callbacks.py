@@ -7,7 +7,7 @@ from mongoengine import DoesNotExist
 
 from .accounts import (_get_user, clear_get_user_cache, get_user,
                        write_through_user_cache, update_user)
-from .contacts import (clear_get_contacts_cache,
+from .contacts import (clear_follower_ids, clear_get_contacts_cache,
                        clear_get_contacts_last_yo_cache,
                        clear_get_followers_cache, get_contact_pair)
 from .core import sns
@@ -210,6 +210,10 @@ def _consume_pseudo_user_async(user_id, pseudo_user_id, owner_contact_targets):
         c.save()
         clear_get_contacts_cache(c.owner)
 
+    # The followers moved from the pseudo user so reload both id sets.
+    clear_follower_ids(user)
+    clear_follower_ids(pseudo_user_id)
+
     for uid in owner_contact_targets:
         u = _get_user(user_id=uid)
         clear_get_followers_cache(u)
@@ -6,6 +6,7 @@ from mongoengine import DoesNotExist
 from yoapi.accounts import get_user
 from yoapi.core import cache
 from yoapi.errors import APIError
+from yoapi.localization import clear_region_bounds
 from yoapi.models import Header
 from yoapi.models.region import Region
 from yoapi.models.reengagement_push import ReengagementPush
@@ -116,6 +117,8 @@ def update_items(payload):
 
 def clear_get_item_cache(class_name, item_id):
     cache.delete_memoized(get_item_by_id, class_name, item_id)
+    if class_name == 'Region':
+        clear_region_bounds()
 
 
 #@cache.memoize()
@@ -135,6 +135,35 @@ class Default(object):
     AWS_ACCESS_KEY_ID = env('YO_AWS_ACCESS_KEY_ID')
     AWS_SECRET_ACCESS_KEY = env('YO_AWS_SECRET_ACCESS_KEY')
 
+    # Bounded pool of keep-alive SNS connections per worker process.
+    SNS_POOL_SIZE = env('SNS_POOL_SIZE', default=10, cast=int)
+    SNS_POOL_MAX_IDLE = env('SNS_POOL_MAX_IDLE', default=300, cast=int)
+
+    # Pooled, circuit-broken client used for user callbacks and webhooks.
+    CALLBACK_TIMEOUT = env('CALLBACK_TIMEOUT', default=3, cast=int)
+    CALLBACK_CONCURRENCY = env('CALLBACK_CONCURRENCY', default=20, cast=int)
+    CALLBACK_POOL_HOSTS = 100
+    CALLBACK_POOL_PER_HOST = 10
+    CALLBACK_BREAKER_THRESHOLD = 5
+    CALLBACK_BREAKER_RESET_TIMEOUT = 60
+    CALLBACK_BREAKER_HOSTS = 1000
+
+    # Link content types are probed once and cached. Failed probes are
+    # cached for a shorter time so that broken links get retried.
+    LINK_CONTENT_TYPE_TIMEOUT = env('LINK_CONTENT_TYPE_TIMEOUT', default=3,
+                                    cast=int)
+    LINK_CONTENT_TYPE_CACHE_TIMEOUT = 60 * 60 * 24
+    LINK_CONTENT_TYPE_ERROR_TIMEOUT = 60 * 10
+
+    # Reverse geocoded cities are cached by coordinates rounded to this many
+    # decimals. Two decimals make cells of roughly a kilometer.
+    GEOCODE_PRECISION = env('GEOCODE_PRECISION', default=2, cast=int)
+    GEOCODE_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+    # Seconds that each process keeps the bounds of regions before
+    # reloading them.
+    REGION_BOUNDS_TIMEOUT = 60
+
     BITLY_API_KEY = env('BITLY_API_KEY')
 
     MIXPANEL_API_KEY = env('MIXPANEL_API_KEY')
@@ -143,7 +172,13 @@ class Default(object):
     CACHE_KEY_PREFIX = 'YOAPI'
 
     CACHE_ENABLED = True
-    CACHE_TYPE = env('CACHE_TYPE', default='redis')
+    CACHE_TYPE = env('CACHE_TYPE',
+                     default='yoapi.extensions.local_cache.two_tier_redis')
+
+    # Process-local LRU kept in front of redis for hot memoized getters.
+    # A size of 0 disables it.
+    CACHE_LOCAL_SIZE = env('CACHE_LOCAL_SIZE', default=10000, cast=int)
+    CACHE_LOCAL_TIMEOUT = env('CACHE_LOCAL_TIMEOUT', default=5, cast=int)
 
     # See Flask-Cors documentation for more information.
     # http://flask-cors.readthedocs.org/
@@ -192,6 +227,13 @@ class Default(object):
 
     LOG_LEVEL = logging.DEBUG
 
+    # Log records are written to stdout in batches from a greenlet. Set
+    # LOG_QUEUE_SIZE to 0 to write them on the request instead. Once the
+    # queue is half full only one in LOG_SAMPLE_RATE info records is kept.
+    LOG_QUEUE_SIZE = env('LOG_QUEUE_SIZE', default=10000, cast=int)
+    LOG_BATCH_SIZE = 100
+    LOG_SAMPLE_RATE = 10
+
     MAILCHIMP_API_KEY = env('MAILCHIMP_API_KEY')
     MAILCHIMP_LIST_ID = env('MAILCHIMP_LIST_ID')
     MAILCHIMP_SERVER = env('MAILCHIMP_SERVER')
@@ -294,6 +336,9 @@ class Production(Default):
     CACHE_DEFAULT_TIMEOUT = 30 * 24 * 3600
     CACHE_ENABLED = True
     CACHE_REDIS_URL = env('CACHE_REDIS_URL')
+    # Direct connection for local cache invalidations since twemproxy
+    # in front of CACHE_REDIS_URL does not support pub/sub.
+    CACHE_PUBSUB_REDIS_URL = env('CACHE_PUBSUB_REDIS_URL', optional=True)
 
     # Debug mode the debugger will kick in when an unhandled exception occurs
     # and the integrated server will automatically reload the application if
@@ -41,3 +41,8 @@ DEFAULT_CONTEXTS = [LOCATION_CTX, DEFAULT_CTX, CAMERA_CTX]
 # we are creating banners for context ids that exist.
 VALID_CONTEXT_IDS = [AUDIO_CTX, CAMERA_CTX, DEFAULT_CTX, EMOJI_CTX, GIPHY_CTX,
                      LOCATION_CTX, CLIPBOARD_CTX, EASTER_EGG_CTX]
+
+# Sending a yo with any of these within CONTEXT_USAGE_DAYS unlocks all of
+# the contexts.
+UNLOCKING_CONTEXT_IDS = [GIPHY_CTX, EMOJI_CTX]
+CONTEXT_USAGE_DAYS = 27
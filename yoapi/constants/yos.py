@@ -5,7 +5,21 @@
 
 QUEUING_WORKERS = 10
 PARTITION_SIZE = 2000
+PUSH_BATCH_SIZE = 500
+# Child yos are created and read back in chunks of this many recipients.
+# Keep it a multiple of PUSH_BATCH_SIZE and PARTITION_SIZE.
+CHILD_YO_CHUNK_SIZE = 10000
 UNREAD_YOS_FETCH_LIMIT = 20
+# The newest unread yo ids of each user are kept in a redis sorted set per
+# app. Inboxes that aren't used expire and are rebuilt from mongo.
+UNREAD_YO_STATUSES = ['sent', 'received']
+UNREAD_INBOX_APP_ID = 'co.justyo.yoapp'
+UNREAD_INBOX_SIZE = 100
+UNREAD_INBOX_TIMEOUT = 60 * 60 * 24 * 7
+# Thumbnails are stored under a hash of their source url so they are only
+# rendered once per image.
+THUMBNAIL_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+THUMBNAIL_DOWNLOAD_TIMEOUT = 10
 LIVE_YO_CHANNEL = 'live-yos'
 LIVE_YO_COMMAND = 'live-yo'
 WELCOME_MESSAGE_COPY = 'Yo is an app that lets you share the moments that need no words. To stop receiving Yos by SMS reply STOP.'
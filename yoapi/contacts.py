@@ -3,19 +3,39 @@
 """Account management package."""
 
 from collections import namedtuple
+from uuid import uuid4
 
 from flask import current_app, g
 from phonenumbers.phonenumberutil import NumberParseException
 from .async import async_job
 from .permissions import assert_account_permission
-from .core import cache, twilio
+from .core import cache, redis, twilio
 from .helpers import get_usec_timestamp, clean_phone_number
 from .errors import APIError
-from .accounts import clear_get_user_cache
+from .accounts import clear_get_user_cache, get_users_by_ids
 from .models import User, Contact, YoToken, Yo
+from .models.user import get_reference_id
 from .services import low_rq
 
 
+# Follower ids are kept in a sorted set per user scored by follow time.
+# The set always holds a sentinel member scored 0 so that an account
+# without followers can be told apart from one not loaded into redis yet.
+# Follows that land while the set is loaded are kept in a pending set and
+# merged in once the load is done.
+FOLLOWER_IDS_KEY = 'yoapi:followers:%s'
+FOLLOWER_IDS_SENTINEL = '-'
+FOLLOWER_IDS_CHUNK_SIZE = 1000
+FOLLOWER_IDS_SNAPSHOT_TIMEOUT = 3600
+
+# Ids of the users blocked by a user are kept in a set that also holds a
+# sentinel member once loaded from mongo. The sets expire so that one that
+# missed an update while being loaded is rebuilt.
+BLOCKED_IDS_KEY = 'yoapi:blocked:%s'
+BLOCKED_IDS_SENTINEL = '-'
+BLOCKED_IDS_TIMEOUT = 60 * 60 * 24
+
+
 def add_contact(owner, target, contact_name=None, ignore_permission=False):
     """Adds a contact to the owner if it doesn't already exist
 
@@ -53,10 +73,13 @@ def block_contact(source, target):
     if not source.has_blocked(target):
         source.blocked.append(target)
         source.save()
+        source.blocked_ids = source.blocked_ids | {target.pk}
+        add_blocked_id(source, target)
 
         contact = get_contact_pair(source, target)
         if contact:
             contact.delete()
+            remove_follower_id(target, source)
 
         clear_get_user_cache(source)
         clear_get_contacts_cache(source, target)
@@ -99,6 +122,193 @@ def clear_get_followers_cache(user):
     cache.delete_memoized(_get_follower_contacts, user.user_id)
 
 
+def _get_blocked_ids_key(user):
+    return BLOCKED_IDS_KEY % get_reference_id(user)
+
+
+def _load_blocked_ids(user):
+    """Loads the blocked ids of a user from mongo into redis"""
+    key = _get_blocked_ids_key(user)
+    user_data = User.objects(id=get_reference_id(user)).only('blocked') \
+        .as_pymongo().first() or {}
+    blocked_ids = [str(get_reference_id(blocked))
+                   for blocked in user_data.get('blocked') or []]
+
+    pipe = redis.pipeline(transaction=False)
+    pipe.delete(key)
+    pipe.sadd(key, BLOCKED_IDS_SENTINEL, *blocked_ids)
+    pipe.expire(key, BLOCKED_IDS_TIMEOUT)
+    pipe.execute()
+    return blocked_ids
+
+
+def is_blocked(user, target):
+    """Checks if user has blocked target with a single redis lookup"""
+    if target is None:
+        return False
+
+    key = _get_blocked_ids_key(user)
+    target_id = str(get_reference_id(target))
+    pipe = redis.pipeline(transaction=False)
+    pipe.exists(key)
+    pipe.sismember(key, target_id)
+    loaded, blocked = pipe.execute()
+    if not loaded:
+        return target_id in _load_blocked_ids(user)
+
+    return bool(blocked)
+
+
+def add_blocked_id(user, target):
+    """Adds a blocked id to a user's set if it is loaded"""
+    key = _get_blocked_ids_key(user)
+    target_id = str(get_reference_id(target))
+
+    # The key is watched so that a set expiring in between is not created
+    # again without its sentinel.
+    def add(pipe):
+        loaded = pipe.exists(key)
+        pipe.multi()
+        if loaded:
+            pipe.sadd(key, target_id)
+
+    redis.transaction(add, key)
+
+
+def remove_blocked_id(user, target):
+    """Removes a blocked id from a user's set"""
+    redis.srem(_get_blocked_ids_key(user), str(get_reference_id(target)))
+
+
+def _get_follower_ids_key(user):
+    user_id = user.user_id if isinstance(user, User) else str(user)
+    return FOLLOWER_IDS_KEY % user_id
+
+
+def _load_follower_ids(user):
+    """Loads the follower ids of a user from mongo into redis
+
+    Like the baseline followers list, owners that no longer exist or that
+    have blocked the user are left out. The set is built under a temporary
+    key and stored over the real one together with the follows added
+    while it loaded, so readers never see it partly loaded.
+    """
+    key = _get_follower_ids_key(user)
+    loading_key = '%s:loading' % key
+    pending_key = '%s:pending' % key
+    user_id = user.user_id if isinstance(user, User) else str(user)
+    target_id = get_reference_id(user_id)
+    contacts = Contact.objects(target=user_id).only('owner', 'created') \
+        .as_pymongo().batch_size(FOLLOWER_IDS_CHUNK_SIZE)
+
+    tmp_key = '%s:loading:%s' % (key, uuid4().hex)
+    pipe = redis.pipeline(transaction=False)
+    # Scores are passed as keyword arguments since their position differs
+    # between the redis-py Redis and StrictRedis clients.
+    pipe.zadd(tmp_key, **{FOLLOWER_IDS_SENTINEL: 0})
+    pipe.expire(tmp_key, FOLLOWER_IDS_SNAPSHOT_TIMEOUT)
+    pipe.set(loading_key, 1, ex=FOLLOWER_IDS_SNAPSHOT_TIMEOUT)
+    pipe.execute()
+
+    def add_chunk(chunk):
+        owners = User.objects(id__in=chunk.keys()).only('id', 'blocked') \
+            .as_pymongo()
+        for owner in owners:
+            blocked = owner.get('blocked') or []
+            if any(get_reference_id(ref) == target_id for ref in blocked):
+                continue
+            pipe.zadd(tmp_key, **{str(owner['_id']): chunk[owner['_id']]})
+        pipe.execute()
+
+    chunk = {}
+    for contact in contacts:
+        if contact.get('owner'):
+            owner_id = get_reference_id(contact['owner'])
+            chunk[owner_id] = contact.get('created') or 1
+        if len(chunk) >= FOLLOWER_IDS_CHUNK_SIZE:
+            add_chunk(chunk)
+            chunk = {}
+    if chunk:
+        add_chunk(chunk)
+
+    # The key is watched so that a set stored by a concurrent load, and
+    # updated since, is not overwritten.
+    def store(pipe):
+        loaded = pipe.exists(key)
+        pipe.multi()
+        if not loaded:
+            pipe.zunionstore(key, [tmp_key, pending_key], aggregate='MAX')
+        pipe.delete(tmp_key, pending_key, loading_key)
+
+    redis.transaction(store, key)
+
+
+def add_follower_id(user, follower):
+    """Adds a follower to the follower ids of a loaded user"""
+    key = _get_follower_ids_key(user)
+    loading_key = '%s:loading' % key
+    pending_key = '%s:pending' % key
+    follower_id = follower.user_id if isinstance(follower, User) \
+        else str(follower)
+
+    # Only update sets that exist or are being loaded. Missing ones are
+    # loaded when needed.
+    def add(pipe):
+        loaded = pipe.exists(key)
+        loading = pipe.exists(loading_key)
+        pipe.multi()
+        if loaded:
+            pipe.zadd(key, **{follower_id: get_usec_timestamp()})
+        elif loading:
+            pipe.zadd(pending_key, **{follower_id: get_usec_timestamp()})
+            pipe.expire(pending_key, FOLLOWER_IDS_SNAPSHOT_TIMEOUT)
+
+    redis.transaction(add, key, loading_key)
+
+
+def remove_follower_id(user, follower):
+    """Removes a follower from the follower ids of a user"""
+    follower_id = follower.user_id if isinstance(follower, User) \
+        else str(follower)
+    redis.zrem(_get_follower_ids_key(user), follower_id)
+
+
+def clear_follower_ids(user):
+    """Drops the follower ids of a user so they are reloaded from mongo"""
+    redis.delete(_get_follower_ids_key(user))
+
+
+def iter_follower_ids(user, chunk_size=FOLLOWER_IDS_CHUNK_SIZE):
+    """Yields the follower ids of a user in lists of chunk_size
+
+    The ids are read from a snapshot of the sorted set so that follows
+    and unfollows during a long broadcast cannot skip or repeat anyone.
+    """
+    key = _get_follower_ids_key(user)
+    if not redis.exists(key):
+        _load_follower_ids(user)
+
+    snapshot_key = '%s:snapshot:%s' % (key, uuid4().hex)
+    pipe = redis.pipeline()
+    pipe.zunionstore(snapshot_key, [key])
+    pipe.expire(snapshot_key, FOLLOWER_IDS_SNAPSHOT_TIMEOUT)
+    pipe.execute()
+
+    try:
+        # Skip the sentinel which always has the lowest score.
+        start = 1
+        while True:
+            follower_ids = redis.zrange(snapshot_key, start,
+                                        start + chunk_size - 1)
+            if not follower_ids:
+                break
+
+            yield follower_ids
+            start += len(follower_ids)
+    finally:
+        redis.delete(snapshot_key)
+
+
 def find_contacts_by_facebook_ids(facebook_ids):
     """Returns contacts that match any of the given facebook ids
 
@@ -295,14 +505,24 @@ def _get_follower_contacts(user_id):
     return list(contacts)
 
 
+def get_follower_ids(user):
+    """Returns the ids of the users that have added the user"""
+    owner_ids = Contact.objects(target=user).no_dereference().scalar('owner')
+    return [str(get_reference_id(owner_id)) for owner_id in owner_ids]
+
+
 @cache.memoize()
 def _get_followers(user):
-    """Returns a list of followers."""
-    contacts = Contact.objects(target=user).select_related()
-    contacts = [contact.owner for contact in contacts
-                if not contact.has_dbrefs() and
-                   not contact.owner.has_blocked(contact.target)]
-    return list(contacts)
+    """Returns a list of followers.
+
+    Only the owner ids are read from the contacts. The users themselves
+    come from the user cache, missing ones in a single query.
+    """
+    follower_ids = get_follower_ids(user)
+    followers = get_users_by_ids(follower_ids, ignore_permission=True)
+    return [followers[follower_id] for follower_id in follower_ids
+            if follower_id in followers and
+               not followers[follower_id].has_blocked(user)]
 
 
 @cache.memoize()
@@ -366,6 +586,7 @@ def remove_contact(owner, target, ignore_permission=False):
         assert_account_permission(owner, 'Permission denied')
 
     Contact.objects(owner=owner, target=target).delete()
+    remove_follower_id(target, owner)
     clear_get_contacts_cache(owner, target)
     clear_get_followers_cache(target)
 
@@ -379,9 +600,14 @@ def unblock_contact(source, target):
     """
     if source.has_blocked(target):
         source.update(pull__blocked=target)
+        source.blocked_ids = source.blocked_ids - {target.pk}
+        remove_blocked_id(source, target)
         clear_get_user_cache(source)
         clear_get_contacts_cache(source, target)
         clear_get_followers_cache(target)
+        # Contacts kept through a block were left out of the follower ids.
+        if get_contact_pair(source, target):
+            add_follower_id(target, source)
 
 
 def upsert_contact(owner, target, last_yo=None, contact_name=None,
@@ -449,6 +675,8 @@ def upsert_contact(owner, target, last_yo=None, contact_name=None,
             set__last_yo_object=last_yo,
             set__updated=get_usec_timestamp(),
             unset__hidden=True)
+        if should_reverse_upsert:
+            add_follower_id(owner, target)
 
     # If owner has blocked said user then we unblock them.
     unblocked = False
@@ -468,6 +696,7 @@ def upsert_contact(owner, target, last_yo=None, contact_name=None,
     if is_new_contact:
         # Only clear if this is a new contact
         clear_get_followers_cache(target)
+        add_follower_id(target, owner)
 
     if (is_new_contact or unblocked) and target.in_store:
         event_data = {'event': 'service_subscribed',
@@ -509,6 +738,8 @@ def delete_user_contacts(user_id):
         clear_get_contacts_last_yo_cache(contact, user)
         clear_get_contacts_last_yo_cache(user, contact)
         clear_get_followers_cache(contact)
+        remove_follower_id(contact, user_id)
 
+    clear_follower_ids(user_id)
     if isinstance(user, User):
         clear_get_followers_cache(user)
@@ -10,17 +10,49 @@ from datetime import datetime, timedelta
 from mongoengine import DoesNotExist
 
 from .ab_test import get_enrolled_experiments
+from .accounts import update_user_activity
 from .core import cache
 from .errors import APIError
 from .helpers import assert_valid_time
 from .models import GifPhrase
 
 from .constants.context import DEFAULT_CONTEXTS, ALL_CONTEXT_IDS, LOCATION_CTX, DEFAULT_CTX, AUDIO_CTX, CAMERA_CTX
+from .constants.context import CONTEXT_USAGE_DAYS, UNLOCKING_CONTEXT_IDS
 import semver
 from yoapi.models import Yo
 from yoapi.notification_endpoints import get_useragent_profile
 
 
+def has_used_contexts(user, context_ids, since):
+    """Returns True if the user sent a yo with any of the contexts since
+    the given usec timestamp
+
+    The context times recorded on the user are read first. Yos sent before
+    those were recorded are found with a single query on the
+    (sender, context_id, created) index. What the query finds is recorded
+    on the user as well, so it runs at most once per user until the
+    recorded times fall out of the window again.
+    """
+    context_times = user.context_times or {}
+    if any(context_times.get(context_id, 0) > since
+           for context_id in context_ids):
+        return True
+
+    if user.context_times_since and user.context_times_since <= since:
+        return False
+
+    yo = Yo.objects(sender=user, context_id__in=context_ids,
+                    created__gt=since).only('context_id', 'created') \
+        .limit(1).first()
+    if yo:
+        update_user_activity(
+            user, **{'context_times.%s' % yo.context_id: yo.created})
+    else:
+        update_user_activity(user, context_times_since=since)
+
+    return yo is not None
+
+
 def get_contexts(user, request=None):
     """Gets the contexts associated with the supplied user"""
 
@@ -28,13 +60,10 @@ def get_contexts(user, request=None):
     if user is None:
         return [LOCATION_CTX, DEFAULT_CTX, CAMERA_CTX, AUDIO_CTX], default_context
 
-    week_ago = datetime.now() - timedelta(days=27)
+    week_ago = datetime.now() - timedelta(days=CONTEXT_USAGE_DAYS)
     week_ago_unix = int(time.mktime(week_ago.timetuple()) * 1e6)
 
-    if Yo.objects.filter(sender=user, created__gt=week_ago_unix, context_id='gif').count() > 0:
-        return ALL_CONTEXT_IDS, default_context
-
-    if Yo.objects.filter(sender=user, created__gt=week_ago_unix, context_id='emoji').count() > 0:
+    if has_used_contexts(user, UNLOCKING_CONTEXT_IDS, week_ago_unix):
         return ALL_CONTEXT_IDS, default_context
 
     try:
@@ -17,6 +17,7 @@ from flask_redis import Redis
 from flask_sslify import SSLify
 from flask_wtf.csrf import CsrfProtect
 
+from .extensions.dispatcher import CallbackDispatcher
 from .extensions.flask_facebook import Facebook
 from .extensions.flask_giphy import Giphy
 from .extensions.flask_imgur import Imgur
@@ -82,6 +83,9 @@ twilio = Twilio()
 # SendGrid
 sendgrid = SendGrid()
 
+# Pooled HTTP client for user callbacks and webhooks.
+callback_dispatcher = CallbackDispatcher()
+
 # Enables CORS headers on all responses.
 cors = CORS()
 
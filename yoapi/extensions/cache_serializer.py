@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""Compact serialization of cached documents"""
+
+from bson import BSON
+from mongoengine import Document
+from mongoengine.base import get_document
+from werkzeug.contrib.cache import RedisCache
+
+
+# Marks values written by this module. Werkzeug uses '!' for pickles and
+# plain digits for integers.
+MARKER = '#'
+
+# Bump when the stored format or the shape of cached documents changes.
+# Values written with any other version are treated as cache misses.
+VERSION = 1
+
+
+def _dump_document(document):
+    return {'c': document._class_name, 'd': document.to_mongo()}
+
+
+def _load_document(data):
+    document_class = get_document(data['c'])
+    return document_class._from_son(data['d'])
+
+
+def is_compactable(value):
+    """Checks if a value is a document or a list of documents"""
+    if isinstance(value, Document):
+        return value.pk is not None
+
+    if isinstance(value, list) and value:
+        return all(isinstance(item, Document) and item.pk is not None
+                   for item in value)
+
+    return False
+
+
+def dumps(value):
+    """Serializes a document or list of documents as versioned BSON"""
+    if isinstance(value, Document):
+        data = _dump_document(value)
+    else:
+        data = {'l': [_dump_document(item) for item in value]}
+
+    return MARKER + chr(VERSION) + BSON.encode(data)
+
+
+def loads(value):
+    """Rebuilds the value written by dumps
+
+    Returns None for values written with another format version.
+    """
+    if ord(value[1]) != VERSION:
+        return None
+
+    data = BSON(value[2:]).decode()
+    if 'l' in data:
+        return [_load_document(item) for item in data['l']]
+
+    return _load_document(data)
+
+
+class CompactRedisCache(RedisCache):
+    """A RedisCache that stores documents as BSON instead of pickles
+
+    Pickled documents carry every dereferenced reference along with them
+    and are slow to load. Here only the raw SON is stored and documents are
+    rebuilt with `_from_son`, leaving references to be dereferenced through
+    the cache on access. All other values are stored as before.
+    """
+
+    def dump_object(self, value):
+        if is_compactable(value):
+            return dumps(value)
+
+        return super(CompactRedisCache, self).dump_object(value)
+
+    def load_object(self, value):
+        if value is not None and value.startswith(MARKER):
+            return loads(value)
+
+        return super(CompactRedisCache, self).load_object(value)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+"""Callback and webhook dispatching module"""
+
+import time
+from collections import OrderedDict
+from urlparse import urlparse
+
+import gevent.pool
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+
+from . import FlaskExtension
+
+
+class CircuitOpenError(RequestException):
+    """Error returned for requests to a host whose circuit is open"""
+    pass
+
+
+class CircuitBreaker(object):
+    """Tracks consecutive failures of a single callback host
+
+    After `threshold` consecutive failures the circuit opens and requests
+    to the host are refused for `reset_timeout` seconds. Once that passes
+    a single trial request is let through: success closes the circuit and
+    failure opens it again.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=60):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_pending = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow_request(self):
+        if not self.is_open:
+            return True
+
+        if self.trial_pending:
+            return False
+
+        if time.time() - self.opened_at >= self.reset_timeout:
+            self.trial_pending = True
+            return True
+
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_pending = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_pending = False
+        if self.is_open or self.failures >= self.threshold:
+            self.opened_at = time.time()
+
+    def release_trial(self):
+        """Lets another trial through after one ended without a verdict"""
+        self.trial_pending = False
+
+
+class CallbackDispatcher(FlaskExtension):
+    """A flask extension class for dispatching user callbacks"""
+
+    EXTENSION_NAME = 'callback-dispatcher'
+
+    def __init__(self, app=None):
+        super(CallbackDispatcher, self).__init__(app=app)
+
+    def _create_instance(self, app):
+        """Init and store the dispatcher for the app."""
+        return _CallbackDispatcher(app)
+
+
+class _CallbackDispatcher(object):
+    """Sends callback requests over a shared pool of connections
+
+    Connections are kept alive and limited per host through the session
+    adapters. Batches of requests are sent concurrently from a bounded
+    greenlet pool and every host has a circuit breaker so that a slow or
+    dead host stops tying up workers. Breakers are kept for the most
+    recently used hosts only.
+    """
+
+    def __init__(self, app):
+        self.timeout = app.config.get('CALLBACK_TIMEOUT', 3)
+        self.concurrency = app.config.get('CALLBACK_CONCURRENCY', 20)
+        self.breaker_threshold = app.config.get('CALLBACK_BREAKER_THRESHOLD',
+                                                5)
+        self.breaker_reset_timeout = app.config.get(
+            'CALLBACK_BREAKER_RESET_TIMEOUT', 60)
+        self.breaker_hosts = app.config.get('CALLBACK_BREAKER_HOSTS', 1000)
+        self.breakers = OrderedDict()
+
+        adapter = HTTPAdapter(
+            pool_connections=app.config.get('CALLBACK_POOL_HOSTS', 100),
+            pool_maxsize=app.config.get('CALLBACK_POOL_PER_HOST', 10),
+            pool_block=True)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get_breaker(self, url):
+        host = urlparse(url).netloc.lower()
+        breaker = self.breakers.pop(host, None)
+        if breaker is None:
+            breaker = CircuitBreaker(threshold=self.breaker_threshold,
+                                     reset_timeout=self.breaker_reset_timeout)
+
+        # Re-insert to mark the host as most recently used.
+        self.breakers[host] = breaker
+        while len(self.breakers) > self.breaker_hosts:
+            self.breakers.popitem(last=False)
+        return breaker
+
+    def request(self, method, url, **kwargs):
+        """Sends a single request unless the host's circuit is open
+
+        Connection errors, timeouts and 5xx responses count as failures.
+        TLS certificates are verified unless verify=False is passed.
+        """
+        breaker = self.get_breaker(url)
+        if not breaker.allow_request():
+            raise CircuitOpenError('Circuit open for %s' % url)
+
+        kwargs.setdefault('timeout', self.timeout)
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except RequestException:
+            breaker.record_failure()
+            raise
+        except BaseException:
+            # Not the host's fault, but a pending trial must not keep the
+            # circuit open for good.
+            breaker.release_trial()
+            raise
+
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+        return response
+
+    def map(self, calls):
+        """Sends (method, url, kwargs) calls concurrently
+
+        Returns a list in the same order as calls holding either the
+        response or the exception raised for that call.
+        """
+
+        def send(call):
+            method, url, kwargs = call
+            try:
+                return self.request(method, url, **kwargs)
+            except Exception as err:
+                return err
+
+        pool = gevent.pool.Pool(self.concurrency)
+        return pool.map(send, calls)
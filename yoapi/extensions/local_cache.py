@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+"""Two tier cache backend for Flask-Cache"""
+
+import json
+import sys
+import time
+from collections import OrderedDict
+
+import gevent
+from redis import from_url as redis_from_url
+from redis.exceptions import RedisError
+from werkzeug.contrib.cache import BaseCache
+
+from .cache_serializer import CompactRedisCache
+
+
+INVALIDATION_CHANNEL = 'yoapi:cache:invalidate'
+
+# Published instead of a list of keys when the whole cache is cleared.
+CLEAR_ALL = '*'
+
+# Bounds in seconds for the wait before a dead listener is respawned.
+MIN_LISTEN_BACKOFF = 1
+MAX_LISTEN_BACKOFF = 60
+
+
+def compact_redis(app, config, args, kwargs):
+    """Flask-Cache factory for a redis cache storing documents as BSON
+
+    Reads the same settings as the stock Flask-Cache redis backend.
+    """
+    kwargs.update(dict(
+        host=config.get('CACHE_REDIS_HOST', 'localhost'),
+        port=config.get('CACHE_REDIS_PORT', 6379),
+    ))
+    password = config.get('CACHE_REDIS_PASSWORD')
+    if password:
+        kwargs['password'] = password
+
+    key_prefix = config.get('CACHE_KEY_PREFIX')
+    if key_prefix:
+        kwargs['key_prefix'] = key_prefix
+
+    db_number = config.get('CACHE_REDIS_DB')
+    if db_number:
+        kwargs['db'] = db_number
+
+    redis_url = config.get('CACHE_REDIS_URL')
+    if redis_url:
+        kwargs['host'] = redis_from_url(redis_url, db=kwargs.pop('db', None))
+
+    return CompactRedisCache(*args, **kwargs)
+
+
+def two_tier_redis(app, config, args, kwargs):
+    """Flask-Cache factory for a redis cache with a process-local layer
+
+    Set CACHE_TYPE to 'yoapi.extensions.local_cache.two_tier_redis' to use
+    it. Setting CACHE_LOCAL_SIZE to 0 returns the compact redis backend.
+
+    The cache redis is usually reached through twemproxy which does not
+    support pub/sub, so invalidations go over a direct connection to
+    CACHE_PUBSUB_REDIS_URL, the same server as redis_pubsub by default.
+    """
+    remote = compact_redis(app, config, args, kwargs)
+
+    size = config.get('CACHE_LOCAL_SIZE', 0)
+    if not size:
+        return remote
+
+    pubsub_url = config.get('CACHE_PUBSUB_REDIS_URL') or \
+        config.get('REDIS_URL')
+    return TwoTierCache(remote, size=size,
+                        timeout=config.get('CACHE_LOCAL_TIMEOUT', 5),
+                        logger=app.logger,
+                        pubsub_client=redis_from_url(pubsub_url))
+
+
+class TwoTierCache(BaseCache):
+    """A bounded, short lived LRU in front of a werkzeug RedisCache
+
+    Values are kept locally in their serialized form so that every caller
+    still gets its own copy of the object, but repeated lookups of hot keys
+    skip the round trip to redis. Every write and delete is published on a
+    redis channel and a greenlet in each process evicts the keys it hears
+    about. While that greenlet is not listening the local layer is bypassed.
+
+    The channel lives on pubsub_client, which must be a direct redis
+    connection. It defaults to the client of the remote cache.
+    """
+
+    def __init__(self, remote, size=10000, timeout=5, logger=None,
+                 pubsub_client=None):
+        super(TwoTierCache, self).__init__(
+            default_timeout=remote.default_timeout)
+        self.remote = remote
+        self.size = size
+        self.timeout = timeout
+        self.logger = logger
+        self.pubsub_client = pubsub_client or remote._client
+
+        self.local = OrderedDict()
+        self.listening = False
+        self.greenlet = None
+
+        # The listener is not respawned before this time after it died.
+        self.backoff = 0
+        self.retry_at = 0
+
+        # Bumped on every eviction so values fetched from redis before an
+        # invalidation arrived are not stored locally afterwards.
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def client(self):
+        return self.remote._client
+
+    def _local_get(self, key):
+        entry = self.local.pop(key, None)
+        if entry is None:
+            return None
+
+        expires_at, raw = entry
+        if expires_at < time.time():
+            return None
+
+        # Re-insert to mark the key as most recently used.
+        self.local[key] = entry
+        return raw
+
+    def _local_set(self, key, raw, generation):
+        if raw is None or generation != self.generation:
+            return
+
+        self.local.pop(key, None)
+        self.local[key] = (time.time() + self.timeout, raw)
+        while len(self.local) > self.size:
+            self.local.popitem(last=False)
+
+    def evict(self, keys):
+        """Drops keys from the local layer of this process"""
+        self.generation += 1
+        if keys == CLEAR_ALL:
+            self.local.clear()
+            return
+
+        for key in keys:
+            self.local.pop(key, None)
+
+    def _publish(self, keys):
+        self.evict(keys)
+        try:
+            self.pubsub_client.publish(INVALIDATION_CHANNEL,
+                                       json.dumps(keys))
+        except RedisError:
+            self._log_exception()
+
+    def _log_exception(self):
+        if self.logger:
+            self.logger.error('Local cache invalidation failed',
+                              exc_info=sys.exc_info())
+
+    def listen(self):
+        """Evicts keys published by other processes until disconnected"""
+        pubsub = self.pubsub_client.pubsub()
+        try:
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            for message in pubsub.listen():
+                if message['type'] == 'subscribe':
+                    self.listening = True
+                    self.backoff = 0
+                elif message['type'] == 'message':
+                    self.evict(json.loads(message['data']))
+        except (AttributeError, RedisError, ValueError):
+            self._log_exception()
+        finally:
+            # Anything could have changed while we weren't listening.
+            self.listening = False
+            self.evict(CLEAR_ALL)
+            self.backoff = min(max(self.backoff * 2, MIN_LISTEN_BACKOFF),
+                               MAX_LISTEN_BACKOFF)
+            self.retry_at = time.time() + self.backoff
+            self.greenlet = None
+            pubsub.close()
+
+    def start(self):
+        """Spawns the invalidation listener if it is not running
+
+        After the listener dies it is respawned with an exponential backoff
+        so that an unreachable redis is not hammered on every lookup.
+        """
+        if not self.greenlet and time.time() >= self.retry_at:
+            self.greenlet = gevent.spawn(self.listen)
+
+    def get(self, key):
+        self.start()
+        if self.listening:
+            raw = self._local_get(key)
+            if raw is not None:
+                self.hits += 1
+                return self.remote.load_object(raw)
+
+        self.misses += 1
+        generation = self.generation
+        raw = self.client.get(self.remote.key_prefix + key)
+        if self.listening:
+            self._local_set(key, raw, generation)
+        return self.remote.load_object(raw)
+
+    def get_many(self, *keys):
+        self.start()
+        values = {}
+        if self.listening:
+            for key in keys:
+                raw = self._local_get(key)
+                if raw is not None:
+                    values[key] = raw
+            self.hits += len(values)
+
+        missing = [key for key in keys if key not in values]
+        if missing:
+            self.misses += len(missing)
+            generation = self.generation
+            prefixed = [self.remote.key_prefix + key for key in missing]
+            for key, raw in zip(missing, self.client.mget(prefixed)):
+                values[key] = raw
+                if self.listening:
+                    self._local_set(key, raw, generation)
+
+        return [self.remote.load_object(values[key]) for key in keys]
+
+    def set(self, key, value, timeout=None):
+        result = self.remote.set(key, value, timeout=timeout)
+        self._publish([key])
+        return result
+
+    def set_many(self, mapping, timeout=None):
+        result = self.remote.set_many(mapping, timeout=timeout)
+        self._publish(list(mapping))
+        return result
+
+    def add(self, key, value, timeout=None):
+        result = self.remote.add(key, value, timeout=timeout)
+        self._publish([key])
+        return result
+
+    def delete(self, key):
+        result = self.remote.delete(key)
+        self._publish([key])
+        return result
+
+    def delete_many(self, *keys):
+        result = self.remote.delete_many(*keys)
+        self._publish(list(keys))
+        return result
+
+    def has(self, key):
+        return self.remote.has(key)
+
+    def clear(self):
+        result = self.remote.clear()
+        self._publish(CLEAR_ALL)
+        return result
+
+    def inc(self, key, delta=1):
+        result = self.remote.inc(key, delta=delta)
+        self._publish([key])
+        return result
+
+    def dec(self, key, delta=1):
+        result = self.remote.dec(key, delta=delta)
+        self._publish([key])
+        return result
+
+    def get_metrics(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self.local),
+                'listening': self.listening}
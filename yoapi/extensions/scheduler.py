@@ -21,10 +21,46 @@ class Scheduler(object):
 
     _redis_greenlet = None
     _schedule_greenlet = None
+    _claim_script = None
+
+    # Scheduled job ids are indexed in a sorted set per schedule and job
+    # type, scored by the time they are scheduled for.
+    INDEX_KEY = 'scheduler:index:%s:%s'
+    INDEX_LOADED_KEY = 'scheduler:index:%s:%s:loaded'
+    INDEX_POP_COUNT = 1000
+
+    # Claimed job ids are moved to a sorted set scored by the deadline of
+    # their lease and only removed once the job has run.
+    CLAIMED_KEY = 'scheduler:claimed:%s:%s'
+
+    # Atomically moves the ids of jobs that are due, and of claims whose
+    # lease expired, to the claimed set so that only one scheduler process
+    # runs them at a time.
+    INDEX_CLAIM_SCRIPT = """
+        local ids = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1],
+                               'LIMIT', 0, ARGV[2])
+        local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1],
+                               'LIMIT', 0, ARGV[2] - #ids)
+        if #due > 0 then
+            redis.call('ZREM', KEYS[1], unpack(due))
+        end
+        for _, id in ipairs(due) do
+            table.insert(ids, id)
+        end
+        for _, id in ipairs(ids) do
+            redis.call('ZADD', KEYS[2], ARGV[3], id)
+        end
+        return ids
+    """
 
     # Grace period in microseconds.
     grace_period = 3e8
 
+    # Lease of claimed jobs in microseconds. A claim not acknowledged in
+    # time, e.g. because the scheduler died, is run again. It must be
+    # shorter than the grace period for the job to still be due then.
+    lease_period = 6e7
+
     # Store registered callbacks
     listen_rules = {}
     lock_key_rules = {}
@@ -32,6 +68,7 @@ class Scheduler(object):
     fail_rules = {}
     schedule_rules = {}
     execute_delay_rules = {}
+    load_rules = {}
 
     execute_headers = {'User-Agent': 'JobScheduler'}
     execute_path = '/scheduled_job'
@@ -49,6 +86,11 @@ class Scheduler(object):
 
     def announce_new(self, job, job_type):
         """Register a WebSocket connection for Redis updates."""
+        if self.is_indexed(job_type):
+            schedule_name = getattr(job, 'schedule_name', None)
+            redis.zadd(self.get_index_key(job_type, schedule_name),
+                       **{str(job.id): job[self.schedule_key]})
+
         job_json_message = job.to_dict()
         if '_job_type' not in job_json_message:
             job_json_message.update({'_job_type': job_type})
@@ -56,12 +98,81 @@ class Scheduler(object):
 
         redis.publish(self.REDIS_CHAN, job_json_message)
 
+    def is_indexed(self, job_type):
+        """Jobs with a load rule are kept in the redis time index"""
+        return job_type in self.load_rules
+
+    def get_index_key(self, job_type, schedule_name=None):
+        if not schedule_name:
+            schedule_name = self.app.config.get('SCHEDULE_NAME')
+        return self.INDEX_KEY % (schedule_name, job_type)
+
+    def get_claimed_key(self, job_type):
+        schedule_name = self.app.config.get('SCHEDULE_NAME')
+        return self.CLAIMED_KEY % (schedule_name, job_type)
+
+    def load_index(self, job_type):
+        """Indexes the future jobs of a type from the database
+
+        This is only needed when redis does not have the index yet, e.g.
+        on first start or after a flush, since new jobs are indexed as
+        they are announced.
+        """
+        schedule_name = self.app.config.get('SCHEDULE_NAME')
+        key = self.get_index_key(job_type)
+        pipe = redis.pipeline(transaction=False)
+        for i, job in enumerate(self.execute_delay_rules[job_type](), 1):
+            pipe.zadd(key, **{str(job.id): job[self.schedule_key]})
+            if i % self.INDEX_POP_COUNT == 0:
+                pipe.execute()
+        pipe.set(self.INDEX_LOADED_KEY % (schedule_name, job_type), 1)
+        pipe.execute()
+
+    def _ensure_index(self, job_type):
+        schedule_name = self.app.config.get('SCHEDULE_NAME')
+        if not redis.exists(self.INDEX_LOADED_KEY % (schedule_name, job_type)):
+            self.load_index(job_type)
+
+    def claim_due_job_ids(self, job_type):
+        """Claims and returns the ids of jobs that are due
+
+        Claimed ids have to be acknowledged with ack_job_ids once their
+        job has run, or they are claimed again when the lease expires.
+        """
+        if not self._claim_script:
+            self._claim_script = redis.register_script(
+                self.INDEX_CLAIM_SCRIPT)
+
+        keys = [self.get_index_key(job_type), self.get_claimed_key(job_type)]
+        usec_now = get_usec_timestamp()
+        deadline = usec_now + int(self.lease_period)
+        job_ids = []
+        while True:
+            claimed = self._claim_script(
+                keys=keys, args=[usec_now, self.INDEX_POP_COUNT, deadline])
+            job_ids.extend(claimed)
+            if len(claimed) < self.INDEX_POP_COUNT:
+                return job_ids
+
+    def ack_job_ids(self, job_type, job_ids):
+        """Releases the claims of jobs that have run"""
+        if job_ids:
+            redis.zrem(self.get_claimed_key(job_type), *job_ids)
+
     def get_scheduled_jobs_by_type(self, job_type):
         """Gets yos scheduled between grace period start and now"""
         if not self.can_handle_job(job_type):
             message = 'Can not handle job of type %s'
             raise NotImplementedError(message % job_type)
 
+        if self.is_indexed(job_type):
+            self._ensure_index(job_type)
+            usec_now = get_usec_timestamp()
+            job_ids = redis.zrangebyscore(self.get_index_key(job_type),
+                                          usec_now - self.grace_period,
+                                          usec_now)
+            return self.load_rules[job_type](job_ids)
+
         return self.schedule_rules[job_type]()
 
 
@@ -85,15 +196,40 @@ class Scheduler(object):
             if not self.can_handle_job(job_type):
                 continue
 
-            jobs = execute_delay_rule()
-            next_job_time = self._get_minimum_delay(job_type, jobs,
-                                                    next_job_time)
+            if self.is_indexed(job_type):
+                next_job_time = self._get_index_delay(job_type,
+                                                      next_job_time)
+            else:
+                jobs = execute_delay_rule()
+                next_job_time = self._get_minimum_delay(job_type, jobs,
+                                                        next_job_time)
             if next_job_time[1] == 0:
                 break
 
         return next_job_time
 
 
+    def _get_index_delay(self, job_type, next_job_time):
+        """Reads the earliest job of a type from the time index
+
+        Expired leases are due as well so claims are retried even when no
+        new job is.
+        """
+        self._ensure_index(job_type)
+        pipe = redis.pipeline(transaction=False)
+        pipe.zrange(self.get_index_key(job_type), 0, 0, withscores=True)
+        pipe.zrange(self.get_claimed_key(job_type), 0, 0, withscores=True)
+        firsts = [first[0][1] for first in pipe.execute() if first]
+        if not firsts:
+            return next_job_time
+
+        schedule_time = max(min(firsts) - get_usec_timestamp(), 0)
+        if schedule_time < next_job_time[1]:
+            next_job_time = (job_type, schedule_time)
+
+        return next_job_time
+
+
     def _get_minimum_delay(self, job_type, jobs, next_job_time):
 
         usec_now = get_usec_timestamp()
@@ -210,6 +346,21 @@ class Scheduler(object):
     def execute_scheduled_items_now(self, job_type):
         """Execute items scheduled between grace period start and now"""
 
+        if self.is_indexed(job_type):
+            self._ensure_index(job_type)
+            # Claiming is atomic so the jobs don't need to be locked.
+            job_ids = self.claim_due_job_ids(job_type)
+            jobs = list(self.load_rules[job_type](job_ids)) if job_ids else []
+
+            # Ids that no longer load, e.g. canceled jobs, are done.
+            loaded_ids = set(str(job.id) for job in jobs)
+            self.ack_job_ids(job_type, [job_id for job_id in job_ids
+                                        if job_id not in loaded_ids])
+            for job in jobs:
+                self._execute_job(job_type, job)
+                self.ack_job_ids(job_type, [str(job.id)])
+            return
+
         jobs = self.get_scheduled_jobs_by_type(job_type)
         for job in jobs:
             key = self.get_job_lock_key(job_type, job)
@@ -217,20 +368,25 @@ class Scheduler(object):
             if locked == 1:
                 key_expire_sec = int(self.grace_period / 1e6) + 1
                 redis.expire(key, key_expire_sec)
-                with self._make_context():
-                    try:
-                        self.execute_rules[job_type](job)
-                    except Exception:
-                        # We assume the job can never
-                        # sucessfully retry
-                        if not self.ignore_failures:
-                            self.fail_rules[job_type](job)
-                            self.app.log_exception(sys.exc_info())
-                    else:
-                        self.app.process_response(make_json_response(**job.to_dict()))
+                self._execute_job(job_type, job)
                 redis.delete(key)
 
 
+    def _execute_job(self, job_type, job):
+        """Executes a job and handles its failure"""
+        with self._make_context():
+            try:
+                self.execute_rules[job_type](job)
+            except Exception:
+                # We assume the job can never
+                # sucessfully retry
+                if not self.ignore_failures:
+                    self.fail_rules[job_type](job)
+                    self.app.log_exception(sys.exc_info())
+            else:
+                self.app.process_response(make_json_response(**job.to_dict()))
+
+
     def get_job_lock_key(self, job_type, job):
         if job_type not in self.lock_key_rules:
             return 'scheduler_state_lock_%s' % str(job.id)
@@ -276,6 +432,22 @@ class Scheduler(object):
         return _inner
 
 
+    def load_jobs_handler(self, job_type=None):
+        """Registers a function loading due jobs by their ids
+
+        Registering one keeps the job type in the redis time index instead
+        of querying every future job on each scheduling loop.
+        """
+        if not job_type:
+            job_type = self.DEFAULT_JOB_TYPE
+
+        def _inner(func):
+            self.load_rules[job_type] = func
+            return func
+
+        return _inner
+
+
     def new_job_handler(self, job_type=None):
         if not job_type:
             job_type = self.DEFAULT_JOB_TYPE
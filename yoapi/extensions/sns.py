@@ -2,11 +2,97 @@
 
 """Amazon SNS extension module"""
 
+import time
+from collections import deque
+from contextlib import contextmanager
+
 import boto.sns
+from boto.exception import BotoClientError, BotoServerError
+from gevent.lock import BoundedSemaphore
 
 from . import FlaskExtension
 
 
+class SNSConnectionPool(object):
+
+    """A bounded pool of keep-alive SNS connections
+
+    A single boto connection shared by every greenlet in a worker means
+    concurrent pushes either queue up behind each other or re-handshake
+    TLS. The pool hands out at most `size` connections at a time and keeps
+    released ones around so their sockets can be reused.
+
+    Connections that sat idle longer than `max_idle` seconds are discarded
+    on checkout since AWS closes idle keep-alive sockets. Connections are
+    returned to the pool after boto errors, such as a disabled endpoint or
+    throttling, since the service answered over them. Any other error may
+    leave the connection in an unknown state so it is discarded.
+    """
+
+    def __init__(self, factory, size=10, max_idle=300):
+        self.factory = factory
+        self.size = size
+        self.max_idle = max_idle
+        self._idle = deque()
+        self._semaphore = BoundedSemaphore(size)
+        self.checkouts = 0
+        self.waits = 0
+        self.creations = 0
+        self.discards = 0
+
+    def _checkout(self):
+        while self._idle:
+            conn, released = self._idle.pop()
+            if time.time() - released <= self.max_idle:
+                return conn
+            self.discards += 1
+
+        self.creations += 1
+        return self.factory()
+
+    @contextmanager
+    def connection(self):
+        """Checks out a connection, waiting if the pool is exhausted"""
+        if self._semaphore.locked():
+            self.waits += 1
+
+        self._semaphore.acquire()
+        try:
+            self.checkouts += 1
+            conn = self._checkout()
+            try:
+                yield conn
+            except (BotoClientError, BotoServerError):
+                self._idle.append((conn, time.time()))
+                raise
+            except BaseException:
+                self.discards += 1
+                raise
+
+            self._idle.append((conn, time.time()))
+        finally:
+            self._semaphore.release()
+
+    def get_metrics(self):
+        return {'checkouts': self.checkouts,
+                'creations': self.creations,
+                'discards': self.discards,
+                'idle': len(self._idle),
+                'size': self.size,
+                'waits': self.waits}
+
+    def __getattr__(self, name):
+        """Forward boto calls to a pooled connection"""
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def pooled_call(*args, **kwargs):
+            with self.connection() as conn:
+                return getattr(conn, name)(*args, **kwargs)
+
+        return pooled_call
+
+
 class SNS(FlaskExtension):
 
     """A helper class for managing an SNS connection
@@ -58,12 +144,26 @@ class SNS(FlaskExtension):
         super(SNS, self).__init__(app=app)
 
     def _create_instance(self, app):
-        """Init and store the SNS object on the stack on first use."""
-        boto_sns_connection = boto.sns.connect_to_region(
-            'us-east-1',
-            aws_access_key_id=app.config['AWS_ACCESS_KEY_ID'],
-            aws_secret_access_key=app.config['AWS_SECRET_ACCESS_KEY'])
-        return boto_sns_connection
+        """Init and store the SNS connection pool for the app."""
+
+        def connect():
+            return boto.sns.connect_to_region(
+                'us-east-1',
+                aws_access_key_id=app.config['AWS_ACCESS_KEY_ID'],
+                aws_secret_access_key=app.config['AWS_SECRET_ACCESS_KEY'])
+
+        return SNSConnectionPool(connect,
+                                 size=app.config.get('SNS_POOL_SIZE', 10),
+                                 max_idle=app.config.get('SNS_POOL_MAX_IDLE',
+                                                         300))
+
+    def connection(self):
+        """Checks out a boto connection from the pool"""
+        return self.instance.connection()
+
+    def get_pool_metrics(self):
+        """Returns the connection pool counters for the current app"""
+        return self.instance.get_metrics()
 
     def create_platform_application_with_p12(self, name, platform, p12_content, p12_password=None):
         from OpenSSL import crypto
@@ -81,14 +181,14 @@ class SNS(FlaskExtension):
         return rv
 
     def create_platform_application_with_pem(self, name, platform, pem_cert, pem_private_key):
-        arn = self.instance.create_platform_application(
-            name=name,
-            platform=platform,
-            attributes={
-                'PlatformPrincipal': pem_cert,
-                'PlatformCredential': pem_private_key
-            })
-        return arn
+        with self.connection() as conn:
+            return conn.create_platform_application(
+                name=name,
+                platform=platform,
+                attributes={
+                    'PlatformPrincipal': pem_cert,
+                    'PlatformCredential': pem_private_key
+                })
 
     def create_endpoint(self, device_type, push_token, platform_arn=None):
         """Creates an endpoint and returns the ARN
@@ -104,11 +204,11 @@ class SNS(FlaskExtension):
         if not platform_arn:
             platform_arn = self.ARN_BY_DEVICE_TYPE[device_type]
 
-        conn = self.instance
-        return conn.create_platform_endpoint(platform_arn, push_token) \
-            .get('CreatePlatformEndpointResponse') \
-            .get('CreatePlatformEndpointResult') \
-            .get('EndpointArn')
+        with self.connection() as conn:
+            return conn.create_platform_endpoint(platform_arn, push_token) \
+                .get('CreatePlatformEndpointResponse') \
+                .get('CreatePlatformEndpointResult') \
+                .get('EndpointArn')
 
     def create_topic(self, topic_name):
         """Creates an topic and returns the ARN
@@ -120,11 +220,11 @@ class SNS(FlaskExtension):
             topic_name: Name for the topic being created.
 
         """
-        conn = self.instance
-        return conn.create_topic(topic_name) \
-            .get('CreateTopicResponse') \
-            .get('CreateTopicResult') \
-            .get('TopicArn')
+        with self.connection() as conn:
+            return conn.create_topic(topic_name) \
+                .get('CreateTopicResponse') \
+                .get('CreateTopicResult') \
+                .get('TopicArn')
 
     def get_endpoint(self, endpoint_arn):
         """Gets endpoint attributes.
@@ -133,7 +233,8 @@ class SNS(FlaskExtension):
             endpoint_arn: ARN provided by amazon.
 
         """
-        return self.instance.get_endpoint_attributes(endpoint_arn)
+        with self.connection() as conn:
+            return conn.get_endpoint_attributes(endpoint_arn)
 
     def delete_endpoint(self, endpoint_arn):
         """Deletes an endpoint
@@ -144,7 +245,8 @@ class SNS(FlaskExtension):
             endpoint_arn: ARN returned when endpoint was created.
 
         """
-        return self.instance.delete_endpoint(endpoint_arn)
+        with self.connection() as conn:
+            return conn.delete_endpoint(endpoint_arn)
 
     def set_endpoint(self, endpoint_arn, attributes):
         """Sets the attributes in sns for a given endpoint arn
@@ -157,8 +259,9 @@ class SNS(FlaskExtension):
                 Token: device provided push token
 
         """
-        self.instance.set_endpoint_attributes(endpoint_arn=endpoint_arn,
-                                              attributes=attributes)
+        with self.connection() as conn:
+            conn.set_endpoint_attributes(endpoint_arn=endpoint_arn,
+                                         attributes=attributes)
 
     def subscribe(self, topic_arn, endpoint_arn, protocol='application'):
         """Subscribes an endpoint to a topic arn
@@ -172,10 +275,11 @@ class SNS(FlaskExtension):
         Note: 'application' is used for mobile apps and devices
         """
 
-        return self.instance.subscribe(topic_arn, protocol, endpoint_arn) \
-            .get('SubscribeResponse') \
-            .get('SubscribeResult') \
-            .get('SubscriptionArn')
+        with self.connection() as conn:
+            return conn.subscribe(topic_arn, protocol, endpoint_arn) \
+                .get('SubscribeResponse') \
+                .get('SubscribeResult') \
+                .get('SubscriptionArn')
 
     def publish(self, **kwargs):
         """Publish a push message to the provided topic or endpoint arn
@@ -201,7 +305,8 @@ class SNS(FlaskExtension):
                 'data_type': 'String'
             }
         }
-        return self.instance.publish(
-            message_structure='json',
-            message_attributes=message_attributes,
-            **kwargs)
+        with self.connection() as conn:
+            return conn.publish(
+                message_structure='json',
+                message_attributes=message_attributes,
+                **kwargs)
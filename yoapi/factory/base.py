@@ -11,7 +11,8 @@ from flask import g, make_response, request
 from werkzeug.contrib.fixers import ProxyFix
 from ..callbacks import process_user_activity
 from ..core import (cache, redis, parse, errors, mongo_engine,
-                    twilio, sendgrid, cors, csrf, sslify)
+                    twilio, sendgrid, cors, csrf, sslify,
+                    callback_dispatcher)
 from ..helpers import make_json_response
 from ..permissions import assert_admin_permission
 from ..services import redis_pubsub
@@ -73,6 +74,7 @@ def create_app(name=None, override_settings=None, config=None, is_worker=False,
     app.logger  # pylint: disable=pointless-statement
 
     cache.init_app(app)
+    callback_dispatcher.init_app(app)
     errors.init_app(app)
     parse.init_app(app)
     principals.init_app(app)
@@ -15,6 +15,7 @@ from .constants.emojis import replace_emojis_with_text, text_has_emojis
 from .constants.regex import IS_ALNUM_RE
 from .contacts import (get_contact_pair, clear_get_contacts_cache,
                        clear_get_followers_cache, remove_contact,
+                       add_follower_id,
                        get_contact_objects, block_contact,
                        _get_follower_contacts)
 from .errors import APIError
@@ -175,6 +176,7 @@ def add_group_member(group, member, is_admin=None, contact_name=None,
 
     clear_get_contacts_cache(group, member)
     clear_get_followers_cache(member)
+    add_follower_id(member, group)
 
 
     # create the relationship to be owned and managed by the member.
@@ -186,6 +188,7 @@ def add_group_member(group, member, is_admin=None, contact_name=None,
 
     clear_get_contacts_cache(member, group)
     clear_get_followers_cache(group)
+    add_follower_id(group, member)
 
     # If the contact is None then it is new.
     if not contact and send_notifications:
@@ -414,6 +417,7 @@ def fix_old_group(group):
 
             new_contact.modify(upsert=True, set__updated=current_time,
                                **upsert_values)
+            add_follower_id(contact.owner, group)
 
             contact.is_group_admin = None
             contact.save()
@@ -7,7 +7,9 @@
 # pylint: disable=deprecated-module
 
 
+import base64
 import calendar
+import hashlib
 import inspect
 import random
 import string
@@ -40,6 +42,8 @@ def make_json_response(*args, **kwargs):
 
     response = jsonify(*args, **kwargs)
     response.log_json_response = log_json_response
+    # Keep the data so logging doesn't have to parse the body again.
+    response.json_data = dict(*args, **kwargs)
 
     if status_code:
         response.status_code = status_code
@@ -107,12 +111,9 @@ def generate_thumbnail_from_url(url):
     api_key = "P54E3B2A2019BE"
     secret = "S3F033C68A36DE"
 
-    url = url2png(url, api_key, secret)
-
-    #ping_url.delay(url)  # url2png only renders photo if loaded at least once
-    requests.get(url)
-
-    return url
+    # url2png only renders the page once the url has been loaded. That is
+    # left to the caller so it can be done off the send path.
+    return url2png(url, api_key, secret)
 
 
 def generate_thumbnail_from_image(image_data):
@@ -181,6 +182,33 @@ def partition_list(l, n):
         yield l[i:i + n]
 
 
+def _make_memoized_cache_key(fname, version, keyargs, keykwargs):
+    """Returns a memoize cache key in the format Flask-Cache makes them"""
+    updated = '{0}{1}{2}'.format(fname, keyargs, keykwargs)
+    cache_key = base64.b64encode(
+        hashlib.md5(updated.encode('utf-8')).digest())[:16]
+    return cache_key.decode('utf-8') + version
+
+
+def make_memoized_cache_keys(cache, func, values):
+    """Returns the memoize cache keys of a function for many values
+
+    Flask-Cache reads the version of the function from the cache every
+    time it makes a key. The version is the same for every argument of a
+    plain function, so it is read once here and the keys are built from it.
+    """
+    uncached = func.uncached
+    fname, version = cache._memoize_version(
+        uncached, timeout=getattr(func, 'cache_timeout', None))
+
+    cache_keys = []
+    for value in values:
+        keyargs, keykwargs = cache._memoize_kwargs_to_args(uncached, value)
+        cache_keys.append(_make_memoized_cache_key(fname, version, keyargs,
+                                                   keykwargs))
+    return cache_keys
+
+
 def copy_current_request_context(f):
     top = _request_ctx_stack.top
     if top is None:
@@ -198,12 +226,12 @@ def copy_current_request_context(f):
     return update_wrapper(wrapper, f)
 
 
-def get_link_content_type(link):
+def get_link_content_type(link, timeout=10):
     # All links uploaded via the dashboard begin with this prefix
     if link.startswith(current_app.config.get('IMAGE_WRAPPER_PREFIX')):
         return 'image/jpg'
 
-    resp = requests.head(link, timeout=10, allow_redirects=True)
+    resp = requests.head(link, timeout=timeout, allow_redirects=True)
     resp.raise_for_status()
 
     return resp.headers.get('Content-Type', 'application/unknown')
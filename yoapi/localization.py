@@ -1,16 +1,30 @@
+import math
+import time
 from collections import namedtuple
+
+from flask import current_app
+from gevent.event import AsyncResult
 from haversine import haversine
+from pygeocoder import GeocoderError
 
 
 # While we automatically add a visitor's country code to the store query, we
 # do not trust any geo lookup package to correctly/predictably labeling
 # cities. The next best thing is to define a city by its coordinates and
 # compare distances. TODO: The data source for this should be MongoDB.
-from yoapi.core import cache
+from yoapi.core import cache, geocoder, redis
 from yoapi.models.region import Region
 
 LocalizedCity = namedtuple('LocalizedCity', ['point', 'radius'])
 
+# A region with a bounding box around its circle, so that most locations
+# outside of it can be ruled out without computing distances.
+RegionBounds = namedtuple('RegionBounds', ['name', 'point', 'radius',
+                                           'min_latitude', 'max_latitude',
+                                           'min_longitude', 'max_longitude'])
+
+EARTH_RADIUS_MILES = 3958.8
+
 AUSTIN_COORDINATES = (30.2500, -97.7500)
 AUSTIN_RADIUS = 20
 
@@ -37,6 +51,15 @@ LOCALIZED_CITIES = {
     'UW': LocalizedCity(UW_COOR, RADIUS)
     }
 
+# Process-local bounds of every region by region id. They are reloaded
+# every REGION_BOUNDS_TIMEOUT seconds.
+_region_bounds = {}
+_region_bounds_expiry = [0]
+
+# Reverse geocoding lookups in flight by cache key, so that concurrent
+# lookups in the same cell share one request.
+_pending_city_lookups = {}
+
 
 @cache.memoize()
 def get_regions():
@@ -49,20 +72,158 @@ def get_region_by_name(name):
 
 
 def get_region(coordinates):
-    """Looks up localized city by request IP"""
+    """Looks up localized city by request IP
+
+    Every region is checked against the process-local bounds, so most of
+    them are ruled out by their bounding box alone.
+    """
 
     # If we can't determine the coordinates associated with the request then
     # we simply return nothing.
     if not coordinates:
         return None
 
-    # In the future, this should probably use the result of a geopoint query
-    # to mongodb.
-    regions = get_regions()
-    for region in regions:
-        point = (region.latitude, region.longitude)
-        distance = haversine(coordinates,
-                             point,
-                             miles=True)
-        if distance <= region.radius:
-            return region.name
+    for bounds in _get_region_bounds().itervalues():
+        if _is_in_bounds(bounds, coordinates):
+            return bounds.name
+
+
+def _make_region_bounds(region):
+    """Returns the bounds of a region"""
+    latitude_delta = math.degrees(region.radius / EARTH_RADIUS_MILES)
+    min_latitude = max(region.latitude - latitude_delta, -90)
+    max_latitude = min(region.latitude + latitude_delta, 90)
+
+    # Degrees of longitude shrink towards the poles so use the latitude
+    # closest to a pole. Boxes that reach a pole or wrap around the
+    # antimeridian don't limit the longitude.
+    widest_latitude = max(abs(min_latitude), abs(max_latitude))
+    min_longitude, max_longitude = -180, 180
+    if widest_latitude < 90:
+        longitude_delta = latitude_delta / math.cos(
+            math.radians(widest_latitude))
+        if (region.longitude - longitude_delta >= -180 and
+                region.longitude + longitude_delta <= 180):
+            min_longitude = region.longitude - longitude_delta
+            max_longitude = region.longitude + longitude_delta
+
+    return RegionBounds(region.name, (region.latitude, region.longitude),
+                        region.radius,
+                        min_latitude, max_latitude,
+                        min_longitude, max_longitude)
+
+
+def _get_region_bounds():
+    """Returns the bounds of every region, keyed by region id"""
+    if time.time() > _region_bounds_expiry[0]:
+        regions = Region.objects(latitude__exists=True,
+                                 longitude__exists=True,
+                                 radius__exists=True) \
+            .only('name', 'latitude', 'longitude', 'radius')
+        bounds = dict((region.id, _make_region_bounds(region))
+                      for region in regions)
+        _region_bounds.clear()
+        _region_bounds.update(bounds)
+        _region_bounds_expiry[0] = (
+            time.time() + current_app.config.get('REGION_BOUNDS_TIMEOUT'))
+
+    return _region_bounds
+
+
+def clear_region_bounds():
+    """Makes the next lookup reload the bounds of every region"""
+    _region_bounds_expiry[0] = 0
+
+
+def _load_region_bounds(region_id):
+    """Loads the bounds of a region missing from the process-local ones"""
+    region = Region.objects(id=region_id, latitude__exists=True,
+                            longitude__exists=True, radius__exists=True) \
+        .only('name', 'latitude', 'longitude', 'radius').first()
+    if not region:
+        return None
+
+    bounds = _region_bounds[region_id] = _make_region_bounds(region)
+    return bounds
+
+
+def _is_in_bounds(bounds, coordinates):
+    """Returns True if the coordinates are within the radius of a region
+
+    The bounding box of the region is checked before the exact distance.
+    """
+    latitude, longitude = coordinates
+    if not (bounds.min_latitude <= latitude <= bounds.max_latitude and
+            bounds.min_longitude <= longitude <= bounds.max_longitude):
+        return False
+
+    return haversine(coordinates, bounds.point, miles=True) <= bounds.radius
+
+
+def is_in_region(region_id, coordinates):
+    """Returns False if the coordinates are outside of a region
+
+    Regions created since the bounds were loaded are looked up on their
+    own. Regions that don't exist or have no center exclude everyone.
+    """
+    bounds = _get_region_bounds().get(region_id) or \
+        _load_region_bounds(region_id)
+    if not bounds:
+        return False
+
+    return _is_in_bounds(bounds, coordinates)
+
+
+def _get_location_city_key(latitude, longitude):
+    return 'yoapi:geocode:%s,%s' % (latitude, longitude)
+
+
+def _reverse_geocode_city(latitude, longitude):
+    """Looks up the city at a location and caches it"""
+    try:
+        addresses = geocoder.reverse_geocode(latitude, longitude)
+        city = addresses[0].city if addresses.count else None
+    except GeocoderError as err:
+        # Other errors, e.g. hitting the rate limit, are not cached.
+        if err.status != GeocoderError.G_GEO_ZERO_RESULTS:
+            raise
+        city = None
+
+    key = _get_location_city_key(latitude, longitude)
+    redis.set(key, (city or u'').encode('utf-8'),
+              current_app.config.get('GEOCODE_CACHE_TIMEOUT'))
+    return city
+
+
+def get_location_city(latitude, longitude):
+    """Returns the city at a location, or None if there isn't one
+
+    Cities are cached in redis by coordinates rounded to GEOCODE_PRECISION
+    decimals, so nearby yos only need one geocoder request. Concurrent
+    lookups in the same cell wait for the request already in flight.
+    """
+    precision = current_app.config.get('GEOCODE_PRECISION')
+    latitude = round(latitude, precision)
+    longitude = round(longitude, precision)
+
+    key = _get_location_city_key(latitude, longitude)
+    city = redis.get(key)
+    if city is not None:
+        return city.decode('utf-8') or None
+
+    pending = _pending_city_lookups.get(key)
+    if pending:
+        return pending.get()
+
+    pending = _pending_city_lookups[key] = AsyncResult()
+    try:
+        city = _reverse_geocode_city(latitude, longitude)
+    except Exception as err:
+        pending.set_exception(err)
+        raise
+    else:
+        pending.set(city)
+    finally:
+        del _pending_city_lookups[key]
+
+    return city
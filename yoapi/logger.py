@@ -6,6 +6,7 @@ TODO: This should be moved into its own repository so it can beresued across
 different flask apps.
 """
 
+import atexit
 import logging
 import hashlib
 import requests
@@ -13,11 +14,14 @@ import socket
 import sys
 import traceback
 
+import gevent
+
 
 from cStringIO import StringIO
 from datetime import datetime
 from flask import json, request, current_app, g, _request_ctx_stack
 from collections import OrderedDict
+from gevent.queue import Queue, Empty, Full
 from coloredlogs import ColoredStreamHandler
 from logging import Formatter, StreamHandler, getLogger
 from logging.handlers import BufferingHandler
@@ -120,9 +124,22 @@ class JSONLogger(object):
         app.extensions[EXTENSION_NAME][self] = (adapter, logger)
 
     def _create_stream_handler(self, app):
-        """Creates a logger for a Flask application"""
+        """Creates a logger for a Flask application
+
+        Records are written from a greenlet in batches unless
+        LOG_QUEUE_SIZE is 0.
+        """
         handler = StreamHandler(sys.stdout)
-        return handler
+        queue_size = app.config.get('LOG_QUEUE_SIZE')
+        if not queue_size:
+            return handler
+
+        queue_handler = QueueHandler(
+            handler, size=queue_size,
+            batch_size=app.config.get('LOG_BATCH_SIZE', 100),
+            sample_rate=app.config.get('LOG_SAMPLE_RATE', 10))
+        atexit.register(queue_handler.flush)
+        return queue_handler
 
     def _create_email_handler(self, app, sendgrid, redis):
         """Creates a logger for a Flask application"""
@@ -187,17 +204,21 @@ class JSONFormatter(Formatter):
 
     @classmethod
     def _filter_content(cls, data):
-        """Filters some content from request/response payload"""
+        """Filters some content from request/response payload
+
+        A filtered copy is returned since the payload can be the same
+        object the response was built from.
+        """
         if isinstance(data, list):
-            for item in data:
-                item = cls._filter_content(item)
+            return [cls._filter_content(item) for item in data]
         if isinstance(data, dict):
+            rv = OrderedDict() if isinstance(data, OrderedDict) else {}
             for field_name, value in data.items():
                 if field_name in cls._excluded_fields:
-                    data[field_name] = 'REDACTED'
+                    rv[field_name] = 'REDACTED'
                 else:
-                    if isinstance(value, dict) or isinstance(value, list):
-                        value = cls._filter_content(value)
+                    rv[field_name] = cls._filter_content(value)
+            return rv
         return data
 
     def format(self, record):
@@ -207,7 +228,10 @@ class JSONFormatter(Formatter):
             indent = 4
 
         if isinstance(record.msg, dict):
+            # Records can be formatted outside of the app context so pass
+            # the encoder explicitly.
             rv = json.dumps(self._filter_content(record.msg),
+                            cls=self.app.json_encoder,
                             sort_keys=False,
                             indent=indent)
         else:
@@ -295,6 +319,120 @@ class LoggerAdapter(logging.LoggerAdapter):
         return rv, kwargs
 
 
+class QueueHandler(logging.Handler):
+
+    """Hands records to a greenlet that formats and writes them in batches
+
+    Records are queued as they are and formatted by the target handler when
+    written, so formatting and the write to the stream happen off the
+    request. The queue is bounded. Once it is half full only one in
+    `sample_rate` records below WARNING is kept, and when it is full records
+    are dropped. Both are counted and reported in the stream.
+    """
+
+    def __init__(self, target, size=10000, batch_size=100, sample_rate=10):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.size = size
+        self.batch_size = batch_size
+        self.sample_rate = sample_rate
+
+        self.queue = Queue(maxsize=size)
+        self.greenlet = None
+
+        self.queued = 0
+        self.written = 0
+        self.sampled = 0
+        self.dropped = 0
+        self._reported_sampled = 0
+        self._reported_dropped = 0
+        self._sample_count = 0
+
+    def setFormatter(self, formatter):
+        logging.Handler.setFormatter(self, formatter)
+        self.target.setFormatter(formatter)
+
+    def emit(self, record):
+        if record.levelno < logging.WARNING and self.sample_rate > 1:
+            if self.queue.qsize() >= self.size / 2:
+                self._sample_count += 1
+                if self._sample_count % self.sample_rate:
+                    self.sampled += 1
+                    return
+
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+            return
+
+        self.queued += 1
+        if not self.greenlet:
+            self.greenlet = gevent.spawn(self._run)
+
+    def _get_batch(self, block=True):
+        records = []
+        try:
+            records.append(self.queue.get(block=block))
+            while len(records) < self.batch_size:
+                records.append(self.queue.get_nowait())
+        except Empty:
+            pass
+        return records
+
+    def _run(self):
+        try:
+            while True:
+                self._write(self._get_batch())
+        finally:
+            self.greenlet = None
+
+    def _write(self, records):
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.target.format(record))
+            except Exception:
+                self.handleError(record)
+
+        sampled, dropped = self.sampled, self.dropped
+        if (sampled, dropped) != (self._reported_sampled,
+                                  self._reported_dropped):
+            lines.append('Log queue full: %s records sampled out, '
+                         '%s dropped' % (sampled - self._reported_sampled,
+                                         dropped - self._reported_dropped))
+            self._reported_sampled = sampled
+            self._reported_dropped = dropped
+
+        if not lines:
+            return
+
+        self.target.acquire()
+        try:
+            stream = self.target.stream
+            stream.write('\n'.join(lines) + '\n')
+            stream.flush()
+        except Exception:
+            self.handleError(records[-1])
+        finally:
+            self.target.release()
+        self.written += len(records)
+
+    def flush(self):
+        """Writes every queued record right away"""
+        records = self._get_batch(block=False)
+        while records:
+            self._write(records)
+            records = self._get_batch(block=False)
+
+    def get_metrics(self):
+        return {'queued': self.queued,
+                'written': self.written,
+                'sampled': self.sampled,
+                'dropped': self.dropped,
+                'pending': self.queue.qsize()}
+
+
 class EmailHandler(StreamHandler):
 
     """A class that sends an email on application errors"""
@@ -35,7 +35,9 @@ from ..notification_endpoints import subscribe, clear_get_user_endpoints_cache,
     get_user_endpoints, register_device
 from ..models import (User, Device, SignupLocation,
                       NotificationEndpoint)
+from ..models.oauth import Token
 from ..parse import Follower
+from ..polls import reconcile_poll_counts
 from ..helpers import iso8601_from_usec, get_usec_timestamp
 from yoapi.constants.sns import APP_ID_TO_ARN_IDS
 from yoapi.constants.yos import UNREAD_YOS_FETCH_LIMIT
@@ -215,6 +217,43 @@ class FixPolls1(Command):
             register_device(user.user_id, 'com.flashpolls.beta', user_dict.get('token'), user_dict.get('installation_id'))
 
 
+class ReconcilePollCounts(Command):
+    """Recomputes poll reply counts from the reply yos"""
+
+    option_list = [
+        Option('--poll-id', dest='poll_id'),
+        Option('--days', dest='days', type=int, default=7),
+    ]
+
+    # pylint: disable=method-hidden
+    def run(self, poll_id=None, days=7):
+        if poll_id:
+            polls = Yo.objects(id=poll_id)
+        else:
+            since = get_usec_timestamp() - days * 24 * 3600 * 1e6
+            polls = Yo.objects(is_poll=True, created__gte=since,
+                               response_pair__exists=True)
+
+        for poll in polls.no_cache():
+            left_count, right_count = reconcile_poll_counts(poll)
+            print '%s: %s/%s' % (poll.yo_id, left_count, right_count)
+
+
+class BackfillAccessTokenLower(Command):
+    """Sets the lower cased copy of OAuth tokens saved before it existed"""
+
+    # pylint: disable=method-hidden
+    def run(self):
+        Token.ensure_indexes()
+        tokens = Token.objects(access_token_lower__exists=False,
+                               access_token__exists=True) \
+            .only('access_token').no_cache()
+        for i, token in enumerate(tokens):
+            if token.access_token:
+                token.update(set__access_token_lower=token.access_token.lower())
+            print '\r%s' % i,
+
+
 class CreateUser(Command):
     option_list = [
         Option('--username'),
@@ -434,8 +473,8 @@ class ReregisterDevices(Command):
         identity_changed.send(current_app, identity=identity)
 
         # Register devices.
-        users = User.objects(created__gte=cutoff)
-        user_ids = [str(user.id) for user in users]
+        user_ids = [str(user_id) for user_id in
+                    User.objects(created__gte=cutoff).scalar('id')]
         devices = Device.objects(owner__in=user_ids)
         for i, device in enumerate(devices):
             if device.device_type != 'winphone':
@@ -694,6 +733,8 @@ class ClearSNSEndpoints(Command):
             print '%s endpoint %s' % (i, endpoint.arn)
             sns.delete_endpoint(endpoint_arn=endpoint.arn)
             endpoint.delete()
+            if endpoint._data.get('owner'):
+                clear_get_user_endpoints_cache(endpoint._data['owner'])
 
         topics = sns.get_all_topics() \
             .get('ListTopicsResponse') \
@@ -813,24 +854,25 @@ class RemoveInvalidPhoneNumbersFromUsers(Command):
 class ExportEmails(Command):
 
     def run(self):
-        users = User.objects.filter(email=re.compile('^.{1,256}$'))
+        emails = User.objects.filter(email=re.compile('^.{1,256}$')) \
+            .scalar('email')
         added = []
         with open("emails.txt", "a") as myfile:
-            for user in users:
-                print user.email
-                if 'nextdroidlabs.com' in user.email:
+            for email in emails:
+                print email
+                if 'nextdroidlabs.com' in email:
                     continue
-                elif 'justyo.co' in user.email:
+                elif 'justyo.co' in email:
                     continue
-                elif 'yoceleb.com' in user.email:
+                elif 'yoceleb.com' in email:
                     continue
-                elif 'test' == user.email.lower():
+                elif 'test' == email.lower():
                     continue
-                if user.email in added:
+                if email in added:
                     continue
                 try:
-                    myfile.write(user.email + '\n')
-                    added.append(user.email)
+                    myfile.write(email + '\n')
+                    added.append(email)
                 except:
                     print 'error'
 
@@ -838,6 +880,11 @@ class ExportEmails(Command):
 
 test = False
 
+# The fields the reengagement pushes look at. Users are otherwise only
+# passed on as recipients so there is no need to load anything else.
+REENGAGEMENT_USER_FIELDS = ('id', 'username', 'is_pseudo', 'is_service',
+                            'timezone', 'country_name')
+
 
 class TestReengagementPushOnCohorts(Command):
     """Finds users with a last_seen_time of a week ago or more and sends
@@ -899,6 +946,7 @@ class TestReengagementPushOnCohorts(Command):
                                                  country_name='United States', last_reengamement_push_time__exists=False) \
                         .order_by('-created') \
                         .limit(cohort_size)
+                cohort = cohort.only(*REENGAGEMENT_USER_FIELDS)
 
                 for user in cohort:
 
@@ -996,6 +1044,7 @@ class SendBestReengagePushToAllUsers(Command):
                 #                            Q(last_seen_time__lte=days_prior_usec) &
                 #                            Q(last_reengamement_push_time__gte=days_prior_usec) |
                 #                            Q(last_reengamement_push_time__exists=False)) \
+            batch = batch.only(*REENGAGEMENT_USER_FIELDS)
 
             for user in batch:
 
@@ -40,12 +40,23 @@ class Grant(DocumentMixin, Document):
 
 class Token(DocumentMixin, Document):
 
-    meta = {'collection': 'oauth_token'}
+    meta = {'collection': 'oauth_token',
+            'indexes': [
+                {'fields': ['access_token_lower'], 'sparse': True}]}
 
     access_token = StringField()
+
+    # Lower cased copy of the access token so that case insensitive
+    # lookups can use an index.
+    access_token_lower = StringField()
     refresh_token = StringField()
     client_id = StringField()
     expires = DateTimeField()
     user = ReferenceField(User)
     client = ReferenceField(Client)
     scopes = ListField(StringField(), default=None)
+
+    def clean(self):
+        super(Token, self).clean()
+        if self.access_token:
+            self.access_token_lower = self.access_token.lower()
@@ -388,6 +388,25 @@ class YoPayload(Payload):
         if flattened_yo.right_link:
             self.set_extras(right_deep_link=flattened_yo.right_link)
 
+    def copy_for_yo(self, yo, flattened_yo=None):
+        """Returns a copy of the payload for a sibling broadcast yo
+
+        Only the extras that differ between the children of a broadcast
+        are replaced.
+        """
+        if flattened_yo is None:
+            flattened_yo = yo.get_flattened_yo()
+
+        # copy.copy would call __new__ without a yo.
+        payload = object.__new__(self.__class__)
+        payload.__dict__.update(self.__dict__)
+        payload.yo = yo
+        payload._extras = dict(self.get_extras())
+        payload._extras.pop('created_at', None)
+        payload.set_extras(created_at=flattened_yo.created,
+                           yo_id=flattened_yo.yo_id)
+        return payload
+
     def to_sns(self, endpoint=None):
 
         apns = self.get_apns_payload()
@@ -969,3 +988,96 @@ class YoGroupPayload(YoPayload):
         self.formatting_dict.update({'social_text': social_text})
 
         self._social_text = social_text
+
+
+# Formatting fields that differ between the recipients of a broadcast.
+RECIPIENT_FORMATTING_FIELDS = ('pseudo_user_name', 'recipient_display_name',
+                               'webclient_url')
+
+
+class PayloadCache(object):
+    """Renders the sns message of a yo once per endpoint capability class.
+
+    The children of a broadcast only differ by recipient, so the shared
+    parts of their payload (type, push text, category and extras) are built
+    once per parent yo, support dict, sender contact name and header
+    template. Only the child yo id and creation time are set per recipient
+    before the message is serialized. Group yos and header templates that
+    format recipient fields are built per child yo.
+
+    Endpoints of one recipient with identical capabilities (e.g. a phone
+    and a tablet on the same app version) reuse the serialized message.
+    """
+
+    def __init__(self):
+        self._messages = {}
+        self._payloads = {}
+
+    @staticmethod
+    def make_key(yo, support_dict):
+        return (yo.yo_id, tuple(sorted(support_dict.items())))
+
+    @staticmethod
+    def make_class_key(yo, flattened_yo, support_dict, log_enrolled=False):
+        """Returns the key of the payloads a broadcast child shares
+
+        This looks up the contact name and the A/B tested header of the
+        recipient, which are the only recipient specific inputs of a
+        payload that does not format recipient fields.
+        """
+        contact = get_contact_pair(flattened_yo.recipient,
+                                   flattened_yo.sender)
+        sender_name = contact.get_name() if contact else None
+
+        template = None
+        if not support_dict.get('is_legacy'):
+            if flattened_yo.header is not None:
+                template = flattened_yo.header.push
+            else:
+                payload_type = YoPayload.get_yo_payload_type(
+                    flattened_yo, support_dict=support_dict)
+                header = get_header(flattened_yo.recipient, payload_type,
+                                    False, log_enrolled)
+                if header:
+                    template = header.push
+
+        shared_id = flattened_yo.parent_yo_id
+        if template and any('%%(%s)' % field in template
+                            for field in RECIPIENT_FORMATTING_FIELDS):
+            shared_id = flattened_yo.yo_id
+
+        return (shared_id, tuple(sorted(support_dict.items())), sender_name,
+                template, flattened_yo.left_link, flattened_yo.right_link,
+                yo.response_pair)
+
+    def get_payload(self, yo, support_dict, log_enrolled=False):
+        """Returns the payload of a yo, sharing it between broadcast
+        children where possible"""
+        flattened_yo = yo.get_flattened_yo()
+        if not flattened_yo.parent_yo_id or flattened_yo.is_group_yo:
+            return YoPayload(yo, support_dict, log_enrolled=log_enrolled)
+
+        key = self.make_class_key(yo, flattened_yo, support_dict,
+                                  log_enrolled=log_enrolled)
+        payload = self._payloads.get(key)
+        if payload is None:
+            # The header was already looked up, and logged, for the
+            # recipient when making the key.
+            payload = YoPayload(yo, support_dict)
+            self._payloads[key] = payload
+            return payload
+
+        return payload.copy_for_yo(yo, flattened_yo)
+
+    def get_sns_message(self, yo, endpoint, log_enrolled=False):
+        support_dict = endpoint.get_payload_support_dict()
+        key = self.make_key(yo, support_dict)
+        if key not in self._messages:
+            payload = self.get_payload(yo, support_dict,
+                                       log_enrolled=log_enrolled)
+            self._messages[key] = payload.to_sns(endpoint)
+
+        return self._messages[key]
+
+    def __len__(self):
+        return len(self._messages)
@@ -6,11 +6,12 @@
 import phonenumbers
 import re
 
-from bson import DBRef
+from bson import DBRef, ObjectId
 from flask import current_app
 from flask_mongoengine import Document
 from mongoengine import (BooleanField, StringField, IntField, PULL,
-                         EmbeddedDocumentField, LongField, ListField, FloatField)
+                         EmbeddedDocumentField, LongField, ListField, FloatField,
+                         MapField)
 from passlib.hash import bcrypt
 from phonenumbers.phonenumberutil import NumberParseException
 
@@ -74,6 +75,17 @@ FIELD_LIST_MAP = {'account': ACCOUNT_FIELDS,
                   'admin': ADMIN_FIELDS}
 
 
+def get_reference_id(value):
+    """Returns the ObjectId of a user, DBRef or id without loading it"""
+    if isinstance(value, DBRef):
+        return value.id
+
+    if isinstance(value, Document):
+        return value.pk
+
+    return ObjectId(str(value))
+
+
 class User(DocumentMixin, Document):
 
     """MongoDB user model.
@@ -256,6 +268,13 @@ class User(DocumentMixin, Document):
     # The last time a user sent  a yo.
     last_sent_time = LongField()
 
+    # The last time a user sent a yo with each context id.
+    context_times = MapField(LongField(), default=None)
+
+    # Yos sent since this time are all recorded in context_times, so they
+    # no longer need to be looked up.
+    context_times_since = LongField()
+
     # The last time a user received a yo.
     last_received_time = LongField()
 
@@ -729,12 +748,31 @@ class User(DocumentMixin, Document):
 
         return False
 
+    @property
+    def blocked_ids(self):
+        """Returns a frozenset of the ObjectIds of blocked users
+
+        The set is built from the raw references the first time it is
+        needed so that checking it never dereferences the blocked users.
+        """
+        blocked_ids = getattr(self, '_blocked_ids', None)
+        if blocked_ids is None:
+            blocked = self._data.get('blocked') or []
+            blocked_ids = frozenset(get_reference_id(ref) for ref in blocked)
+            self._blocked_ids = blocked_ids
+
+        return blocked_ids
+
+    @blocked_ids.setter
+    def blocked_ids(self, value):
+        self._blocked_ids = frozenset(value)
+
     def has_blocked(self, user):
         """Returns True if this user is in our blocked list"""
-        if not self.blocked:
+        if user is None:
             return False
 
-        return user in self.blocked
+        return get_reference_id(user) in self.blocked_ids
 
     def as_topic(self):
         return {
@@ -31,6 +31,7 @@ class Yo(DocumentMixin, Document):
                         {'fields': ['reply_to'], 'sparse': True},
                         ('scheduled_for', 'status'),
                         ('sender', 'created'),
+                        ('sender', 'context_id', 'created'),
                         ('recipient', 'created'),
                         ('sender', 'recipient', 'created'),
                         ('recipient', 'sender', 'created')],
@@ -17,7 +17,7 @@ from .accounts import get_user, create_user, record_get_me_location
 from .async import async_job
 from .errors import APIError
 from .permissions import assert_account_permission
-from .core import parse, sns, redis
+from .core import cache, parse, sns, redis
 from .models import Device, NotificationEndpoint, User
 from .services import low_rq
 from .constants.regex import ANDROID_RE, IOS_RE, WINPHONE_RE
@@ -41,9 +41,29 @@ FLASHPOLLSPROD = 'com.flashpolls.flashpolls.prod'
 FLASHPOLLSBETA = 'com.flashpolls.beta'  # for old beta prod
 
 
+# Fields kept in the endpoint cache. Only what is needed to build
+# payloads and pick endpoints is stored instead of pickled documents.
+ENDPOINT_CACHE_FIELDS = ('arn', 'platform', 'version', 'os_version',
+                         'sdk_version', 'installation_id')
+
+
 def clear_get_user_endpoints_cache(user):
-    pass
-    #cache.delete_memoized(_get_user_endpoints, user.user_id)
+    """Evicts the cached endpoints of a user, user id or DBRef"""
+    if isinstance(user, User):
+        user_id = user.user_id
+    elif hasattr(user, 'id'):
+        user_id = str(user.id)
+    else:
+        user_id = str(user)
+
+    cache.delete_memoized(_get_user_endpoints, user_id)
+
+
+def clear_endpoint_owners_cache(endpoints):
+    """Evicts the cached endpoints of every owner in a queryset"""
+    for endpoint in endpoints.no_dereference().only('owner'):
+        if endpoint.owner:
+            clear_get_user_endpoints_cache(endpoint.owner)
 
 
 @async_job(rq=low_rq)
@@ -66,21 +86,34 @@ def delete_user_endpoints(user):
 
 
 def get_user_endpoints(user, app_id=None, ignore_permissions=False):
-    """Returns the user endpoints"""
+    """Returns the user endpoints
+
+    The endpoints are rebuilt from cached field tuples and are not meant
+    to be saved. Query NotificationEndpoint directly when the full
+    document is needed.
+    """
 
     if not ignore_permissions:
         assert_account_permission(user, 'No permission to access user.')
-    return _get_user_endpoints(user.user_id, app_id)
 
-
-#@cache.memoize()
-def _get_user_endpoints(user_id, app_id=None):
+    endpoint_tuples = _get_user_endpoints(user.user_id)
     if app_id:
         sns_app_ids = APP_ID_TO_ARN_IDS[app_id]
-        endpoints = NotificationEndpoint.objects(owner=user_id, platform__in=sns_app_ids)
-    else:
-        endpoints = NotificationEndpoint.objects(owner=user_id)
-    return list(endpoints)
+        endpoint_tuples = [endpoint_tuple for endpoint_tuple in endpoint_tuples
+                           if endpoint_tuple[1] in sns_app_ids]
+
+    return [NotificationEndpoint(owner=user,
+                                 **dict(zip(ENDPOINT_CACHE_FIELDS, values)))
+            for values in endpoint_tuples]
+
+
+@cache.memoize()
+def _get_user_endpoints(user_id):
+    endpoints = NotificationEndpoint.objects(owner=user_id) \
+        .only(*ENDPOINT_CACHE_FIELDS)
+    return [tuple(getattr(endpoint, field)
+                  for field in ENDPOINT_CACHE_FIELDS)
+            for endpoint in endpoints]
 
 
 @async_job(rq=low_rq)
@@ -322,6 +355,10 @@ def subscribe(user_id, platform, token, installation_id):
     arn = None
     endpoints = NotificationEndpoint.objects(
         (Q(installation_id=installation_id) & Q(platform=platform)) | Q(token=token))
+
+    # The endpoints may be deleted or handed over to this user below so
+    # evict the cache of whoever owns them now.
+    clear_endpoint_owners_cache(endpoints)
     try:
         endpoint = endpoints.get()
         if endpoint.platform != platform:
@@ -353,7 +390,8 @@ def subscribe(user_id, platform, token, installation_id):
                      set__arn=arn,
                      set__version=version,
                      set__os_version=os_version,
-                     set__sdk_version=sdk_version)
+                     set__sdk_version=sdk_version,
+                     set__disabled=False)
 
     clear_get_user_endpoints_cache(user)
 
@@ -430,6 +468,8 @@ def unsubscribe(user_id, installation_id, user_agent):
         endpoint = NotificationEndpoint.objects(installation_id=installation_id,
                                                 platform=platform).get()
         if endpoint:
+            if endpoint.owner:
+                clear_get_user_endpoints_cache(endpoint.owner)
             endpoint.update(unset__owner=True)
             clear_get_user_endpoints_cache(user)
     except DoesNotExist:
@@ -8,12 +8,13 @@ from uuid import uuid4
 from flask import g, current_app
 from boto.exception import BotoServerError
 from twilio.rest.exceptions import TwilioRestException
-from .accounts import get_user
+from .accounts import get_user, get_users_by_ids
 from .async import async_job
 from .contacts import get_contact_pair
 from .core import sns, twilio, log_to_slack, redis
 from .notification_endpoints import get_user_endpoints, IOS, IOSBETA
 from .services import low_rq, medium_rq
+from .models import NotificationEndpoint
 from .models.payload import Payload
 from yoapi.models.notification_endpoint import IOSDEV
 
@@ -27,8 +28,7 @@ def _push_to_endpoint(endpoint_arn=None, sns_message=None,
 
     if endpoint_arn and sns_message:
         try:
-            sns.set_endpoint_attributes(endpoint_arn, {'Enabled': True})
-            sns.publish(target_arn=endpoint_arn, message=sns_message)
+            _publish_to_endpoint(endpoint_arn, sns_message)
         except BotoServerError as err:
             log_to_slack('Exception: ' + endpoint_arn + ' - ' + err.message)
             if err.code in sns.REMOVE_ON_FAILURE_TYPES:
@@ -56,6 +56,36 @@ def _push_to_endpoint(endpoint_arn=None, sns_message=None,
             return error % (phone, err.code, message)
 
 
+def _publish_to_endpoint(endpoint_arn, sns_message):
+    """Publishes a message to an endpoint, re-enabling it only if needed.
+
+    Endpoints are enabled when they are registered so we no longer pay for
+    a SetEndpointAttributes call before every publish. If SNS reports the
+    endpoint as disabled it is re-enabled and the publish is retried once.
+    The outcome is recorded on the NotificationEndpoint so that the
+    disabled state can be inspected without asking SNS.
+    """
+
+    try:
+        return sns.publish(target_arn=endpoint_arn, message=sns_message)
+    except BotoServerError as err:
+        if err.code not in sns.REMOVE_ON_FAILURE_TYPES:
+            raise
+
+    sns.set_endpoint(endpoint_arn, {'Enabled': True})
+    try:
+        result = sns.publish(target_arn=endpoint_arn, message=sns_message)
+    except BotoServerError as err:
+        if err.code in sns.REMOVE_ON_FAILURE_TYPES:
+            NotificationEndpoint.objects(arn=endpoint_arn) \
+                .update(set__disabled=True)
+        raise
+
+    NotificationEndpoint.objects(arn=endpoint_arn, disabled=True) \
+        .update(set__disabled=False)
+    return result
+
+
 def _send_notification_to_user(user, payload, app_id=None):
     # Send a payload to a particular user's endpoints if the endpoint
     # is supported by the payload
@@ -111,14 +141,16 @@ def notify_yo_status_update(yo):
 @async_job(rq=low_rq)
 def _send_notification_to_users(user_ids, payload_support,
                                 payload_args, payload_kwargs):
-    users = [get_user(user_id=user_id) for user_id in user_ids]
+    users = get_users_by_ids(user_ids)
     payload = Payload(*payload_args, **payload_kwargs)
     for item in payload_support:
         if hasattr(payload, item[0]):
             setattr(payload, item[0], item[1])
 
-    for user in users:
-        _send_notification_to_user(user, payload)
+    for user_id in user_ids:
+        user = users.get(str(user_id))
+        if user:
+            _send_notification_to_user(user, payload)
 
 
 @async_job(rq=low_rq)
@@ -148,8 +180,12 @@ def announce_sign_up_to_contacts(contact_ids, is_yostatus):
     # Restrict these announcments to version 2.0.3 or better.
     announcement_payload.version_support = '>=2.0.3'
 
+    friends = get_users_by_ids(contact_ids, ignore_permission=True)
     for contact_id in contact_ids:
-        friend = get_user(user_id=contact_id, ignore_permission=True)
+        friend = friends.get(str(contact_id))
+        if not friend:
+            continue
+
         already_contact = bool(get_contact_pair(friend, user))
         user_blocked = friend.has_blocked(user)
         user_blocked = user_blocked or user.has_blocked(friend)
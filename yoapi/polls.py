@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""Poll tally management package."""
+
+from .accounts import get_users_by_ids
+from .models import Yo
+from .models.user import get_reference_id
+from .yos.queries import clear_get_yo_cache
+
+
+def get_poll_reply_texts(poll):
+    """Returns the left and right reply texts of a poll"""
+    left_reply_text, right_reply_text = poll.response_pair.split('.')[:2]
+    return left_reply_text, right_reply_text
+
+
+def get_poll_reply_senders(poll, reply_text):
+    """Returns the users that replied to a poll with the given text
+
+    Only the sender ids are read from the replies.
+    """
+    sender_ids = Yo.objects(reply_to=poll, text=reply_text) \
+        .no_dereference().scalar('sender')
+    sender_ids = [str(get_reference_id(sender_id))
+                  for sender_id in sender_ids if sender_id]
+    senders = get_users_by_ids(sender_ids, ignore_permission=True)
+    return [senders[sender_id] for sender_id in sender_ids
+            if sender_id in senders]
+
+
+def get_poll_counts(poll):
+    """Returns the left and right reply counts of a poll
+
+    Polls that predate the counters are reconciled first.
+    """
+    if poll.left_replies_count is None and poll.right_replies_count is None:
+        return reconcile_poll_counts(poll)
+
+    return poll.left_replies_count or 0, poll.right_replies_count or 0
+
+
+def count_poll_reply(poll, reply_text):
+    """Counts a reply to a poll and returns the new reply counts
+
+    The matching counter is incremented atomically so concurrent votes
+    don't overwrite each other. The reply yo is expected to be saved
+    already so that reconciling includes it.
+    """
+    if poll.left_replies_count is None and poll.right_replies_count is None:
+        return reconcile_poll_counts(poll)
+
+    left_reply_text, right_reply_text = get_poll_reply_texts(poll)
+    if reply_text == left_reply_text:
+        update = {'inc__left_replies_count': 1}
+    elif reply_text == right_reply_text:
+        update = {'inc__right_replies_count': 1}
+    else:
+        return get_poll_counts(poll)
+
+    poll = Yo.objects(id=poll.id).modify(new=True, **update)
+    clear_get_yo_cache(poll.yo_id)
+    return poll.left_replies_count or 0, poll.right_replies_count or 0
+
+
+def reconcile_poll_counts(poll):
+    """Recomputes the reply counts of a poll from its reply yos"""
+    left_reply_text, right_reply_text = get_poll_reply_texts(poll)
+    left_count = Yo.objects(reply_to=poll, text=left_reply_text).count()
+    right_count = Yo.objects(reply_to=poll, text=right_reply_text).count()
+
+    poll.update(set__left_replies_count=left_count,
+                set__right_replies_count=right_count)
+    poll.left_replies_count = left_count
+    poll.right_replies_count = right_count
+    clear_get_yo_cache(poll.yo_id)
+    return left_count, right_count
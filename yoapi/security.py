@@ -25,15 +25,14 @@ from flask import request, current_app, g, session
 from flask_principal import Identity, identity_changed, identity_loaded
 from .errors import APIError
 from .models import Client
-from mongoengine import DoesNotExist
 from .permissions import (LoginNeed, ViewProfileNeed, AccountNeed,
                           admin_need, pseudo_need)
-from .accounts import get_user, find_user_ids, user_id_exists
+from .accounts import (get_user, user_id_exists, get_user_id_by_api_token,
+                       get_user_id_by_access_token)
 from .core import principals
 from . import jwt
 from .jwt import JWTError
 from yoapi.helpers import make_json_response
-from yoapi.models.oauth import Token
 
 
 def is_admin():
@@ -89,12 +88,10 @@ def identity_loader():
         token_value = splitted[1]
 
         if len(token_value) == 30:
-            try:
-                token = Token.objects.get(access_token__iexact=token_value)
-            except DoesNotExist as e:
+            user_id = get_user_id_by_access_token(token_value)
+            if not user_id:
                 raise APIError('Invalid access token.', status_code=401)
-            user = token.user
-            return YoIdentity(str(user.id), auth_type='OAUTH', client=client)
+            return YoIdentity(user_id, auth_type='OAUTH', client=client)
         try:
             jwt_token = jwt.get_decoded_token()
             # If successful we can access the parsed User object.
@@ -115,32 +112,32 @@ def identity_loader():
         api_token = request.values.get('api_token')
         api_token = api_token or request.json.get('api_token')
 
-        user_ids = find_user_ids(api_token=api_token) if api_token else None
-        if user_ids and len(user_ids) == 1:
-            return YoIdentity(user_ids[0], auth_type='API', client=client)
+        user_id = get_user_id_by_api_token(api_token) if api_token else None
+        if user_id:
+            return YoIdentity(user_id, auth_type='API', client=client)
 
         raise APIError('Invalid API token.', status_code=401)
 
     if 'access_token' in request.json:
-        try:
-            access_token = request.json.get('access_token')
-            token = Token.objects.get(access_token=access_token)
-            user = token.user
-            return YoIdentity(str(user.id), auth_type='OAUTH', client=client)
-
-        except DoesNotExist as e:
-
+        access_token = request.json.get('access_token')
+        if not access_token:
             raise APIError('Invalid access token.', status_code=401)
 
+        try:
+            user_id = get_user_id_by_access_token(access_token, exact=True)
         except Exception as e:
 
-            user_ids = find_user_ids(api_token=access_token)
-            if user_ids and len(user_ids) == 1:
-                return YoIdentity(user_ids[0], auth_type='API', client=client)
+            user_id = get_user_id_by_api_token(access_token)
+            if user_id:
+                return YoIdentity(user_id, auth_type='API', client=client)
 
             current_app.log_exception(sys.exc_info())
             raise APIError('Invalid access token.', status_code=401)
 
+        if not user_id:
+            raise APIError('Invalid access token.', status_code=401)
+        return YoIdentity(user_id, auth_type='OAUTH', client=client)
+
     # Last check for secure cookie from web users.
     if 'identity.id' in session and 'identity.auth_type' in session:
         if user_id_exists(session['identity.id']):
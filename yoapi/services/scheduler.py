@@ -76,6 +76,20 @@ def get_time_until_next_jobs():
     return query.order_by('scheduled_for')
 
 
+@yo_scheduler.load_jobs_handler(job_type=YO_JOB_TYPE)
+def get_scheduled_jobs_by_ids(yo_ids):
+    """Gets the due yos for ids read from the schedule index"""
+    schedule_name = yo_scheduler.app.config.get('SCHEDULE_NAME')
+    usec_now = get_usec_timestamp()
+    cutoff_usec = usec_now - GRACE_PERIOD
+    query = Yo.objects(id__in=yo_ids,
+                       scheduled_for__lte=usec_now,
+                       scheduled_for__gte=cutoff_usec,
+                       schedule_name=schedule_name,
+                       status='scheduled')
+    return query.order_by('scheduled_for')
+
+
 @yo_scheduler.failed_job_handler(job_type=YO_JOB_TYPE)
 def handle_failed_job(yo):
     yo.status='failed'
@@ -2,12 +2,12 @@
 import hashlib
 
 import emoji
-import requests
 from yoapi.accounts import update_user, get_user
 from yoapi.async import async_job
 from yoapi.constants.emojis import UNESCAPED_EMOJI_MAP, REVERSE_EMOJI_MAP
 from yoapi.contacts import _get_follower_contacts, get_contact_pair
-from yoapi.core import mixpanel_yostatus, redis, cache, log_to_slack
+from yoapi.core import (mixpanel_yostatus, redis, cache, log_to_slack,
+                        callback_dispatcher)
 from yoapi.errors import APIError
 from yoapi.helpers import get_usec_timestamp
 from yoapi.models.status import Status
@@ -21,28 +21,34 @@ from yoapi.yos.send import send_yo
 @async_job(rq=low_rq)
 def send_user_updated_webhooks(user):
 
-    subscriptions = Subscription.objects(target=user)
+    params = {
+        'event_type': 'status.updated',
+        'user': {
+            'id': user.user_id,
+            'status': user.status,
+            'username': user.username,
+            'display_name': user.display_name,
+        }
+    }
+
+    calls = []
+    subscriptions = list(Subscription.objects(target=user))
     for subscription in subscriptions:
-        try:
-            params = {
-                'event_type': 'status.updated',
-                'user': {
-                    'id': user.user_id,
-                    'status': user.status,
-                    'username': user.username,
-                    'display_name': user.display_name,
-                }
-            }
-            if subscription.token:
-                params['token'] = subscription.token
-
-            requests.post(url=subscription.webhook_url,
-                          json=params,
-                          headers={'Connection': 'close'},
-                          timeout=5)
-        except Exception as e:
+        subscription_params = dict(params)
+        if subscription.token:
+            subscription_params['token'] = subscription.token
+
+        calls.append(('POST', subscription.webhook_url,
+                      {'json': subscription_params, 'timeout': 5}))
+
+    if not calls:
+        return
+
+    results = callback_dispatcher.map(calls)
+    for subscription, result in zip(subscriptions, results):
+        if isinstance(result, Exception):
             try:
-                log_to_slack(e.message + ' : ' + str(subscription.id))
+                log_to_slack(str(result.message) + ' : ' + str(subscription.id))
             except:
                 pass
 
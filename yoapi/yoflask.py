@@ -156,6 +156,9 @@ class YoResponse(Response):
     # Only log the response json if set to true
     log_json_response = True
 
+    # The data a json response was built from, if known.
+    json_data = None
+
     def get_loggable_dict(self, include_headers=False):
         """Get a dict representation good for logging"""
 
@@ -170,15 +173,17 @@ class YoResponse(Response):
         # Include JSON response depending if content type suggests it's
         # available.
         if self.log_json_response and 'json' in self.content_type:
-            try:
-                log_dict = json.loads(response_data)
-                if log_dict:
-                    # Let's not include an empty dictionary.
-                    rv['json'] = log_dict
-            except (TypeError, ValueError):
-                # If response is malformed then display warning in the logs
-                # so there is a chance to fix it.
-                current_app.logger.warning('Malformed JSON response')
+            log_dict = self.json_data
+            if log_dict is None:
+                try:
+                    log_dict = json.loads(response_data)
+                except (TypeError, ValueError):
+                    # If response is malformed then display warning in the
+                    # logs so there is a chance to fix it.
+                    current_app.logger.warning('Malformed JSON response')
+            if log_dict:
+                # Let's not include an empty dictionary.
+                rv['json'] = log_dict
         elif 'json' in self.content_type:
             rv['json'] = {'response': 'REDACTED'}
 
@@ -3,26 +3,31 @@
 """Yo helpers package."""
 
 import datetime
+import hashlib
 import json
 import sys
 import grequests
+from itertools import islice
 
 import requests
 from flask import current_app, g, request
 from mongoengine import DoesNotExist
 from requests.exceptions import RequestException, Timeout
 from .queries import (clear_get_favorite_yos_cache,
-                      clear_get_unread_yos_cache,
-                      clear_get_yo_count_cache, clear_get_yo_cache,
+                      clear_get_yo_cache,
                       clear_get_yo_token_cache,
-                      get_last_broadcast, get_yo_by_id, get_public_dict_for_yo_id)
+                      get_last_broadcast, get_yo_by_id, get_public_dict_for_yo_id,
+                      remove_unread_yo)
 from ..ab_test import log_ab_test_data
 from ..async import async_job
-from ..core import s3, mixpanel_yoapp, log_to_slack, sendgrid
+from ..core import (s3, mixpanel_yoapp, log_to_slack, sendgrid,
+                    callback_dispatcher, redis)
 from ..errors import (APIError, YoTokenExpiredError, YoTokenInvalidError,
                       YoTokenUsedError)
+from ..extensions.dispatcher import CircuitOpenError
 from ..headers import get_header_by_id, get_header
 from ..helpers import get_usec_timestamp
+from ..helpers import get_link_content_type as probe_link_content_type
 from ..models import Yo
 from ..notification_endpoints import endpoint_support_from_useragent
 from ..notifications import notify_yo_status_update, send_silent_yo_opened
@@ -31,15 +36,12 @@ from ..services import low_rq, redis_pubsub
 from ..urltools import UrlHelper
 from ..models.payload import YoPayload
 from yoapi.accounts import _get_user
-from yoapi.constants.yos import UNREAD_YOS_FETCH_LIMIT
+from yoapi.constants.yos import UNREAD_YO_STATUSES, CHILD_YO_CHUNK_SIZE
 from yoapi.contacts import get_contact_pair
 from yoapi.groups import get_group_members
 from yoapi.localization import get_region_by_name
 
 
-YO_BUFFER_MAX = 10000
-
-
 @async_job(rq=low_rq)
 def acknowledge_yo_received(yo_id, status=None, from_push=False):
     """Acknowledges a Yo with the specified status.
@@ -52,9 +54,6 @@ def acknowledge_yo_received(yo_id, status=None, from_push=False):
     except DoesNotExist:
         raise APIError('Yo not found')
 
-    if yo.app_id == 'co.justyo.yopolls':
-        clear_get_unread_yos_cache(yo.recipient.user_id, UNREAD_YOS_FETCH_LIMIT, app_id='co.justyo.yopolls')
-
     status = status or 'received'
     # TODO: Find a nicer way to do this. Perhaps with a permission assert.
     is_current_users_yo = yo.recipient and yo.recipient == g.identity.user
@@ -109,7 +108,8 @@ def acknowledge_yo_received(yo_id, status=None, from_push=False):
         yo.status = status
         yo.save()
         clear_get_yo_cache(yo_id)
-        clear_get_unread_yos_cache(str(yo.recipient), UNREAD_YOS_FETCH_LIMIT)
+        if status not in UNREAD_YO_STATUSES:
+            remove_unread_yo(yo)
 
         flattened_yo = yo.get_flattened_yo()
         support_dict = endpoint_support_from_useragent(request)
@@ -182,25 +182,6 @@ def favorite_yo(user_id, yo_id, favorite=True):
         clear_get_favorite_yos_cache(user_id)
 
 
-def increment_count_in(user):
-    """Incrementes the received Yo counter for a user
-
-    The reason we need an explicit function for this is because we increment
-    it both in the database and clear the cache
-    """
-    user.update(inc__count_in=1)
-    clear_get_yo_count_cache(user)
-
-
-def increment_count_out(user):
-    """Incrementes the received Yo counter for a user
-
-    The reason we need an explicit function for this is because we increment
-    it both in the database and under a redis key.
-    """
-    user.update(inc__count_out=1)
-
-
 def construct_yo(sender=None, recipients=None, sound=None, link=None,
                  location=None, broadcast=False, ignore_permission=False,
                  header=None, link_content_type=None, origin_yo=None,
@@ -504,56 +485,75 @@ def get_params_for_callback(sender_id, yo_id):
     return params
 
 
-@async_job(rq=low_rq)
-def trigger_callback(sender_id, callback, yo_id):
-    """Augment the callback URL and trigger it."""
+def _build_callback_request(sender_id, callback, yo_id):
+    """Returns the (method, url, kwargs) request for a callback URL."""
 
     params = get_params_for_callback(sender_id, yo_id)
 
-    try:
-        # Set stream to true so that we don't actually download the response
-        # Similarly, we set connection close so that the connection doesn't
-        # stay open.
-
-        # Since get requests have issues with emojis, all new callbacks that need
-        # reply or reply_to will be in POST
-        url = None
-        if params.get('reply') or params.get('reply_to'):
-            requests.post(callback, data=json.dumps(params),
-                          timeout=3,
-                          stream=True,
-                          headers={'Connection': 'close',
-                                   'Content-type': 'application/json'},
-                          verify=False)
+    # Since get requests have issues with emojis, all new callbacks that need
+    # reply or reply_to will be in POST
+    # User callbacks have never verified certificates.
+    if params.get('reply') or params.get('reply_to'):
+        return ('POST', callback,
+                {'data': json.dumps(params),
+                 'headers': {'Content-type': 'application/json'},
+                 'verify': False})
 
-        else:
-            params.pop('display_name')
-            if params.get('context'):
-                params.pop('context')
-            helper = UrlHelper(callback, params=params)
-            url = helper.get_url()
-            requests.get(url,
-                         timeout=3,
-                         stream=True,
-                         headers={'Connection': 'close'},
-                         verify=False)
-
-
-    except Exception as e:
-        if url:
+    params.pop('display_name')
+    if params.get('context'):
+        params.pop('context')
+    helper = UrlHelper(callback, params=params)
+    return ('GET', helper.get_url(), {'verify': False})
+
+
+def trigger_callbacks(sender_id, callbacks, yo_id):
+    """Augment the callback URLs and trigger them concurrently.
+
+    Requests go through the pooled callback dispatcher so connections to
+    the same host are reused and hosts that keep failing are skipped until
+    their circuit closes again.
+    """
+
+    calls = []
+    for callback in callbacks:
+        try:
+            calls.append(_build_callback_request(sender_id, callback, yo_id))
+        except Exception as e:
+            log_to_slack(str(e.message))
+
+    if not calls:
+        return
+
+    results = callback_dispatcher.map(calls)
+    for (method, url, _), result in zip(calls, results):
+        if not isinstance(result, Exception):
+            continue
+
+        # The host is already known to be failing and has been reported.
+        if isinstance(result, CircuitOpenError):
+            continue
+
+        if method == 'GET':
             yo = get_yo_by_id(yo_id)
             user = yo.recipient
             body = 'Hi there! We\'ve experienced an issue with the callback URL specified on Yo username:' \
                    '{}.\n' \
                    'The user received a Yo and subsequently we\'ve sent a request to: {}\n' \
-                   'which resulted in the error: {}'.format(user.username, url, str(e.message))
+                   'which resulted in the error: {}'.format(user.username, url, str(result.message))
             sendgrid.send_mail(recipient=user.email,
                                subject='Yo Callback Failure',
                                body=body,
                                sender='api@justyo.co')
             log_to_slack('sent to {}: {}'.format(user.email, body))
         else:
-            log_to_slack(str(e.message))
+            log_to_slack(str(result.message))
+
+
+@async_job(rq=low_rq)
+def trigger_callback(sender_id, callback, yo_id):
+    """Augment the callback URL and trigger it."""
+
+    trigger_callbacks(sender_id, [callback], yo_id)
 
 
 def publish_to_pubsub(yo):
@@ -579,41 +579,77 @@ def ping_live_counter():
         current_app.logger.warning('Live counter not available')
 
 
-def _create_child_yos(yo, recipients):
+def _create_child_yos(yo, recipients, chunk_size=CHILD_YO_CHUNK_SIZE):
     """Creates the child yos for use with broadcasting.
-       Each child yo represents an individual recipient."""
+       Each child yo represents an individual recipient.
+
+       Recipients can be any iterable, e.g. a stream of follower ids. They
+       are consumed and inserted chunk_size at a time so that no more than
+       one chunk of children is held in memory."""
 
-    children = []
+    recipients = iter(recipients)
     recipient_count = 0
-    for i, recipient in enumerate(recipients):
-        recipient_count += 1
-        status = 'pending'
-        # When yos are muted, they come in with a status already provided.
-        if isinstance(recipient, tuple):
-            recipient, status = recipient
-
-        child_yo = Yo(parent=yo,
-                      recipient=recipient,
-                      status=status,
-                      created=get_usec_timestamp(),
-                      is_poll=yo.is_poll,
-                      left_link=yo.left_link,
-                      right_link=yo.right_link,
-                      app_id=yo.app_id)
-        children.append(child_yo)
-
-        if i > 0 and i % YO_BUFFER_MAX == 0:
-            Yo.objects.insert(children, load_bulk=False)
-            children = []
-
-    # Set load_bulk to False so that only ObjectId's are returned
-    # Yo cannot insert an empty list
-    if children:
+    while True:
+        children = []
+        for recipient in islice(recipients, chunk_size):
+            status = 'pending'
+            # When yos are muted, they come in with a status already provided.
+            if isinstance(recipient, tuple):
+                recipient, status = recipient
+
+            child_yo = Yo(parent=yo,
+                          recipient=recipient,
+                          status=status,
+                          created=get_usec_timestamp(),
+                          is_poll=yo.is_poll,
+                          left_link=yo.left_link,
+                          right_link=yo.right_link,
+                          app_id=yo.app_id)
+            children.append(child_yo)
+
+        # Yo cannot insert an empty list
+        if not children:
+            break
+
+        # Set load_bulk to False so that only ObjectId's are returned
         Yo.objects.insert(children, load_bulk=False)
+        recipient_count += len(children)
 
     return recipient_count
 
 
+def _get_link_content_type_key(link):
+    """Returns the redis key holding the content type of a link"""
+    if isinstance(link, unicode):
+        link = link.encode('utf-8')
+    return 'yoapi:link_content_type:%s' % hashlib.sha1(link).hexdigest()
+
+
+def get_link_content_type(link):
+    """Returns the content type of a link, probing it at most once
+
+    Content types are cached in redis so a popular link isn't probed again
+    by every sender. Failed probes are cached as unknown for a shorter
+    time so that broken links are retried eventually.
+    """
+    key = _get_link_content_type_key(link)
+    content_type = redis.get(key)
+    if content_type:
+        return content_type
+
+    config = current_app.config
+    try:
+        content_type = probe_link_content_type(
+            link, timeout=config.get('LINK_CONTENT_TYPE_TIMEOUT'))
+        cache_timeout = config.get('LINK_CONTENT_TYPE_CACHE_TIMEOUT')
+    except RequestException:
+        content_type = 'application/unknown'
+        cache_timeout = config.get('LINK_CONTENT_TYPE_ERROR_TIMEOUT')
+
+    redis.set(key, content_type, cache_timeout)
+    return content_type
+
+
 @async_job(rq=low_rq)
 def send_slack_msg():
     log_to_slack('Yo')
\ No newline at end of file
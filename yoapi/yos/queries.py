@@ -2,70 +2,150 @@
 
 """Yo querying package."""
 
+from collections import OrderedDict
 from itertools import takewhile
 
 from mongoengine import Q, DoesNotExist
-from ..core import cache
+from ..core import cache, redis
 from ..async import async_job
 from ..errors import YoTokenInvalidError
-from ..helpers import get_usec_timestamp
+from ..helpers import get_usec_timestamp, make_memoized_cache_keys
 from ..models import Yo, YoToken, User
+from ..models.user import get_reference_id
 from ..permissions import assert_account_permission
 from ..services import low_rq
-from yoapi.constants.yos import UNREAD_YOS_FETCH_LIMIT
+from yoapi.constants.yos import (UNREAD_YOS_FETCH_LIMIT, CHILD_YO_CHUNK_SIZE,
+                                 UNREAD_YO_STATUSES, UNREAD_INBOX_APP_ID,
+                                 UNREAD_INBOX_SIZE, UNREAD_INBOX_TIMEOUT)
+
+# Member that marks an unread inbox as loaded. Yo scores are creation
+# times so it always sorts first. Its score tells whether the inbox holds
+# every unread yo or only the newest ones because older ones were trimmed.
+UNREAD_INBOX_MARKER = 'complete'
+UNREAD_INBOX_COMPLETE = 0
+UNREAD_INBOX_TRUNCATED = -1
 
 
 @cache.memoize()
-def _get_broadcasts(user_id):
-    """Gets the number of Yo's broadcasted by the user.
+def _get_broadcast_ids(user_id):
+    """Gets the ids of the Yo's broadcasted by the user.
     This has an arbitrary limit of 100 set so that we don't
     cache too much"""
     query = Q(sender=user_id,
               broadcast=True) & (Q(link__exists=True) | Q(photo__exists=True))
-    yos = Yo.objects(query).order_by('-created') \
-                                     .only('id').limit(100)
-    return list(yos)
+    yo_ids = Yo.objects(query).order_by('-created').limit(100).scalar('id')
+    return [str(yo_id) for yo_id in yo_ids]
 
 
 @cache.memoize()
-def _get_favorite_yos(user_id):
-    """Gets the Yo' favorited by the user.
+def _get_favorite_yo_ids(user_id):
+    """Gets the ids of the Yo's favorited by the user.
     This has an arbitrary limit of 100 set so that we don't
     cache too much"""
-    yos = Yo.objects(recipient=user_id,
-                     is_favorite=True).order_by('-created') \
-                                   .only('id').limit(100)
-    return list(yos)
+    yo_ids = Yo.objects(recipient=user_id, is_favorite=True) \
+        .order_by('-created').limit(100).scalar('id')
+    return [str(yo_id) for yo_id in yo_ids]
 
 
-@cache.memoize()
-def _get_unread_yos(user_id, limit, app_id=None):
-    """Gets the Yo' favorited by the user.
-    This has an arbitrary limit of 100 set so that we don't
-    cache too much"""
-    if app_id:
+def _get_unread_inbox_key(user_id, app_id=None):
+    return 'yoapi:unread:%s:%s' % (user_id, app_id or UNREAD_INBOX_APP_ID)
+
+
+def _load_unread_yo_scores(user_id, limit, app_id=None):
+    """Gets the ids and creation times of the Yo's not yet read by the
+    user from mongo"""
+    if app_id and app_id != UNREAD_INBOX_APP_ID:
         yos = Yo.objects(recipient=user_id,
-                         status__in=['sent', 'received'],
+                         status__in=UNREAD_YO_STATUSES,
                          app_id=app_id,
-                         is_push_only__in=[None, False])\
-            .order_by('-created').only('id').limit(limit)
+                         is_push_only__in=[None, False])
     else:
         yos = Yo.objects(recipient=user_id,
-                         status__in=['sent', 'received'],
-                         app_id__in=['co.justyo.yoapp', None],
-                         is_push_only__in=[None, False])\
-            .order_by('-created').only('id').limit(limit)
-    return list(yos)
+                         status__in=UNREAD_YO_STATUSES,
+                         app_id__in=[UNREAD_INBOX_APP_ID, None],
+                         is_push_only__in=[None, False])
+    yos = yos.order_by('-created').limit(limit).scalar('id', 'created')
+    return [(str(yo_id), created or 0) for yo_id, created in yos]
+
+
+def _get_unread_yo_ids(user_id, limit, app_id=None):
+    """Gets the ids of the Yo's not yet read by the user
+
+    The ids are read from the user's unread inbox in redis. An inbox that
+    is missing, or that was trimmed and no longer holds limit yos, is
+    rebuilt from mongo first.
+    """
+    if limit > UNREAD_INBOX_SIZE:
+        yo_scores = _load_unread_yo_scores(user_id, limit, app_id)
+        return [yo_id for yo_id, _ in yo_scores]
+
+    key = _get_unread_inbox_key(user_id, app_id)
+    pipe = redis.pipeline(transaction=False)
+    pipe.zscore(key, UNREAD_INBOX_MARKER)
+    pipe.zrevrangebyscore(key, '+inf', '(0', start=0, num=limit)
+    state, yo_ids = pipe.execute()
+    if state == UNREAD_INBOX_COMPLETE:
+        return yo_ids
+    if state == UNREAD_INBOX_TRUNCATED and len(yo_ids) >= limit:
+        return yo_ids
+
+    # Yos pushed while the inbox is rebuilt are kept since nothing is
+    # removed here.
+    yo_scores = _load_unread_yo_scores(user_id, UNREAD_INBOX_SIZE, app_id)
+    scores = dict(yo_scores)
+    if len(yo_scores) < UNREAD_INBOX_SIZE:
+        scores[UNREAD_INBOX_MARKER] = UNREAD_INBOX_COMPLETE
+    else:
+        scores[UNREAD_INBOX_MARKER] = UNREAD_INBOX_TRUNCATED
+    pipe = redis.pipeline(transaction=False)
+    pipe.zadd(key, **scores)
+    pipe.expire(key, UNREAD_INBOX_TIMEOUT)
+    pipe.execute()
+    return [yo_id for yo_id, _ in yo_scores[:limit]]
+
+
+def add_unread_yo(yo):
+    """Adds a yo to its recipient's unread inbox
+
+    Only the newest UNREAD_INBOX_SIZE yos are kept. The marker has the
+    lowest rank so it is never trimmed, but once yos are trimmed it marks
+    the inbox as truncated.
+    """
+    if not yo.recipient or yo.is_push_only:
+        return
+
+    key = _get_unread_inbox_key(get_reference_id(yo.recipient), yo.app_id)
+    pipe = redis.pipeline(transaction=False)
+    pipe.zadd(key, **{yo.yo_id: yo.created or get_usec_timestamp()})
+    pipe.zscore(key, UNREAD_INBOX_MARKER)
+    pipe.zremrangebyrank(key, 1, -(UNREAD_INBOX_SIZE + 1))
+    pipe.expire(key, UNREAD_INBOX_TIMEOUT)
+    _, state, trimmed, _ = pipe.execute()
+    if trimmed and state == UNREAD_INBOX_COMPLETE:
+        redis.zadd(key, **{UNREAD_INBOX_MARKER: UNREAD_INBOX_TRUNCATED})
+
+
+def remove_unread_yo(yo):
+    """Removes a yo from its recipient's unread inbox"""
+    if not yo.recipient:
+        return
+
+    key = _get_unread_inbox_key(get_reference_id(yo.recipient), yo.app_id)
+    redis.zrem(key, yo.yo_id)
 
 
 def clear_get_favorite_yos_cache(user_id):
     """Clears the _get_favories cache"""
-    cache.delete_memoized(_get_favorite_yos, user_id)
+    cache.delete_memoized(_get_favorite_yo_ids, user_id)
 
 
 def clear_get_unread_yos_cache(user_id, limit, app_id=None):
-    """Clears the get_unread_yos results cache"""
-    cache.delete_memoized(_get_unread_yos, user_id, limit, app_id)
+    """Drops the unread inbox so that it is rebuilt from mongo
+
+    Use this after changing the status of yos directly in mongo. The limit
+    is ignored since the inbox holds every limit.
+    """
+    redis.delete(_get_unread_inbox_key(user_id, app_id))
 
 
 def clear_get_yo_cache(yo_id):
@@ -90,7 +170,7 @@ def clear_get_yos_received_cache(user):
 
 def clear_get_yos_sent_cache(user):
     """Clears the _get_broadcasts and get_yos_sent results cache"""
-    cache.delete_memoized(_get_broadcasts, user.user_id)
+    cache.delete_memoized(_get_broadcast_ids, user.user_id)
     cache.delete_memoized(get_yos_sent, user)
 
 def clear_all_yos_caches(user):
@@ -134,9 +214,8 @@ def get_broadcasts(user, limit=20, ignore_permission=False):
     """Gets the number of Yo's broadcasted by the user"""
     if not ignore_permission:
         assert_account_permission(user, 'No permission to see Yo\'s')
-    yos = _get_broadcasts(user.user_id)
-    yos = [get_yo_by_id(yo.yo_id) for i, yo in enumerate(yos) if i < limit]
-    return yos
+    yo_ids = _get_broadcast_ids(user.user_id)[:limit]
+    return get_yos_by_ids(yo_ids)
 
 
 def get_child_yos(parent_yo_id):
@@ -145,13 +224,35 @@ def get_child_yos(parent_yo_id):
     return yos
 
 
+def iter_child_yo_recipient_ids(parent_yo_id, chunk_size=CHILD_YO_CHUNK_SIZE):
+    """Yields lists of (yo id, recipient id) pairs for the child yos
+
+    Only the ids are read from the cursor so that the children of a
+    broadcast can be walked in bounded memory regardless of its size.
+    """
+    yos = Yo.objects(parent=parent_yo_id).only('id', 'recipient') \
+        .as_pymongo().batch_size(chunk_size)
+
+    chunk = []
+    for yo in yos:
+        if not yo.get('recipient'):
+            continue
+
+        chunk.append((str(yo['_id']), get_reference_id(yo['recipient'])))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
 def get_favorite_yos(user, limit=20, ignore_permission=False):
     """Gets the Yo's favorited by the user"""
     if not ignore_permission:
         assert_account_permission(user, 'No permission to see Yo\'s')
-    yos = _get_favorite_yos(user.user_id)
-    yos = [get_yo_by_id(yo.yo_id) for i, yo in enumerate(yos) if i < limit]
-    return yos
+    yo_ids = _get_favorite_yo_ids(user.user_id)[:limit]
+    return get_yos_by_ids(yo_ids)
 
 
 def get_last_broadcast(user, ignore_permission=False):
@@ -167,14 +268,10 @@ def get_unread_yos(user, limit=20, age_limit=None, app_id=None, ignore_permissio
     """Gets Yo's not yet read by the user"""
     if not ignore_permission:
         assert_account_permission(user, 'No permission to see Yo\'s')
-    yos = _get_unread_yos(user.user_id, limit, app_id)
-    fetched = []
-    for yo in yos:
-        try:
-            reloaded = get_yo_by_id(yo.yo_id)
-            fetched.append(reloaded)
-        except:
-            continue
+    yo_ids = _get_unread_yo_ids(user.user_id, limit, app_id)
+    # Yos read through paths that don't update the inbox are left out.
+    fetched = [yo for yo in get_yos_by_ids(yo_ids)
+               if yo.status in UNREAD_YO_STATUSES]
     if age_limit:
         cuttoff_usec = get_usec_timestamp(age_limit)
         cmp_func = lambda yo: yo.created and yo.created - cuttoff_usec >= 0
@@ -187,8 +284,9 @@ def get_unread_polls(user, limit=20, age_limit=None, ignore_permission=False):
     """Gets Yo's not yet read by the user"""
     if not ignore_permission:
         assert_account_permission(user, 'No permission to see Yo\'s')
-    yos = _get_unread_yos(user.user_id, limit, app_id='co.justyo.yopolls')
-    yos = [get_yo_by_id(yo.yo_id) for yo in yos]
+    yo_ids = _get_unread_yo_ids(user.user_id, limit, app_id='co.justyo.yopolls')
+    yos = [yo for yo in get_yos_by_ids(yo_ids)
+           if yo.status in UNREAD_YO_STATUSES]
     if age_limit:
         cuttoff_usec = get_usec_timestamp(age_limit)
         cmp_func = lambda yo: yo.created and yo.created - cuttoff_usec >= 0
@@ -234,6 +332,42 @@ def get_yo_by_id(yo_id):
     return Yo.objects(id=yo_id).get()
 
 
+def get_yos_by_ids(yo_ids):
+    """Gets many yos through the get_yo_by_id cache in input order
+
+    The memoize version of get_yo_by_id is read once and the cache with a
+    single MGET. Yos missing from it are loaded with one `$in` query and
+    written back in one pipeline under the keys get_yo_by_id uses. Ids
+    without a yo are left out.
+    """
+    yo_ids = [str(yo_id) for yo_id in yo_ids]
+    unique_ids = list(OrderedDict.fromkeys(yo_ids))
+    if not unique_ids:
+        return []
+
+    cache_keys = make_memoized_cache_keys(cache, get_yo_by_id, unique_ids)
+    yos = {}
+    missing = {}
+    for yo_id, cache_key, yo in zip(unique_ids, cache_keys,
+                                    cache.cache.get_many(*cache_keys)):
+        if isinstance(yo, Yo):
+            yos[yo_id] = yo
+        else:
+            missing[yo_id] = cache_key
+
+    if missing:
+        backfill = {}
+        for yo in Yo.objects(id__in=missing.keys()):
+            yos[yo.yo_id] = yo
+            backfill[missing[yo.yo_id]] = yo
+
+        if backfill:
+            # set_many writes every key in a single redis pipeline.
+            cache.cache.set_many(backfill)
+
+    return [yos[yo_id] for yo_id in yo_ids if yo_id in yos]
+
+
 @cache.memoize()
 def get_yo_count(user):
     """Gets the number of Yo's received by the user"""
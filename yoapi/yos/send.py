@@ -2,47 +2,52 @@
 
 """Yo sending package."""
 
+import hashlib
 import sys
-from uuid import uuid4
+from itertools import chain
 import cStringIO
 from datetime import timedelta
 
 import gevent
 from flask import current_app, request, g
-from haversine import haversine
 from mongoengine import DoesNotExist
-from pygeocoder import GeocoderError
 import requests
-from requests.exceptions import RequestException
 from .helpers import (_create_child_yos, assert_valid_yo_token,
-                      construct_yo, increment_count_out, increment_count_in,
-                      trigger_callback, publish_to_pubsub, acknowledge_yo_received)
-from .queries import (clear_get_unread_yos_cache, clear_get_yo_cache,
+                      construct_yo, get_link_content_type,
+                      trigger_callback, trigger_callbacks, publish_to_pubsub,
+                      acknowledge_yo_received)
+from .queries import (add_unread_yo, clear_get_yo_cache,
                       clear_get_yos_received_cache, clear_get_yos_sent_cache,
                       get_child_yos, get_last_broadcast,
-                      get_yo_by_id)
+                      get_yo_by_id, iter_child_yo_recipient_ids)
 from ..ab_test import log_ab_test_data
-from ..accounts import get_user, update_user
+from ..accounts import (get_users_by_usernames, update_user,
+                        update_user_activity, UserActivityBatch)
 from ..async import async_job
+from ..constants.context import VALID_CONTEXT_IDS
 from ..constants.yos import *
-from ..contacts import get_followers, upsert_contact, get_contact_pair
-from ..core import geocoder, parse, s3, log_to_slack
+from ..contacts import (iter_follower_ids, upsert_contact, get_contact_pair,
+                        is_blocked)
+from ..core import geocoder, parse, s3, log_to_slack, redis
 from ..datauri import DataURI
 from ..errors import APIError
 from ..groups import (get_group_followers, fix_old_group,
                       get_group_contacts)
 from ..headers import get_header_by_id
 from ..helpers import (partition_list, get_usec_timestamp,
-                       copy_current_request_context, get_link_content_type)
+                       copy_current_request_context)
+from ..localization import get_location_city, is_in_region
 from ..models import User, Yo, NotificationEndpoint
 from ..notification_endpoints import get_user_endpoints, IOS, IOSBETA
 from ..notifications import _push_to_endpoint, _send_notification_to_user, send_command_add_response
 from ..security import load_identity
 from ..urltools import UrlHelper
-from ..models.payload import YoPayload
+from ..models.payload import PayloadCache, YoPayload
+from ..models.user import get_reference_id
 from yoapi.constants.emojis import EMOJI_TO_PNG
 from yoapi.constants.sns import APP_ID_TO_ARN_IDS
-from yoapi.helpers import generate_thumbnail_from_url, generate_thumbnail_from_image
+from yoapi.helpers import (generate_thumbnail_from_url,
+                           generate_thumbnail_from_image, get_image_url)
 from yoapi.models.integration import Integration
 from yoapi.models.notification_endpoint import IOSDEV
 from yoapi.services import low_rq, medium_rq
@@ -108,33 +113,97 @@ def _push_to_recipient(yo_id, protocol='sns', add_response_acked=False):
         raise APIError('Job terminated because Yo has been deleted',
                        status_code=404)
 
+    return _push_yo_to_recipient(yo, protocol=protocol)
+
+
+@async_job(rq=low_rq)
+def _push_to_recipient_batch(yo_ids, protocol='sns'):
+    """Pushes a slice of child yos to their recipients in a single job
+
+    Broadcasts used to enqueue one job per child yo, which meant one
+    enqueue, one pickle and one request context per recipient. Loading the
+    whole slice with a single query and looping here keeps that overhead
+    proportional to the number of batches instead.
+
+    Children that fail are queued again as jobs of their own, so they are
+    retried and end up in the failed queue like they used to without
+    pushing the rest of the batch twice.
+    """
+
+    yos = Yo.objects(id__in=yo_ids).select_related()
+    payload_cache = PayloadCache()
+    user_activity = UserActivityBatch()
+    results = {}
+    failed_yo_ids = []
+    try:
+        for yo in yos:
+            # A single bad recipient should not abort the rest of the batch.
+            try:
+                results[yo.yo_id] = _push_yo_to_recipient(
+                    yo, protocol=protocol, payload_cache=payload_cache,
+                    user_activity=user_activity)
+            except Exception:
+                current_app.log_exception(sys.exc_info())
+                failed_yo_ids.append(yo.yo_id)
+    finally:
+        # Recipient counters and timestamps are written in bulk.
+        user_activity.flush()
+
+    for yo_id in failed_yo_ids:
+        _push_to_recipient.delay(yo_id, protocol=protocol)
+
+    return results
+
+
+def _push_yo_to_recipient(yo, protocol='sns', payload_cache=None,
+                          user_activity=None):
+    """Performs the push of an already loaded child yo to its recipient
+
+    Counter and timestamp updates for the recipient are added to
+    user_activity, or written as soon as the push is done without one.
+    """
+    if user_activity is not None:
+        return _deliver_yo_to_recipient(yo, protocol, payload_cache,
+                                        user_activity)
+
+    user_activity = UserActivityBatch()
+    try:
+        return _deliver_yo_to_recipient(yo, protocol, payload_cache,
+                                        user_activity)
+    finally:
+        user_activity.flush()
+
+
+def _deliver_yo_to_recipient(yo, protocol, payload_cache, user_activity):
+    if payload_cache is None:
+        payload_cache = PayloadCache()
+
     flattened_yo = yo.get_flattened_yo()
 
     # Get the sender from the parent.
     sender = flattened_yo.sender
 
-    if yo.recipient.has_blocked(sender):
-        return 'Yo canceled because sender has been blocked'
-
-    if yo.recipient.has_blocked(sender):
+    # The recipient may come from a cached copy so check the blocked ids in
+    # redis, which are updated as soon as someone is blocked.
+    if is_blocked(yo.recipient, sender):
         return 'Yo canceled because sender has been blocked'
 
-    if yo.region:
+    # The region is read from the process-local bounds instead of being
+    # dereferenced for every recipient.
+    region_id = yo._data.get('region')
+    if region_id:
         if yo.recipient.latitude and yo.recipient.longitude:
             user_location = (yo.recipient.latitude, yo.recipient.longitude)
-            region_center = (yo.region.latitude, yo.region.longitude)
-            distance = haversine(user_location,
-                                 region_center,
-                                 miles=True)
-            if distance > yo.region.radius:
+            if not is_in_region(get_reference_id(region_id), user_location):
                 return 'Yo canceled because recipient is not in region'
 
     # Increment the count_in for the recipient.
     if not flattened_yo.broadcast:
-        increment_count_in(yo.recipient)
+        user_activity.add(yo.recipient, counters={'count_in': 1})
         clear_get_yos_received_cache(yo.recipient)
 
-    clear_get_unread_yos_cache(yo.recipient.user_id, UNREAD_YOS_FETCH_LIMIT)
+    # The yo is marked as sent below, or already is when muted.
+    add_unread_yo(yo)
 
     # Don't send yos already marked as 'sent'.
     # This would most likely mean the yo was muted.
@@ -249,11 +318,10 @@ def _push_to_recipient(yo_id, protocol='sns', add_response_acked=False):
             #if yo.recipient and yo.recipient.is_beta_tester:
             #    log_to_slack('Sending to endpoint: ' + str(endpoint.id))
 
-            payload = YoPayload(yo, endpoint.get_payload_support_dict(),
-                                log_enrolled=bool(i == 0))
+            sns_message = payload_cache.get_sns_message(
+                yo, endpoint, log_enrolled=bool(i == 0))
 
-            _push_to_endpoint(endpoint.arn,
-                              sns_message=payload.to_sns(endpoint))
+            _push_to_endpoint(endpoint.arn, sns_message=sns_message)
 
         #if yo.recipient and yo.recipient.is_beta_tester:
         #    log_to_slack('Marking Yo as send')
@@ -269,10 +337,9 @@ def _push_to_recipient(yo_id, protocol='sns', add_response_acked=False):
         # Update the user last in case it fails.
         # NOTE: APIErrors are not retried.
         if yo.recipient:
-            update_user(yo.recipient, last_yo_time=get_usec_timestamp(),
-                        ignore_permission=True)
-            update_user(yo.recipient, last_received_time=get_usec_timestamp(),
-                        ignore_permission=True)
+            now = get_usec_timestamp()
+            user_activity.add(yo.recipient, last_yo_time=now,
+                              last_received_time=now)
 
 
 @async_job(rq=low_rq)
@@ -292,46 +359,27 @@ def _apply_callback(yo_id):
     if yo.recipient:
         publish_to_pubsub(yo)
 
-    # Trigger callback.
+    # Trigger callbacks.
     if yo.should_trigger_callback():
 
+        callback_user = None
         if yo.recipient:
-            if yo.recipient.callback:
-                trigger_callback(sender.id,
-                                 yo.recipient.callback,
-                                 yo_id)
-
-            if yo.recipient.callbacks:
-                for callback_url in yo.recipient.callbacks:
-                    trigger_callback(sender.id,
-                                 callback_url,
-                                 yo_id)
-
+            callback_user = yo.recipient
         elif yo.reply_to:
-
             if yo.reply_to.parent:
-
-                if yo.reply_to.parent.sender.callback:
-                    trigger_callback(sender.id,
-                                     yo.reply_to.parent.sender.callback,
-                                     yo_id)
-
-                if yo.reply_to.parent.sender.callbacks:
-                    for callback_url in yo.reply_to.parent.sender.callbacks:
-                        trigger_callback(sender.id,
-                                         callback_url,
-                                         yo_id)
+                callback_user = yo.reply_to.parent.sender
             else:
-                if yo.reply_to.sender.callback:
-                    trigger_callback(sender.id,
-                                     yo.reply_to.sender.callback,
-                                     yo_id)
+                callback_user = yo.reply_to.sender
+
+        if callback_user:
+            callbacks = []
+            if callback_user.callback:
+                callbacks.append(callback_user.callback)
+            if callback_user.callbacks:
+                callbacks.extend(callback_user.callbacks)
 
-                if yo.reply_to.sender.callbacks:
-                    for callback_url in yo.reply_to.sender.callbacks:
-                        trigger_callback(sender.id,
-                                         callback_url,
-                                         yo_id)
+            if callbacks:
+                trigger_callbacks(sender.id, callbacks, yo_id)
 
     try:
         if yo.should_trigger_oauth_callback():
@@ -418,7 +466,6 @@ def _push_to_recipients(parent_yo_id):
     """Pushes Yo's to a list of recipients"""
 
     parent_yo = get_yo_by_id(parent_yo_id)
-    yos = get_child_yos(parent_yo.yo_id)
     # Any broadcasts with a recipient count lower than this cutoff will be sent
     # through the regular worker channel.
     queue_lbound = current_app.config.get('SEPARATE_QUEUE_LBOUND', 500)
@@ -433,10 +480,10 @@ def _push_to_recipients(parent_yo_id):
         custom_queue = None
 
     # Apply the custom queue decorator
-    __push_to_recipient = _push_to_recipient.original_func
+    __push_to_recipient_batch = _push_to_recipient_batch.original_func
     __push_to_recipient_partition = _push_to_recipient_partition.original_func
     custom_async_job = async_job(rq=low_rq, custom_queue=custom_queue)
-    push_to_recipient_custom = custom_async_job(__push_to_recipient)
+    push_to_batch_custom = custom_async_job(__push_to_recipient_batch)
     push_to_partition_custom = custom_async_job(__push_to_recipient_partition)
 
     # Send the Yo to SNS and parse.
@@ -444,7 +491,7 @@ def _push_to_recipients(parent_yo_id):
     # won't be retried.
 
     queuing_pool = gevent.pool.Pool(QUEUING_WORKERS)
-    recipients = []
+    batches = {'sns': [], 'sms': []}
 
     def push_to_partition_worker(parent_yo, partition):
         """Queues parse recipient partitions in parallel"""
@@ -453,18 +500,16 @@ def _push_to_recipients(parent_yo_id):
         except Exception as err:
             current_app.log_exception(sys.exc_info())
 
-    def push_to_recipient_worker(yo, protocol='sns'):
-        """Pulls Yo's from the iterator in parallel to speed up queuing.
-        Uses a lock to ensure there are no cursor collisions"""
+    def push_to_batch_worker(yo_ids, protocol='sns'):
+        """Queues batches of child yos in parallel to speed up queuing."""
 
         try:
-            push_to_recipient_custom.delay(yo.yo_id,
-                                           protocol=protocol)
+            push_to_batch_custom.delay(yo_ids, protocol=protocol)
         except Exception as err:
             current_app.log_exception(sys.exc_info())
 
     # Get the first yo or an empty array.
-    test_child_yo = yos[0:1]
+    test_child_yo = get_child_yos(parent_yo.yo_id)[0:1]
     if test_child_yo:
         support_dict = NotificationEndpoint.perfect_payload_support_dict()
         payload = YoPayload(test_child_yo[0], support_dict)
@@ -497,40 +542,124 @@ def _push_to_recipients(parent_yo_id):
                       'broadcast': bool(parent_yo.broadcast)}
         current_app.log_analytics(event_data)
 
-    # continue queuing until no yos are available.
-    for yo in yos:
-        # Skip yos where the recipient is no longer valid.
-        if yo.has_dbrefs():
-            continue
+    # The children are read back in chunks of ids and their recipients are
+    # resolved with one query per chunk, so memory stays bounded no matter
+    # how many followers the sender has.
+    sender_id = parent_yo.sender.pk
+    for chunk in iter_child_yo_recipient_ids(parent_yo.yo_id):
+        recipient_ids = [recipient_id for _, recipient_id in chunk]
+        users = User.objects(id__in=recipient_ids) \
+            .only('id', 'is_pseudo').as_pymongo()
+        is_pseudo = dict((user['_id'], bool(user.get('is_pseudo')))
+                         for user in users)
 
-        # Dont send to sender for group yos.
-        if parent_yo.is_group_yo and yo.recipient == parent_yo.sender:
-            continue
+        recipients = []
+        for yo_id, recipient_id in chunk:
+            # Skip yos where the recipient is no longer valid.
+            if recipient_id not in is_pseudo:
+                continue
 
-        # build the recipients array for parse.
-        protocol = 'sms'
-        if not yo.recipient.is_pseudo:
-            protocol = 'sns'
-            recipients.append(yo.recipient.user_id)
+            # Dont send to sender for group yos.
+            if parent_yo.is_group_yo and recipient_id == sender_id:
+                continue
 
-        wrapped_worker = copy_current_request_context(push_to_recipient_worker)
-        queuing_pool.spawn(wrapped_worker, yo, protocol)
+            # build the recipients array for parse.
+            protocol = 'sms'
+            if not is_pseudo[recipient_id]:
+                protocol = 'sns'
+                recipients.append(str(recipient_id))
+
+            # Queue a batch as soon as it is full so that pushing starts
+            # while the remaining children are still being iterated.
+            batch = batches[protocol]
+            batch.append(yo_id)
+            if len(batch) >= PUSH_BATCH_SIZE:
+                wrapped_worker = copy_current_request_context(
+                    push_to_batch_worker)
+                queuing_pool.spawn(wrapped_worker, batch, protocol)
+                batches[protocol] = []
+
+        # Flush the partly filled batches of the chunk and wait for every
+        # batch to be queued, since the parse partitions mark the children
+        # as sent and would otherwise mute the pushes still waiting.
+        for protocol, batch in batches.items():
+            if batch:
+                wrapped_worker = copy_current_request_context(
+                    push_to_batch_worker)
+                queuing_pool.spawn(wrapped_worker, batch, protocol)
+                batches[protocol] = []
+        queuing_pool.join()
 
-    # Do not push if there aren't any recipients.
-    if recipients:
         # Always push to parse because push registration for android was
         # previously handled on the device.
-        # Always push to parse last so that the yo can be mutated.
+        # Always push to parse after the batches of the chunk so that the yo
+        # can be mutated.
         # Since parse is being deprecated always push in bulk.
-        follower_partitions = partition_list(recipients, PARTITION_SIZE)
-        for partition in follower_partitions:
-            wrapped_worker = copy_current_request_context(push_to_partition_worker)
+        for partition in partition_list(recipients, PARTITION_SIZE):
+            wrapped_worker = copy_current_request_context(
+                push_to_partition_worker)
             queuing_pool.spawn(wrapped_worker, parent_yo, partition)
 
     queuing_pool.join()
 
 
+def _get_thumbnail_filename(url):
+    """Returns the s3 filename of the thumbnail of an image url"""
+    if isinstance(url, unicode):
+        url = url.encode('utf-8')
+    return 'thumbnails/%s.png' % hashlib.sha1(url).hexdigest()
+
+
+def _get_thumbnail_cache_key(filename):
+    return 'yoapi:thumbnail:%s' % filename
+
+
+def _get_thumbnail_source_url(yo):
+    """Returns the url of the image a yo is thumbnailed from, if any"""
+    content_type = yo.link_content_type or ''
+    if 'video' in content_type or 'gif' in content_type:
+        return None
+
+    if yo.photo:
+        return yo.photo.make_full_url()
+
+    if yo.link and content_type.startswith('image'):
+        return yo.link
+
+
+def _has_link_preview(yo):
+    """Returns True if the thumbnail of a yo is rendered by url2png"""
+    content_type = yo.link_content_type or ''
+    return bool(yo.link and not yo.photo and 'video' not in content_type and
+                not content_type.startswith('image'))
+
+
+def upload_thumbnail(url):
+    """Thumbnails an image and uploads it to s3 unless already done
+
+    The thumbnail is stored under a hash of the image url so a link sent
+    by many users is only downloaded and uploaded once.
+    """
+    filename = _get_thumbnail_filename(url)
+    cache_key = _get_thumbnail_cache_key(filename)
+    if redis.get(cache_key):
+        return get_image_url(filename)
+
+    response = requests.get(url, timeout=THUMBNAIL_DOWNLOAD_TIMEOUT)
+    response.raise_for_status()
+    file = cStringIO.StringIO(response.content)
+    thumbnail_data = generate_thumbnail_from_image(file)
+    thumbnail_url = s3.upload_image(filename, thumbnail_data)
+    redis.set(cache_key, 1, THUMBNAIL_CACHE_TIMEOUT)
+    return thumbnail_url
+
+
 def generate_thumbnail_url(yo):
+    """Returns the thumbnail url of a yo without making any requests
+
+    Images that have not been thumbnailed before return None. They are
+    rendered by generate_yo_thumbnail after the yo is sent.
+    """
     thumbnail_url = None
 
     if yo.link or yo.photo:
@@ -543,12 +672,10 @@ def generate_thumbnail_url(yo):
             if 'gif' in yo.link_content_type:
                 thumbnail_url = yo.link
             else:
-                url = yo.photo.make_full_url() if yo.photo else yo.link
-                response = requests.get(url)
-                file = cStringIO.StringIO(response.content)
-                thumbnail_data = generate_thumbnail_from_image(file)
-                filename = str(str(uuid4())[:32] + '.png')
-                thumbnail_url = s3.upload_image(filename, thumbnail_data)
+                filename = _get_thumbnail_filename(
+                    _get_thumbnail_source_url(yo))
+                if redis.get(_get_thumbnail_cache_key(filename)):
+                    thumbnail_url = get_image_url(filename)
 
         else:
             thumbnail_url = generate_thumbnail_from_url(yo.link)
@@ -569,20 +696,50 @@ def generate_thumbnail_url(yo):
     return thumbnail_url
 
 
+@async_job(rq=low_rq)
+def generate_yo_thumbnail(yo_id):
+    """Renders the thumbnail of a yo after it has been sent
+
+    Images are thumbnailed and uploaded, and link previews are loaded once
+    so that url2png renders them.
+    """
+    yo = get_yo_by_id(yo_id)
+    if _has_link_preview(yo):
+        if yo.thumbnail_url:
+            requests.get(yo.thumbnail_url, timeout=THUMBNAIL_DOWNLOAD_TIMEOUT)
+        return
+
+    source_url = _get_thumbnail_source_url(yo)
+    if not source_url:
+        return
+
+    thumbnail_url = upload_thumbnail(source_url)
+    if thumbnail_url != yo.thumbnail_url:
+        Yo.objects(id=yo.id).update(set__thumbnail_url=thumbnail_url)
+        clear_get_yo_cache(yo.yo_id)
+
+
 @async_job(rq=low_rq)
 def _send_yo(yo_id=None, recipient_ids=None,
-             reply_to=None):
+             reply_to=None, count_out=False):
     """Either sends or broadcasts a Yo
 
     This function can either be delayed and relayed to a background
-    worker or executed synchronously.
+    worker or executed synchronously. Set count_out to also increment the
+    sender's count_out with the same write as last_sent_time.
     """
     # pylint: disable=invalid-name
     yo = get_yo_by_id(yo_id)
     ten_min_ago = get_usec_timestamp(timedelta(minutes=-10))
 
-    update_user(yo.sender, last_sent_time=get_usec_timestamp(),
-                ignore_permission=True)
+    activity = {'last_sent_time': get_usec_timestamp()}
+    # Remember when each context was last used for the compose screen.
+    if yo.context_id in VALID_CONTEXT_IDS:
+        activity['context_times.%s' % yo.context_id] = \
+            activity['last_sent_time']
+    update_user_activity(yo.sender,
+                         counters={'count_out': 1} if count_out else None,
+                         **activity)
 
     if reply_to:
         acknowledge_yo_received(reply_to, status='read', from_push=False)
@@ -591,14 +748,14 @@ def _send_yo(yo_id=None, recipient_ids=None,
         yo.reply_to = Yo(id=str(yo.reply_to.parent.id))
         reply_to = yo.reply_to
 
+    # Probe the link while the rest of the yo is prepared. The thumbnail
+    # depends on the content type so the probe is joined before it.
+    link_probe = None
     if yo.link and yo.link_content_type is None:
-        try:
-            yo.link_content_type = get_link_content_type(yo.link)
+        def probe_link():
+            return get_link_content_type(yo.link)
 
-        except RequestException as err:
-            yo.link_content_type = 'application/unknown'
-            # Instead of making assumptions about
-            # why an error occurred here, let these through
+        link_probe = gevent.spawn(copy_current_request_context(probe_link))
 
     image = yo.photo or yo.cover
     if image and not image.yo:
@@ -619,11 +776,13 @@ def _send_yo(yo_id=None, recipient_ids=None,
     if yo.status == 'started':
         yo.status = 'sending'
 
-    # If this is a broadcast attach the recipients from get_followers.
+    # If this is a broadcast attach the recipients from the follower ids.
     # If the recipient_count has already been populated or the
     # recipient_ids have been supplied, do not use the followers.
+    # The ids are streamed in chunks so big accounts are never fully
+    # loaded into memory.
     if yo.broadcast and yo.recipient_count is None and recipient_ids is None:
-        recipient_ids = get_followers(yo.sender)
+        recipient_ids = chain.from_iterable(iter_follower_ids(yo.sender))
 
     elif yo.is_group_yo and yo.recipient and yo.recipient.is_group:
         group = yo.recipient
@@ -661,13 +820,8 @@ def _send_yo(yo_id=None, recipient_ids=None,
 
     if yo.location and not (yo.location_city or yo.header):
         try:
-            location = yo.location
-            formatted_addresses = geocoder.reverse_geocode(location[0],
-                                                           location[1])
-            if formatted_addresses.count == 0:
-                raise GeocoderError('Invalid count')
-
-            yo.location_city = formatted_addresses[0].city or None
+            yo.location_city = get_location_city(yo.location[0],
+                                                 yo.location[1])
         except Exception as err:
             pass
             """
@@ -678,6 +832,12 @@ def _send_yo(yo_id=None, recipient_ids=None,
                 current_app.log_exception(sys.exc_info())
             """
 
+    if link_probe:
+        # A probe that is still running is left to finish so that its
+        # result is cached for the next sender.
+        link_probe.join(current_app.config.get('LINK_CONTENT_TYPE_TIMEOUT'))
+        yo.link_content_type = link_probe.value or 'application/unknown'
+
     try:
         yo.thumbnail_url = generate_thumbnail_url(yo)
     except:
@@ -738,6 +898,12 @@ def _send_yo(yo_id=None, recipient_ids=None,
                       'broadcast': False}
         current_app.log_analytics(event_data)
 
+    # Thumbnails that need requests to third parties are rendered after
+    # the push has gone out. The yo is updated when they are ready.
+    if ((_get_thumbnail_source_url(yo) and not yo.thumbnail_url) or
+            _has_link_preview(yo)):
+        generate_yo_thumbnail.delay(yo.yo_id)
+
     if yo.context_id:
         log_ab_test_data(yo.sender, 'context', context_id=yo.context_id)
 
@@ -791,13 +957,16 @@ def send_yo(sender=None, recipients=None, sound=None, link=None,
     if recipient_usernames:
         recipient_username_set = set()
         recipients = []
+        recipient_users = get_users_by_usernames(recipient_usernames)
         for recipient_username in recipient_usernames:
             # Don't allow duplicates.
             if recipient_username.upper() in recipient_username_set:
                 continue
 
-            # Get user will error if the user is not found.
-            recipient = get_user(username=recipient_username)
+            recipient = recipient_users.get(str(recipient_username).upper())
+            if recipient is None:
+                raise APIError('No user found', status_code=404, code=404)
+
             if recipient.is_pseudo and recipient.migrated_to:
                 recipient = recipient.migrated_to
 
@@ -875,7 +1044,6 @@ def send_yo(sender=None, recipients=None, sound=None, link=None,
                       app_id=app_id, is_push_only=is_push_only,
                       ignore_permission=ignore_permission)
 
-    increment_count_out(yo.sender)
     clear_get_yos_sent_cache(yo.sender)
 
     if recipients:
@@ -883,15 +1051,20 @@ def send_yo(sender=None, recipients=None, sound=None, link=None,
     else:
         recipient_ids = None
 
-    if not disable_send:
-        if not broadcast and len(recipient_ids) == 1:
-            _send_yo(yo_id=yo.yo_id,
-                     recipient_ids=recipient_ids,
-                     reply_to=reply_to)
-        else:
-            _send_yo.delay(yo_id=yo.yo_id,
-                           recipient_ids=recipient_ids,
-                           reply_to=reply_to)
+    # The count_out is incremented together with last_sent_time when the
+    # yo is sent.
+    if disable_send:
+        update_user_activity(yo.sender, counters={'count_out': 1})
+    elif not broadcast and len(recipient_ids) == 1:
+        _send_yo(yo_id=yo.yo_id,
+                 recipient_ids=recipient_ids,
+                 reply_to=reply_to,
+                 count_out=True)
+    else:
+        _send_yo.delay(yo_id=yo.yo_id,
+                       recipient_ids=recipient_ids,
+                       reply_to=reply_to,
+                       count_out=True)
 
     _apply_callback.delay(yo.yo_id)
 